@@ -1,39 +1,157 @@
+import json
+import threading
+import time
+import traceback
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
+from astropy.time import Time
 from bokeh.embed import server_document
-from flask import Flask, render_template
+from flask import Flask, abort, jsonify, render_template, request
 
 from lib.astronomical_events import generate_astronomical_events
+from plotting import metrics
+from plotting.settings import (
+    ASTRONOMICAL_EVENTS_NIGHTS,
+    FIGURE_ERROR_RETRY_SECONDS,
+    NIGHT,
+)
 
 app = Flask(__name__)
 worker_pool = ThreadPoolExecutor(4)
-astronomical_events = None
+# The futures computing the astronomical events, by night MJD, least recently
+# used first, and the times at which those that failed did so.
+astronomical_events = OrderedDict()
+astronomical_event_errors = dict()
+astronomical_events_lock = threading.Lock()
 
 
-def _set_astronomical_events():
-    global astronomical_events
-    astronomical_events = generate_astronomical_events()
+def astronomical_events_generated(night, future):
+    """Record the time at which the astronomical events of a night failed
+    to be generated, if they did."""
+    error = future.exception()
+    if error is None:
+        return
+    print(f"Generating the astronomical events of {night.iso[:10]} failed: {error}")
+    traceback.print_exception(type(error), error, error.__traceback__)
+    with astronomical_events_lock:
+        if astronomical_events.get(night.mjd) is future:
+            astronomical_event_errors[night.mjd] = time.monotonic()
 
 
-# Generate the astronomical events
-worker_pool.submit(_set_astronomical_events)
+def get_astronomical_events(night):
+    """Return the astronomical events of a night, or None if they are still
+    being computed (or failed to be, in which case they are computed again
+    once FIGURE_ERROR_RETRY_SECONDS have passed)."""
+    with astronomical_events_lock:
+        error_time = astronomical_event_errors.get(night.mjd)
+        if (
+            error_time is not None
+            and time.monotonic() - error_time >= FIGURE_ERROR_RETRY_SECONDS
+        ):
+            del astronomical_events[night.mjd]
+            del astronomical_event_errors[night.mjd]
+
+        new_events = night.mjd not in astronomical_events
+        if new_events:
+            # Generate the astronomical events
+            astronomical_events[night.mjd] = worker_pool.submit(
+                generate_astronomical_events, night
+            )
+            while len(astronomical_events) > ASTRONOMICAL_EVENTS_NIGHTS:
+                old_mjd, _ = astronomical_events.popitem(last=False)
+                astronomical_event_errors.pop(old_mjd, None)
+        else:
+            astronomical_events.move_to_end(night.mjd)
+        events = astronomical_events[night.mjd]
+
+    if new_events:
+        # Added outside the lock, since it is called straight away (and
+        # takes the lock) if the events are already generated.
+        events.add_done_callback(partial(astronomical_events_generated, night))
+    if not events.done() or events.exception() is not None:
+        return None
+    return events.result()
+
+
+# Generate the astronomical events for the default night straight away
+get_astronomical_events(NIGHT)
 
 
 @app.route('/')
 def home():
-    night_reward_script = server_document('http://127.0.0.1:5006/night_reward')
-    footprint_script = server_document('http://127.0.0.1:5006/footprint')
-    visit_script = server_document('http://127.0.0.1:5006/visit')
+    metrics.increment("briefing pages")
+    # The night may be chosen with a night argument, e.g. ?night=2023-10-05,
+    # which is passed on to the bokeh server.
+    night_arg = request.args.get('night')
+    try:
+        night = NIGHT if night_arg is None else Time(night_arg, scale='utc')
+    except ValueError:
+        abort(400, f"Invalid night {night_arg}")
+    arguments = None if night_arg is None else {'night': night_arg}
+
+    night_reward_script = server_document('http://127.0.0.1:5006/night_reward', arguments=arguments)
+    footprint_script = server_document('http://127.0.0.1:5006/footprint', arguments=arguments)
+    visit_script = server_document('http://127.0.0.1:5006/visit', arguments=arguments)
 
     html = render_template(
         'index.html',
         night_reward_script=night_reward_script,
         footprint_script=footprint_script,
         visit_script=visit_script,
-        astronomical_events=astronomical_events
+        astronomical_events=get_astronomical_events(night)
     )
     return html
 
 
+def get_bokeh_metrics(url, profile_span=None):
+    """Return the metrics of the bokeh server, or the error getting them.
+
+    Raises ``urllib.error.HTTPError`` if the bokeh server rejects the
+    request, e.g. to profile a span it has not recorded.
+    """
+    if profile_span is not None:
+        url += '?' + urllib.parse.urlencode({'profile': profile_span})
+    try:
+        with urllib.request.urlopen(url, timeout=5) as bokeh_io:
+            return json.load(bokeh_io)
+    except urllib.error.HTTPError as e:
+        if e.code == 400:
+            raise
+        return {'error': str(e)}
+    except OSError as e:
+        return {'error': str(e)}
+
+
+@app.route('/metrics')
+def app_metrics():
+    # The plots are made by the bokeh server, so include its metrics too.
+    # A profile argument, with the name of a span, requests a profile of the
+    # next run of the span in whichever servers have recorded it.
+    bokeh_metrics_url = 'http://127.0.0.1:5006/metrics'
+    profile_span = request.args.get('profile')
+    profile_known = False
+    if profile_span is not None:
+        try:
+            metrics.request_profile(profile_span)
+            profile_known = True
+        except ValueError:
+            pass
+
+    try:
+        bokeh_metrics = get_bokeh_metrics(bokeh_metrics_url, profile_span)
+    except urllib.error.HTTPError:
+        # The bokeh server rejects spans it has not recorded
+        if not profile_known:
+            abort(400, f"Unknown span {profile_span}")
+        bokeh_metrics = get_bokeh_metrics(bokeh_metrics_url)
+
+    return jsonify(flask=metrics.metrics(), bokeh=bokeh_metrics)
+
+
 if __name__ == '__main__':
     app.run()
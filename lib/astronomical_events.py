@@ -1,9 +1,10 @@
 import pandas as pd
 from astropy.coordinates import EarthLocation
 from astropy.time import Time
-from rubin_sim.scheduler.modelObservatory import Model_observatory
 
-from plotting.settings import TIMEZONE, scheduler, NIGHT
+from plotting import metrics
+from plotting.night_context import get_night_context
+from plotting.settings import NIGHT, TIMEZONE
 
 
 def all_times(mjds, site):
@@ -23,17 +24,20 @@ def all_times(mjds, site):
     return time_df
 
 
-def generate_astronomical_events():
-    observatory = Model_observatory(mjd_start=NIGHT.mjd - 1)
+@metrics.timed("astronomical events")
+def generate_astronomical_events(night=NIGHT):
+    night_context = get_night_context(night)
+    observatory = night_context.observatory
     site = EarthLocation.from_geodetic(
         observatory.site.longitude, observatory.site.latitude, observatory.site.height
     )
+    conditions = night_context.start_conditions
 
     sun_events = ("sun_n12_setting", "sun_n18_setting", "sun_n18_rising", "sun_n12_rising")
     moon_events = ("moonrise", "moonset")
     events = sun_events + moon_events
     mjds = pd.Series(
-        [getattr(scheduler.conditions, event) for event in events], index=events
+        [getattr(conditions, event) for event in events], index=events
     )
 
     return all_times(mjds, site)
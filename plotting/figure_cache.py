@@ -0,0 +1,490 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from astropy.time import Time, TimeDelta
+from bokeh.document import Document
+from bokeh.model import Model
+
+from plotting import metrics
+from plotting.night_tasks import add_night_tasks
+from plotting.settings import (
+    FIGURE_CACHE_DIR,
+    FIGURE_CACHE_SIZE,
+    FIGURE_ERROR_RETRY_SECONDS,
+    NIGHT,
+    PREGENERATE_NIGHTS,
+    SCHEDULER_CHECK_SECONDS,
+    scheduler_version,
+)
+from plotting.task_graph import TaskGraph
+
+FigureKey = namedtuple(
+    "FigureKey", ["name", "night_mjd", "scheduler_version", "parameters"]
+)
+# A function that generates a plot from the results of the night's tasks
+# with the given names.
+PlotTask = namedtuple("PlotTask", ["generate", "dependencies"])
+# A plot returned from the cache: its snapshot (or None if it has not been
+# generated), its stream (if its data is still being computed), and the
+# error that stopped it being generated (if any).
+CachedFigure = namedtuple("CachedFigure", ["snapshot", "stream", "error"])
+
+
+def _unversioned(key):
+    return (key.name, key.night_mjd, key.parameters)
+
+
+def _task_name(key):
+    if len(key.parameters) == 0:
+        return f"{key.name} plot"
+    return f"{key.name} plot {dict(key.parameters)}"
+
+
+@metrics.timed("snapshot figure")
+def snapshot_figure(figure):
+    """Serialize a figure as a document.
+
+    Parameters
+    ----------
+    figure : `bokeh.model.Model`
+        The figure, which must not be in a document.
+
+    Returns
+    -------
+    snapshot : `dict`
+        The serialized document, with the figure as its only root.
+    """
+    snapshot_doc = Document()
+    snapshot_doc.add_root(figure)
+    snapshot = snapshot_doc.to_json()
+    snapshot_doc.remove_root(figure)
+    return snapshot
+
+
+@metrics.timed("hydrate figure")
+def hydrate_figure(snapshot):
+    """Make a new copy of a figure from its snapshot.
+
+    Parameters
+    ----------
+    snapshot : `dict`
+        The serialized document, from ``snapshot_figure``.
+
+    Returns
+    -------
+    figure : `bokeh.model.Model`
+        The new copy of the figure, not in any document, whose models have
+        the same ids as those of the original.
+    """
+    snapshot_doc = Document.from_json(snapshot)
+    figure = snapshot_doc.roots[0]
+    snapshot_doc.remove_root(figure)
+    return figure
+
+
+def pregenerate_nights(night=NIGHT, num_nights=PREGENERATE_NIGHTS):
+    """Return the nights for which to generate plots in the background.
+
+    Parameters
+    ----------
+    night : `astropy.time.Time`, optional
+        The first night, by default ``NIGHT``.
+    num_nights : `int`, optional
+        The number of nights, by default ``PREGENERATE_NIGHTS``.
+
+    Returns
+    -------
+    nights : `list` [`astropy.time.Time`]
+        The nights, in order.
+    """
+    return [night + TimeDelta(days, format="jd") for days in range(num_nights)]
+
+
+class FigureCache:
+    def __init__(
+        self,
+        generators,
+        worker_pool,
+        max_size=FIGURE_CACHE_SIZE,
+        cache_dir=FIGURE_CACHE_DIR,
+        add_shared_tasks=add_night_tasks,
+        error_retry_seconds=FIGURE_ERROR_RETRY_SECONDS,
+        stream_pool=None,
+    ):
+        """A least-recently-used cache of plot snapshots, by night.
+
+        Plots are generated in the background, and a cached plot made with
+        an older scheduler keeps being returned while its replacement is
+        generated.
+
+        Parameters
+        ----------
+        generators : `dict` [`str`, `PlotTask`]
+            The task that generates each plot, by plot name. Its function is
+            called with the results of its dependencies (and any parameters
+            as keyword arguments), and returns either the figure, or a stream
+            with a ``figure`` that is filled in by its ``compute`` method,
+            and ``complete`` and ``error`` attributes.
+        worker_pool : `concurrent.futures.Executor`
+            The pool in which to run the tasks generating the plots.
+        max_size : `int`, optional
+            Maximum number of plots to keep in memory,
+            by default ``FIGURE_CACHE_SIZE``.
+        cache_dir : `str`, optional
+            Directory in which to also keep completed plots on disk, None to
+            keep them only in memory. By default ``FIGURE_CACHE_DIR``.
+        add_shared_tasks : `Callable`, optional
+            Function that adds the tasks on which the plots depend to the
+            task graph of a night, called with the graph and the night.
+            By default ``add_night_tasks``.
+        error_retry_seconds : `float`, optional
+            Time after a plot fails to be generated before it is generated
+            again when requested, by default ``FIGURE_ERROR_RETRY_SECONDS``.
+        stream_pool : `concurrent.futures.Executor`, optional
+            The pool in which to compute the data of streams, which may
+            spend a long time waiting for other processes. By default None,
+            for a new thread pool, so that they do not hold the threads of
+            ``worker_pool``.
+        """
+        self.generators = generators
+        self.worker_pool = worker_pool
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.add_shared_tasks = add_shared_tasks
+        self.error_retry_seconds = error_retry_seconds
+        if stream_pool is None:
+            stream_pool = ThreadPoolExecutor(thread_name_prefix="FigureCacheStream")
+        self.stream_pool = stream_pool
+        self._snapshots = OrderedDict()
+        # Streams that are still being computed, by key
+        self._streams = dict()
+        # The key of the latest snapshot of each plot, without its version
+        self._latest = dict()
+        # Tasks generating plots, by key
+        self._pending = dict()
+        # Errors that stopped plots being generated, and when, by key
+        self._errors = dict()
+        # Task graphs generating each night's plots, by night and version
+        self._graphs = dict()
+        self._lock = threading.Lock()
+
+    def key(self, name, night=NIGHT, parameters=None):
+        """Return the key of the current version of a plot.
+
+        Parameters
+        ----------
+        name : `str`
+            The plot name.
+        night : `astropy.time.Time`, optional
+            The night, by default ``NIGHT``.
+        parameters : `dict`, optional
+            Keyword arguments for the plot's generator, by default None.
+
+        Returns
+        -------
+        key : `FigureKey`
+            The key.
+        """
+        parameters = () if parameters is None else tuple(sorted(parameters.items()))
+        return FigureKey(name, night.mjd, scheduler_version(), parameters)
+
+    def _fname(self, key):
+        key_hash = hashlib.sha256(repr(key).encode()).hexdigest()[:16]
+        return os.path.join(
+            self.cache_dir, f"figure_{key.name}_{key.night_mjd}_{key_hash}.json"
+        )
+
+    def _load(self, key):
+        fname = self._fname(key)
+        if not os.path.exists(fname):
+            return None
+
+        try:
+            with open(fname, "r") as snapshot_io:
+                return json.load(snapshot_io)
+        except (OSError, ValueError) as e:
+            # The plot is generated again, replacing the file.
+            print(f"Could not load cached figure {fname}: {e}")
+            return None
+
+    def _save(self, key, snapshot):
+        fname = self._fname(key)
+        # Write to a temporary file and rename, so that other processes
+        # never load a partially written snapshot.
+        tmp_fname = f"{fname}.{os.getpid()}.tmp"
+        with open(tmp_fname, "w") as snapshot_io:
+            json.dump(snapshot, snapshot_io)
+        os.replace(tmp_fname, fname)
+
+    def _put(self, key, snapshot, stream=None):
+        with self._lock:
+            self._snapshots[key] = snapshot
+            self._snapshots.move_to_end(key)
+            if stream is None:
+                self._streams.pop(key, None)
+            else:
+                self._streams[key] = stream
+            self._latest[_unversioned(key)] = key
+
+            while len(self._snapshots) > self.max_size:
+                old_key, _ = self._snapshots.popitem(last=False)
+                self._streams.pop(old_key, None)
+                if self._latest.get(_unversioned(old_key)) == old_key:
+                    del self._latest[_unversioned(old_key)]
+
+            # Errors of other versions of the plot are superseded by it,
+            # and expired errors are not needed to decide when to retry.
+            for error_key in list(self._errors):
+                if (
+                    error_key != key and _unversioned(error_key) == _unversioned(key)
+                ) or self._error_expired(error_key):
+                    del self._errors[error_key]
+
+    def _discard(self, key):
+        with self._lock:
+            self._snapshots.pop(key, None)
+            self._streams.pop(key, None)
+            if self._latest.get(_unversioned(key)) == key:
+                del self._latest[_unversioned(key)]
+
+    def _complete(self, key, snapshot):
+        self._put(key, snapshot)
+        if self.cache_dir is not None:
+            self._save(key, snapshot)
+
+    def _failed(self, key, error):
+        with self._lock:
+            self._errors[key] = (error, time.monotonic())
+
+    def _generate(self, key, *dependency_results):
+        plot_task = self.generators[key.name]
+        plot = plot_task.generate(*dependency_results, **dict(key.parameters))
+        if isinstance(plot, Model):
+            self._complete(key, snapshot_figure(plot))
+        else:
+            # The plot is filled in as its data is computed, so make the
+            # figure available straight away (before any data is streamed
+            # into it), then compute the data in the stream pool.
+            self._put(key, snapshot_figure(plot.figure), plot)
+            self.stream_pool.submit(self._compute_stream, key, plot)
+
+    def _compute_stream(self, key, plot):
+        start_time = time.perf_counter()
+        try:
+            with metrics.profiled(f"compute {key.name} stream"):
+                plot.compute()
+        except Exception as e:
+            print(f"Computing {_task_name(key)} failed: {e}")
+            traceback.print_exc()
+            # Return the error, rather than the incomplete plot, to later
+            # sessions.
+            self._discard(key)
+            self._failed(key, e)
+            return
+
+        duration = time.perf_counter() - start_time
+        print(f"Computing {_task_name(key)} took {duration:.2f} s")
+        metrics.record(f"compute {key.name} stream", duration)
+
+        # Once complete, later sessions get all of the data in the
+        # snapshot, rather than streaming it.
+        plot.stream()
+        self._complete(key, snapshot_figure(plot.figure))
+
+    def _generated(self, key, future):
+        with self._lock:
+            del self._pending[key]
+            if not future.cancelled() and future.exception() is not None:
+                self._errors[key] = (future.exception(), time.monotonic())
+
+    def _error_expired(self, key):
+        # Whether an error is old enough to try generating the plot again
+        # (e.g. if it was caused by a database that was briefly locked).
+        _, error_time = self._errors[key]
+        return time.monotonic() - error_time >= self.error_retry_seconds
+
+    def _expire_error(self, key):
+        if key in self._errors and self._error_expired(key):
+            del self._errors[key]
+
+    def _night_graph(self, key, night):
+        # Plots of the same night and version share a graph (and so the
+        # results of its shared tasks), unless the plot is already in it.
+        graph_key = (key.night_mjd, key.scheduler_version)
+        graph = self._graphs.get(graph_key)
+        if graph is None or _task_name(key) in graph.tasks:
+            graph = TaskGraph(self.worker_pool, name=f"night {night.iso[:10]}")
+            self.add_shared_tasks(graph, night)
+            self._graphs[graph_key] = graph
+
+        # Forget finished graphs of other nights, and their results
+        for other_key, other_graph in list(self._graphs.items()):
+            if other_key != graph_key and other_graph.done:
+                del self._graphs[other_key]
+
+        return graph
+
+    def refresh(self, name, night=NIGHT, parameters=None):
+        """Generate the current version of a plot in the background, unless
+        it is already cached or being generated, or failed less than
+        ``error_retry_seconds`` ago.
+
+        Parameters
+        ----------
+        name : `str`
+            The plot name.
+        night : `astropy.time.Time`, optional
+            The night, by default ``NIGHT``.
+        parameters : `dict`, optional
+            Keyword arguments for the plot's generator, by default None.
+
+        Returns
+        -------
+        key : `FigureKey`
+            The key of the current version of the plot.
+        """
+        key = self.key(name, night, parameters)
+        with self._lock:
+            self._expire_error(key)
+            if key in self._snapshots or key in self._pending or key in self._errors:
+                return key
+
+        snapshot = None if self.cache_dir is None else self._load(key)
+        if snapshot is not None:
+            self._put(key, snapshot)
+            return key
+
+        with self._lock:
+            if key in self._snapshots or key in self._pending or key in self._errors:
+                return key
+
+            # Older versions of the plot are no longer needed.
+            superseded_tasks = [
+                pending_task
+                for pending_key, pending_task in self._pending.items()
+                if _unversioned(pending_key) == _unversioned(key)
+            ]
+
+            graph = self._night_graph(key, night)
+            dependencies = self.generators[name].dependencies
+            task = graph.add(_task_name(key), partial(self._generate, key), dependencies)
+            self._pending[key] = task
+
+        task.future.add_done_callback(partial(self._generated, key))
+        # Cancel the superseded tasks (that have not started) without the
+        # lock, which their callbacks take.
+        for superseded_task in superseded_tasks:
+            superseded_task.future.cancel()
+
+        return key
+
+    def get(self, name, night=NIGHT, parameters=None):
+        """Return the latest snapshot of a plot.
+
+        If the current version of the plot is not cached, it is generated in
+        the background, and the latest older version (if any) returned in
+        the meantime.
+
+        Parameters
+        ----------
+        name : `str`
+            The plot name.
+        night : `astropy.time.Time`, optional
+            The night, by default ``NIGHT``.
+        parameters : `dict`, optional
+            Keyword arguments for the plot's generator, by default None.
+
+        Returns
+        -------
+        figure : `CachedFigure`
+            The serialized document with the plot, from ``snapshot_figure``
+            (or None if no version of the plot has been generated yet), its
+            stream (if its data is still being computed), and the error that
+            stopped the current version being generated (if there is no
+            older version to return instead).
+        """
+        key = self.refresh(name, night, parameters)
+        with self._lock:
+            latest_key = self._latest.get(_unversioned(key))
+            if latest_key is None:
+                error, _ = self._errors.get(key, (None, None))
+                return CachedFigure(None, None, error)
+
+            self._snapshots.move_to_end(latest_key)
+            return CachedFigure(
+                self._snapshots[latest_key], self._streams.get(latest_key), None
+            )
+
+    def pregenerate(self, nights=None):
+        """Generate every plot for nights in the background.
+
+        Parameters
+        ----------
+        nights : `Iterable` [`astropy.time.Time`], optional
+            The nights, by default those from ``pregenerate_nights``.
+        """
+        if nights is None:
+            nights = pregenerate_nights()
+
+        for night in nights:
+            for name in self.generators:
+                self.refresh(name, night)
+
+    def refresh_cached(self):
+        """Generate the current version of every cached plot in the
+        background, unless it is already cached or being generated."""
+        with self._lock:
+            latest_keys = list(self._latest.values())
+
+        for key in latest_keys:
+            night = Time(key.night_mjd, format="mjd", scale="utc")
+            self.refresh(key.name, night, dict(key.parameters))
+
+    def watch_scheduler(self, check_seconds=SCHEDULER_CHECK_SECONDS):
+        """Refresh the cached plots in the background whenever the scheduler
+        file changes, rather than when they are next requested.
+
+        Parameters
+        ----------
+        check_seconds : `float`, optional
+            How often to check the scheduler file, by default
+            ``SCHEDULER_CHECK_SECONDS``. The plots are refreshed once the
+            file has not changed between two checks, so that they are not
+            generated from a file that is still being written.
+
+        Returns
+        -------
+        thread : `threading.Thread`
+            The (daemon) thread checking the scheduler file.
+        """
+        thread = threading.Thread(
+            target=self._watch_scheduler,
+            args=(check_seconds,),
+            name="FigureCacheSchedulerWatch",
+            daemon=True,
+        )
+        thread.start()
+        return thread
+
+    def _watch_scheduler(self, check_seconds):
+        refreshed_version = scheduler_version()
+        checked_version = refreshed_version
+        while True:
+            time.sleep(check_seconds)
+            version = scheduler_version()
+            if version == checked_version and version != refreshed_version:
+                print(f"Scheduler version {version} found, refreshing plots")
+                try:
+                    self.refresh_cached()
+                except Exception as e:
+                    print(f"Refreshing plots failed: {e}")
+                    traceback.print_exc()
+                refreshed_version = version
+            checked_version = version
@@ -1,61 +1,120 @@
+import html
 from concurrent.futures import ThreadPoolExecutor
 
-from bokeh.model import Model
+from astropy.time import Time
 from bokeh.models import Div
 from bokeh.server.server import Server
 from tornado.ioloop import IOLoop
+from tornado.web import HTTPError, RequestHandler
 
+from plotting import metrics
+from plotting.figure_cache import FigureCache, PlotTask, hydrate_figure
 from plotting.night_reward import generate_night_rewards_plot
+from plotting.night_tasks import FOOTPRINT_TASK, NIGHT_CONTEXT_TASK, VISITS_TASK
 from plotting.footprint import generate_footprint_plot
+from plotting.settings import NIGHT
 from plotting.visits import generate_visit_plot
 
-worker_pool = ThreadPoolExecutor(4)
-figure_cache = dict()
+# How often sessions check for new data for plots that are being filled in
+STREAM_PERIOD_MS = 1000
 
 NIGHT_REWARD_PLOT = 'night_reward'
 FOOTPRINT_PLOT = 'footprint'
 VISIT_PLOT = 'visit'
 
+# Each plot is generated from the results of the night's shared tasks
 plots = {
-    NIGHT_REWARD_PLOT: generate_night_rewards_plot,
-    FOOTPRINT_PLOT: generate_footprint_plot,
-    VISIT_PLOT: generate_visit_plot
+    NIGHT_REWARD_PLOT: PlotTask(generate_night_rewards_plot, (NIGHT_CONTEXT_TASK,)),
+    FOOTPRINT_PLOT: PlotTask(generate_footprint_plot, (NIGHT_CONTEXT_TASK, FOOTPRINT_TASK)),
+    VISIT_PLOT: PlotTask(generate_visit_plot, (NIGHT_CONTEXT_TASK, VISITS_TASK, FOOTPRINT_TASK))
 }
 
-
-def _set_fig(name, generator):
-    figure_cache[name] = generator()
-
-
-def generate_plots():
-    for name, generator in plots.items():
-        # Clear the old plot from the cache
-        if name in figure_cache:
-            del figure_cache[name]
-
-        # Generate the new plot asynchronously
-        worker_pool.submit(_set_fig, name, generator)
-
-
-def reset_figure_document(figure):
-    # See https://stackoverflow.com/a/67047128
-    for model in figure.select({'type': Model}):
-        prev_doc = model.document
-        model._document = None
-        if prev_doc:
+worker_pool = ThreadPoolExecutor(4)
+# Snapshots of the generated plots, by plot and night. Each session gets its
+# own copy of a plot, hydrated from its snapshot, so that sessions do not
+# share (and contend for) one set of bokeh models.
+figure_cache = FigureCache(plots, worker_pool)
+
+
+def session_night(doc):
+    """Return the night requested by a session, with its ``night`` argument.
+
+    Parameters
+    ----------
+    doc : `bokeh.document.Document`
+        The session's document.
+
+    Returns
+    -------
+    night : `astropy.time.Time`
+        The night, by default ``NIGHT``.
+    """
+    night_args = doc.session_context.request.arguments.get('night')
+    if not night_args:
+        return NIGHT
+    return Time(night_args[0].decode(), scale='utc')
+
+
+def error_div(name, error):
+    """Return a message saying that a figure could not be generated."""
+    return Div(text=f"The {name} figure could not be generated: {html.escape(str(error))}")
+
+
+def add_stream_callback(name, plot, doc):
+    """Stream new data into a plot in a document as it is computed."""
+    data_sources = plot.document_data_sources(doc)
+    num_streamed = 0
+
+    def update():
+        nonlocal num_streamed
+        complete = plot.complete
+        num_streamed = plot.stream(data_sources, num_streamed)
+        if complete:
+            doc.remove_periodic_callback(callback)
+            if plot.error is not None:
+                doc.add_root(error_div(name, plot.error))
+
+    # Add the data computed so far straight away
+    num_streamed = plot.stream(data_sources, num_streamed)
+    if not plot.complete:
+        callback = doc.add_periodic_callback(update, STREAM_PERIOD_MS)
+    elif plot.error is not None:
+        doc.add_root(error_div(name, plot.error))
+
+
+class MetricsHandler(RequestHandler):
+    def get(self):
+        """Return the recorded metrics as JSON.
+
+        A ``profile`` argument with the name of a span (that has already
+        been recorded) requests a profile of its next run.
+        """
+        profile_span = self.get_argument('profile', None)
+        if profile_span is not None:
             try:
-                prev_doc.remove_root(model)
-            except RuntimeError:
-                pass
+                metrics.request_profile(profile_span)
+            except ValueError as e:
+                raise HTTPError(400, reason=str(e))
+        self.write(metrics.metrics())
 
 
 def render_figure(name, doc):
+    metrics.increment(f"{name} sessions")
+    try:
+        night = session_night(doc)
+    except ValueError:
+        doc.add_root(Div(text="The requested night is not a valid date."))
+        return
+
+    snapshot, stream, error = figure_cache.get(name, night)
     # Check if the plot has been generated or not
-    if name in figure_cache:
-        # Make sure that the previous document has been removed from the figure
-        reset_figure_document(figure_cache[name])
-        # Add the plot to the document
-        doc.add_root(figure_cache[name])
+    if snapshot is not None:
+        # Add this session's own copy of the plot to the document
+        doc.add_root(hydrate_figure(snapshot))
+        if stream is not None:
+            add_stream_callback(name, stream, doc)
+    elif error is not None:
+        doc.add_root(error_div(name, error))
     else:
         # Mention that the figure is still being generated
         doc.add_root(Div(text=f"The {name} figure is being generated, please reload the page shortly..."))
@@ -73,8 +132,10 @@ def visit(doc):
     render_figure(VISIT_PLOT, doc)
 
 
-# Generate all initial plots asynchronously
-worker_pool.submit(generate_plots)
+# Generate the plots for the first nights asynchronously, and again whenever
+# the scheduler file changes
+figure_cache.pregenerate()
+figure_cache.watch_scheduler()
 
 # Start the bokeh server
 server = Server(
@@ -84,7 +145,8 @@ server = Server(
         '/visit': visit
     },
     io_loop=IOLoop(),
-    allow_websocket_origin=["127.0.0.1:5000"]
+    allow_websocket_origin=["127.0.0.1:5000"],
+    extra_patterns=[('/metrics', MetricsHandler)]
 )
 server.start()
 server.io_loop.start()
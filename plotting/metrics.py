@@ -0,0 +1,273 @@
+import cProfile
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+# Number of recent durations of each span to keep, and the directory in which
+# to write profiles requested with ``request_profile``.
+METRICS_RECENT_SPANS = 20
+PROFILE_DIR = tempfile.gettempdir()
+
+_spans = dict()
+_counters = dict()
+_profile_requests = set()
+# Names of spans merged from other processes (e.g. night reward workers)
+_merged_span_names = set()
+_profiles = deque(maxlen=METRICS_RECENT_SPANS)
+_lock = threading.Lock()
+
+
+def _reset_metrics_lock():
+    # A forked process (e.g. a night reward worker) starts with no metrics of
+    # its own, and may inherit the lock held by another thread.
+    global _lock
+    _lock = threading.Lock()
+    _spans.clear()
+    _counters.clear()
+    _profile_requests.clear()
+    _merged_span_names.clear()
+    _profiles.clear()
+
+
+os.register_at_fork(after_in_child=_reset_metrics_lock)
+
+
+class SpanStats:
+    def __init__(self):
+        """Statistics of the durations of a span."""
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=METRICS_RECENT_SPANS)
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.recent.append(duration)
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.recent.extend(other.recent)
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total_s": self.total,
+            "mean_s": self.total / self.count if self.count > 0 else None,
+            "max_s": self.max,
+            "recent_s": list(self.recent),
+        }
+
+
+def record(name, duration):
+    """Record a duration of a span.
+
+    Parameters
+    ----------
+    name : `str`
+        The name of the span.
+    duration : `float`
+        The duration, in seconds.
+    """
+    with _lock:
+        if name not in _spans:
+            _spans[name] = SpanStats()
+        _spans[name].add(duration)
+
+
+def increment(name, value=1):
+    """Add to a counter.
+
+    Parameters
+    ----------
+    name : `str`
+        The name of the counter.
+    value : `int`, optional
+        The amount to add, by default 1.
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def request_profile(name, recorded_only=True):
+    """Profile the next run of a span, writing the profile to ``PROFILE_DIR``.
+
+    Parameters
+    ----------
+    name : `str`
+        The name of the span.
+    recorded_only : `bool`, optional
+        Only accept spans that have already been recorded (or merged from
+        another process), by default True.
+
+    Raises
+    ------
+    ValueError
+        If ``recorded_only`` and no span with the name has been recorded.
+    """
+    with _lock:
+        if recorded_only and name not in _spans:
+            raise ValueError(f"Unknown span {name}")
+        _profile_requests.add(name)
+
+
+def pop_profile_requests():
+    """Return the requested profiles of spans merged from other processes,
+    and forget them, to pass on to the process that runs them.
+
+    Returns
+    -------
+    names : `list` [`str`]
+        The names of the spans.
+    """
+    with _lock:
+        names = sorted(_profile_requests & _merged_span_names)
+        _profile_requests.difference_update(names)
+    return names
+
+
+@contextmanager
+def profiled(name):
+    """Profile a block of code, if a profile of the span it runs is requested.
+
+    Parameters
+    ----------
+    name : `str`
+        The name of the span.
+
+    Note
+    ----
+    cProfile only profiles the calling thread, so work the block hands to
+    other threads (e.g. a thread pool) is not in the profile. Those threads
+    profile their own spans, e.g. the tasks of a ``TaskGraph``.
+    """
+    with _lock:
+        profile_requested = name in _profile_requests
+        _profile_requests.discard(name)
+
+    if not profile_requested:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profile_fname = os.path.join(
+            PROFILE_DIR, f"{name.replace(' ', '_')}_{time.time():.0f}.prof"
+        )
+        profiler.dump_stats(profile_fname)
+        with _lock:
+            _profiles.append(profile_fname)
+
+
+@contextmanager
+def span(name):
+    """Time a block of code, recording its duration as a span, and profile
+    it (in the calling thread) if requested.
+
+    Parameters
+    ----------
+    name : `str`
+        The name of the span.
+    """
+    start_time = time.perf_counter()
+    try:
+        with profiled(name):
+            yield
+    finally:
+        record(name, time.perf_counter() - start_time)
+
+
+def timed(name):
+    """Decorate a function to record each call as a span.
+
+    Parameters
+    ----------
+    name : `str`
+        The name of the span.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def timed_func(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return timed_func
+
+    return decorator
+
+
+def pop_spans():
+    """Return the statistics of the spans recorded so far, and forget them.
+
+    Returns
+    -------
+    spans : `dict` [`str`, `SpanStats`]
+        The statistics of each span, by name.
+    """
+    with _lock:
+        spans = dict(_spans)
+        _spans.clear()
+    return spans
+
+
+def pop_profiles():
+    """Return the file names of the profiles written so far, and forget them.
+
+    Returns
+    -------
+    profiles : `list` [`str`]
+        The file names.
+    """
+    with _lock:
+        profiles = list(_profiles)
+        _profiles.clear()
+    return profiles
+
+
+def merge_spans(spans, profiles=()):
+    """Add span statistics recorded elsewhere, e.g. in a worker process.
+
+    Parameters
+    ----------
+    spans : `dict` [`str`, `SpanStats`]
+        The statistics of each span, by name, from ``pop_spans``.
+    profiles : `Iterable` [`str`], optional
+        The file names of profiles written there, from ``pop_profiles``,
+        by default none.
+    """
+    with _lock:
+        for name, stats in spans.items():
+            if name not in _spans:
+                _spans[name] = SpanStats()
+            _spans[name].merge(stats)
+            _merged_span_names.add(name)
+        _profiles.extend(profiles)
+
+
+def metrics():
+    """Return the recorded spans and counters.
+
+    Returns
+    -------
+    metrics : `dict`
+        The statistics of each span (with durations in seconds), the value
+        of each counter, and the file names of recent profiles.
+    """
+    with _lock:
+        return {
+            "spans": {name: stats.to_dict() for name, stats in _spans.items()},
+            "counters": dict(_counters),
+            "profiles": list(_profiles),
+        }
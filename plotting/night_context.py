@@ -0,0 +1,232 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from copy import deepcopy
+
+import numpy as np
+from rubin_sim.scheduler.modelObservatory import Model_observatory
+
+from plotting import metrics
+from plotting.settings import get_scheduler, NIGHT, NIGHT_CONTEXTS, scheduler_version
+
+# Night contexts, by night MJD and scheduler version, least recently used first
+_night_contexts = OrderedDict()
+_night_contexts_lock = threading.Lock()
+
+# There is one scheduler, shared by the contexts of all nights, so keep track
+# of the night for which it was last updated (and which scheduler, since it
+# is loaded again if its file changes), and hold _scheduler_lock while
+# updating it and reading from it.
+_updated_scheduler = None
+_scheduler_night_mjd = None
+_scheduler_lock = threading.RLock()
+
+
+def _reset_night_context_locks():
+    # A forked process (e.g. a night reward worker) keeps the contexts (and
+    # updated scheduler) of its parent, but may inherit locks held by other
+    # threads in the parent, so give it new ones.
+    global _night_contexts_lock, _scheduler_lock
+    _night_contexts_lock = threading.Lock()
+    _scheduler_lock = threading.RLock()
+    for night_context in _night_contexts.values():
+        night_context._lock = threading.RLock()
+
+
+os.register_at_fork(after_in_child=_reset_night_context_locks)
+
+
+def get_footprint(scheduler):
+    """Extract the footprint from a survey."""
+    # This is a hack, good enough for example code, not for production.
+
+    # Look through the scheduler to find a blob survey that has a footprint basis function
+    for survey_tier in scheduler.survey_lists:
+        for survey in survey_tier:
+            if survey.__class__.__name__ in ("Blob_survey", "Greedy_survey"):
+                for basis_function in survey.basis_functions:
+                    if basis_function.__class__.__name__.startswith("Footprint"):
+                        footprint = np.sum(basis_function.footprint.footprints, axis=0)
+                        break
+
+    footprint[footprint == 0] = np.nan
+    return footprint
+
+
+class NightContext:
+    def __init__(self, night=NIGHT):
+        """The observatory, twilight times, and conditions for a night.
+
+        Parameters
+        ----------
+        night : `astropy.time.Time`, optional
+            The night, by default ``NIGHT``.
+
+        Note
+        ----
+        Use ``get_night_context`` to get the shared instance for a night,
+        rather than creating new ones.
+        """
+        self.night = night
+        self._lock = threading.RLock()
+        self._conditions = dict()
+        self._footprint = None
+
+        # Set the site of the observatory:
+        self.observatory = Model_observatory(mjd_start=night.mjd - 1)
+
+        # Get a conditions object for some time in the night in question,
+        # which will have the sunset and sunrise times:
+        night_conditions = self.conditions(night.mjd, memoise=False)
+        self.start_mjd = night_conditions.sun_n12_setting
+        self.end_mjd = night_conditions.sun_n12_rising
+        self.middle_mjd = (self.start_mjd + self.end_mjd) / 2
+
+    def conditions(self, mjd, memoise=True):
+        """Return the conditions at a time.
+
+        Parameters
+        ----------
+        mjd : `float`
+            The MJD of the conditions.
+        memoise : `bool`, optional
+            Keep the conditions to be returned by later calls with the same
+            ``mjd``, by default True.
+
+        Returns
+        -------
+        conditions : `rubin_sim.scheduler.features.Conditions`
+            The conditions, which are shared between callers and must not be
+            modified. Conditions that are not memoised are those of the
+            observatory itself, which are only valid until the next call.
+        """
+        # Memoised conditions are never replaced, so can be returned without
+        # the lock (which may be held by a thread waiting for the scheduler).
+        memoised_conditions = self._conditions.get(mjd)
+        if memoised_conditions is not None:
+            return memoised_conditions
+
+        with self._lock:
+            if mjd in self._conditions:
+                return self._conditions[mjd]
+
+            with metrics.span("return conditions"):
+                self.observatory.mjd = mjd
+                conditions = self.observatory.return_conditions()
+                if memoise:
+                    # The observatory updates and returns the same
+                    # conditions instance every time, so keep a copy.
+                    conditions = deepcopy(conditions)
+                    self._conditions[mjd] = conditions
+
+        return conditions
+
+    @property
+    def start_conditions(self):
+        """The conditions at the start of the night."""
+        return self.conditions(self.start_mjd)
+
+    def update_scheduler(self):
+        """Update the scheduler for the start of the night, if not already done.
+
+        Returns
+        -------
+        scheduler : `rubin_sim.scheduler.schedulers.Core_scheduler`
+            The updated scheduler.
+
+        Note
+        ----
+        The scheduler is shared with the contexts of other nights, which
+        update it for their own nights, so it is only safe to use from
+        threads that do not use other nights (e.g. a night reward worker).
+        """
+        global _updated_scheduler, _scheduler_night_mjd
+        scheduler = get_scheduler()
+        # Get the conditions before taking the scheduler lock, so that the
+        # locks are always taken in the same order.
+        start_conditions = self.start_conditions
+        with _scheduler_lock:
+            if (
+                _updated_scheduler is not scheduler
+                or _scheduler_night_mjd != self.night.mjd
+            ):
+                with metrics.span("update scheduler conditions"):
+                    scheduler.update_conditions(start_conditions)
+                _updated_scheduler = scheduler
+                _scheduler_night_mjd = self.night.mjd
+
+        return scheduler
+
+    @property
+    def footprint(self):
+        """The survey footprint at the start of the night."""
+        with self._lock:
+            if self._footprint is None:
+                # Hold the scheduler until the footprint is extracted, so
+                # that it is not updated for another night in the meantime.
+                with _scheduler_lock:
+                    scheduler = self.update_scheduler()
+                    self._footprint = get_footprint(scheduler)
+
+        return self._footprint
+
+
+@contextmanager
+def updated_scheduler(night=NIGHT):
+    """Hold the scheduler, updated for a night, so that no other thread
+    updates it (e.g. for another night) until the block ends.
+
+    Parameters
+    ----------
+    night : `astropy.time.Time`, optional
+        The night, by default ``NIGHT``.
+
+    Yields
+    ------
+    night_context : `NightContext`
+        The context for the night.
+    scheduler : `rubin_sim.scheduler.schedulers.Core_scheduler`
+        The scheduler, updated for the start of the night.
+    """
+    night_context = get_night_context(night)
+    # Get the conditions before taking the scheduler lock, so that the
+    # night context's lock is not needed while holding it.
+    night_context.start_conditions
+    with _scheduler_lock:
+        yield night_context, night_context.update_scheduler()
+
+
+def get_night_context(night=NIGHT):
+    """Return the shared context for a night, creating it if necessary.
+
+    Contexts (and so their footprints) are made again when the scheduler
+    file changes, and those made with earlier versions of it are dropped,
+    as are the least recently used once there are more than
+    ``NIGHT_CONTEXTS``.
+
+    Parameters
+    ----------
+    night : `astropy.time.Time`, optional
+        The night, by default ``NIGHT``.
+
+    Returns
+    -------
+    night_context : `NightContext`
+        The context for the night.
+    """
+    version = scheduler_version()
+    with _night_contexts_lock:
+        for key in list(_night_contexts):
+            if key[1] != version:
+                del _night_contexts[key]
+
+        key = (night.mjd, version)
+        if key in _night_contexts:
+            _night_contexts.move_to_end(key)
+        else:
+            _night_contexts[key] = NightContext(night)
+            while len(_night_contexts) > NIGHT_CONTEXTS:
+                _night_contexts.popitem(last=False)
+
+        return _night_contexts[key]
@@ -1,5 +1,6 @@
+import random
+import threading
 import warnings
-from concurrent.futures import ProcessPoolExecutor
 
 import bokeh
 import bokeh.layouts
@@ -8,101 +9,225 @@ import bokeh.plotting
 import numpy as np
 import pandas as pd
 from astropy.time import Time
-from rubin_sim.scheduler.modelObservatory import Model_observatory
 
-from plotting.settings import scheduler, NIGHT
+from plotting import metrics
+from plotting.night_context import get_night_context
+from plotting.settings import (
+    get_scheduler,
+    NIGHT,
+    NIGHT_REWARD_CHUNK_SIZE,
+    REWARD_CHECK,
+    REWARD_CHECK_FRACTION,
+)
+from plotting.worker_pool import get_scheduler_pool, worker_scheduler
 
-worker_pool = ProcessPoolExecutor(1)
+NIGHT_REWARD_COLUMNS = (
+    "tier",
+    "survey_name",
+    "reward",
+    "infeasible",
+    "infeasible_bfs",
+    "mjd",
+    "time",
+)
 
 
-def reward_bfs_df(scheduler, conditions):
-    reward_df = scheduler.make_reward_df(conditions)
-    summary_df = reward_df.reset_index()
-
-    def make_tier_name(row):
-        tier_name = f"tier {row.list_index}"
-        return tier_name
+def check_survey_rewards(scheduler, conditions, last_bfs, mode=REWARD_CHECK, seed=0):
+    """Check rewards accumulated in a reward_df against direct computation.
 
-    summary_df["tier"] = summary_df.apply(make_tier_name, axis=1)
+    Parameters
+    ----------
+    scheduler : `rubin_sim.scheduler.schedulers.Core_scheduler`
+        The scheduler with the surveys.
+    conditions : `rubin_sim.scheduler.features.Conditions`
+        The conditions for which the rewards were computed.
+    last_bfs : `pandas.DataFrame`
+        The last basis function row of the reward_df for each survey,
+        with ``list_index``, ``survey_index`` and ``accum_reward`` columns.
+    mode : `str`, optional
+        "off" to skip the check, "always" to check every survey, or
+        "sampled" to check a random ``REWARD_CHECK_FRACTION`` of surveys.
+        By default ``REWARD_CHECK``.
+    seed : `int` or `float`, optional
+        Seed for choosing the surveys to check when "sampled", e.g. the MJD
+        of the night, combined with the index of each survey so that the
+        same surveys are chosen every time. By default 0.
+    """
+    if mode not in ("off", "sampled", "always"):
+        raise ValueError(f"Unknown reward check mode {mode}")
 
-    def get_survey_name(row):
-        survey_name = scheduler.survey_lists[row.list_index][
-            row.survey_index
-        ].survey_name
-        return survey_name
+    if mode == "off":
+        return
 
-    summary_df["survey_name"] = summary_df.apply(get_survey_name, axis=1)
+    for survey_bf in last_bfs.itertuples():
+        if mode == "sampled":
+            survey_rng = random.Random(
+                f"{seed} {survey_bf.list_index} {survey_bf.survey_index}"
+            )
+            if survey_rng.random() >= REWARD_CHECK_FRACTION:
+                continue
 
-    def make_survey_row(survey_bfs):
-        infeasible_bf = ", ".join(
-            survey_bfs.loc[~survey_bfs.feasible.astype(bool)].basis_function.to_list()
-        )
-        infeasible = ~np.all(survey_bfs.feasible.astype(bool))
-        list_index = survey_bfs.list_index.iloc[0]
-        survey_index = survey_bfs.survey_index.iloc[0]
-        direct_reward = scheduler.survey_lists[list_index][
-            survey_index
+        direct_reward = scheduler.survey_lists[survey_bf.list_index][
+            survey_bf.survey_index
         ].calc_reward_function(conditions)
-        reward = survey_bfs.accum_reward.iloc[-1]
-        assert reward == np.nanmax(direct_reward)
-        survey_row = pd.Series(
-            {
-                "reward": reward,
-                "infeasible": infeasible,
-                "infeasible_bfs": infeasible_bf,
-            }
-        )
-        return survey_row
+        assert survey_bf.accum_reward == np.nanmax(direct_reward)
+
+
+def reward_bfs_df(scheduler, conditions, seed=0):
+    with metrics.span("make reward df"):
+        reward_df = scheduler.make_reward_df(conditions)
+    summary_df = reward_df.reset_index()
+
+    survey_names = pd.Series(
+        {
+            (list_index, survey_index): survey.survey_name
+            for list_index, survey_list in enumerate(scheduler.survey_lists)
+            for survey_index, survey in enumerate(survey_list)
+        }
+    )
+    survey_ids = pd.MultiIndex.from_frame(summary_df[["list_index", "survey_index"]])
+    summary_df["tier"] = "tier " + summary_df.list_index.astype(str)
+    summary_df["survey_name"] = survey_names.reindex(survey_ids).values
+    summary_df["infeasible"] = ~summary_df.feasible.astype(bool)
+    summary_df["infeasible_bfs"] = summary_df.basis_function.where(
+        summary_df.infeasible
+    )
+
+    # The reward for a survey is the reward accumulated through its last
+    # basis function.
+    last_bfs = summary_df.drop_duplicates(["list_index", "survey_index"], keep="last")
+    check_survey_rewards(scheduler, conditions, last_bfs, seed=seed)
 
-    survey_df = summary_df.groupby(["tier", "survey_name"]).apply(make_survey_row)
+    # Surveys in the same tier with the same name are merged, taking the
+    # reward of the last of them.
+    survey_bfs = summary_df.groupby(["tier", "survey_name"])
+    survey_df = pd.DataFrame(
+        {
+            "reward": last_bfs.groupby(["tier", "survey_name"]).accum_reward.last(),
+            "infeasible": survey_bfs.infeasible.any(),
+            "infeasible_bfs": survey_bfs.infeasible_bfs.agg(
+                lambda bfs: ", ".join(bfs.dropna())
+            ),
+        }
+    )
     return survey_df
 
 
-def _process_night_reward_df(freq):
-    # Set the site of the observatory:
-    observatory = Model_observatory(mjd_start=NIGHT.mjd - 1)
+def _process_night_reward_chunk(sample_times, night=NIGHT, profile_spans=()):
+    """Compute the survey rewards at each of a sequence of times.
+
+    Parameters
+    ----------
+    sample_times : `pandas.DatetimeIndex`
+        The times at which to compute the rewards.
+    night : `astropy.time.Time`, optional
+        The night of the sample times, by default ``NIGHT``.
+    profile_spans : `Iterable` [`str`], optional
+        Names of spans of which to profile the next run, by default none.
+
+    Returns
+    -------
+    reward_df : `pandas.DataFrame`
+        Rewards for each survey at each time, in time order.
+    spans : `dict` [`str`, `plotting.metrics.SpanStats`]
+        The spans recorded by the worker process since its last chunk.
+    profiles : `list` [`str`]
+        The file names of the profiles written by the worker process since
+        its last chunk.
+    """
+    for span_name in profile_spans:
+        metrics.request_profile(span_name, recorded_only=False)
+
+    # Each worker process has its own (copy-on-write) copy of the parent's
+    # night context and scheduler, already updated for the night
+    night_context, scheduler = worker_scheduler(night)
+
+    reward_df_time_list = []
+    # Worker processes run one chunk at a time, in one thread, so the
+    # warning filters are safe to change here.
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', category=RuntimeWarning, lineno=552)
+        warnings.filterwarnings('ignore', category=FutureWarning, lineno=465)
+        for pd_time in sample_times:
+            ap_time = Time(pd_time)
+            conditions = night_context.conditions(ap_time.mjd, memoise=False)
+            this_time_reward_df = reward_bfs_df(scheduler, conditions, seed=night.mjd)
+            this_time_reward_df["mjd"] = ap_time.mjd
+            this_time_reward_df["time"] = pd_time
+            reward_df_time_list.append(this_time_reward_df)
+
+    return (
+        pd.concat(reward_df_time_list).reset_index(),
+        metrics.pop_spans(),
+        metrics.pop_profiles(),
+    )
 
-    # Initialaze the time to the start of the night. Start by getting a conditions object for some time in the night
-    # in question, which will have the sunset time:
-    observatory.mjd = NIGHT.mjd
-    conditions = observatory.return_conditions()
 
-    # Now that we have a conditions object in the night we want, get the sunset time from it to get the specific time
-    # for the start of observing:
-    start_mjd = conditions.sun_n12_setting
+def iter_night_reward_dfs(freq="10T", chunk_size=NIGHT_REWARD_CHUNK_SIZE, night=NIGHT):
+    """Compute survey rewards through the night, a slice of time at a time.
 
-    # Now, create a conditions object for this specific time we want, and update the scheduler for that time:
-    observatory.mjd = start_mjd
-    conditions = observatory.return_conditions()
-    scheduler.update_conditions(conditions)
+    Parameters
+    ----------
+    freq : `str`, optional
+        Frequency of the sample times, by default "10T"
+    chunk_size : `int`, optional
+        Number of sample times in each slice,
+        by default ``NIGHT_REWARD_CHUNK_SIZE``.
+    night : `astropy.time.Time`, optional
+        The night, by default ``NIGHT``.
 
+    Yields
+    ------
+    reward_df : `pandas.DataFrame`
+        Rewards for each survey at each time in the next slice of the night.
+    """
+    night_context = get_night_context(night)
     sample_times = pd.date_range(
-        Time(conditions.sun_n12_setting, format="mjd", scale="utc").datetime,
-        Time(conditions.sun_n12_rising, format="mjd", scale="utc").datetime,
+        Time(night_context.start_mjd, format="mjd", scale="utc").datetime,
+        Time(night_context.end_mjd, format="mjd", scale="utc").datetime,
         freq=freq,
     )
 
-    reward_df_time_list = []
-    for pd_time in sample_times:
-        ap_time = Time(pd_time)
-        observatory.mjd = ap_time.mjd
-        conditions = observatory.return_conditions()
-        this_time_reward_df = reward_bfs_df(scheduler, conditions)
-        this_time_reward_df["mjd"] = ap_time.mjd
-        this_time_reward_df["time"] = pd_time
-        reward_df_time_list.append(this_time_reward_df)
-
-    return pd.concat(reward_df_time_list).reset_index()
+    # Submit every slice of the night to the worker processes at once, and
+    # yield the results in time order as they become available. Requested
+    # profiles of spans run by the workers are passed on with the first.
+    worker_pool = get_scheduler_pool(night)
+    profile_spans = metrics.pop_profile_requests()
+    futures = [
+        worker_pool.submit(
+            _process_night_reward_chunk,
+            sample_times[chunk_start : chunk_start + chunk_size],
+            night,
+            profile_spans if chunk_start == 0 else (),
+        )
+        for chunk_start in range(0, len(sample_times), chunk_size)
+    ]
+    try:
+        for future in futures:
+            with metrics.span("wait for night reward chunk"):
+                reward_df, worker_spans, worker_profiles = future.result()
+            metrics.merge_spans(worker_spans, worker_profiles)
+            metrics.increment("night reward samples", reward_df.time.nunique())
+            yield reward_df
+    finally:
+        for future in futures:
+            future.cancel()
 
 
-def _make_night_reward_plot(freq="10T"):
-    proc = worker_pool.submit(_process_night_reward_df, freq)
-    night_reward_df = proc.result()
+def _make_night_reward_plot():
+    # The surveys are known before any rewards are computed, so make the
+    # figure with an empty data source for each survey, to be filled as
+    # the rewards are computed.
+    survey_tiers = dict()
+    for list_index, survey_list in enumerate(get_scheduler().survey_lists):
+        for survey in survey_list:
+            survey_tiers.setdefault(survey.survey_name, f"tier {list_index}")
 
     night_reward_ds = dict()
-    for survey_name, reward_df in night_reward_df.groupby("survey_name"):
-        survey_reward_ds = bokeh.models.ColumnDataSource(reward_df.sort_values("time"))
-        night_reward_ds[survey_name] = survey_reward_ds
+    for survey_name in sorted(survey_tiers):
+        night_reward_ds[survey_name] = bokeh.models.ColumnDataSource(
+            {column: [] for column in NIGHT_REWARD_COLUMNS}
+        )
 
     survey_colors = dict(
         zip(night_reward_ds.keys(), bokeh.palettes.Category20[len(night_reward_ds)])
@@ -118,10 +243,7 @@ def _make_night_reward_plot(freq="10T"):
     }
     survey_dash_pattern = dict()
     for survey_name in night_reward_ds:
-        survey_tier = night_reward_df.query(
-            f'survey_name == "{survey_name}"'
-        ).tier.iloc[0]
-        survey_dash_pattern[survey_name] = tier_dash_pattern[survey_tier]
+        survey_dash_pattern[survey_name] = tier_dash_pattern[survey_tiers[survey_name]]
 
     night_rewards_fig = bokeh.plotting.figure(
         height=500,
@@ -142,17 +264,109 @@ def _make_night_reward_plot(freq="10T"):
             source=reward_ds,
         )
 
-    return night_rewards_fig
+    return night_rewards_fig, night_reward_ds
+
+
+class NightRewardStream:
+    def __init__(self, freq="10T", night=NIGHT):
+        """A night reward plot, filled in as the rewards are computed.
+
+        Parameters
+        ----------
+        freq : `str`, optional
+            Frequency of the reward sample times, by default "10T"
+        night : `astropy.time.Time`, optional
+            The night, by default ``NIGHT``.
+        """
+        self.freq = freq
+        self.night = night
+        night_rewards_fig, self.data_sources = _make_night_reward_plot()
+        self.figure = bokeh.layouts.row(night_rewards_fig, sizing_mode="stretch_width")
+        self.complete = False
+        self.error = None
+        self._reward_dfs = []
+        self._lock = threading.Lock()
+
+    def compute(self):
+        """Compute the rewards for the night, blocking until done.
+
+        Rewards are collected as they are computed, to be sent to the
+        figure by ``stream``. If computing them fails, the error is kept in
+        ``error`` (and raised), and the stream is complete.
+        """
+        try:
+            for reward_df in iter_night_reward_dfs(self.freq, night=self.night):
+                with self._lock:
+                    self._reward_dfs.append(reward_df)
+        except Exception as e:
+            self.error = e
+            raise
+        finally:
+            self.complete = True
+
+    def document_data_sources(self, doc):
+        """Return the data sources of a copy of the figure in a document.
+
+        Parameters
+        ----------
+        doc : `bokeh.document.Document`
+            A document holding a copy of ``figure``, e.g. one hydrated from a
+            snapshot of it, whose models keep the ids of the originals.
+
+        Returns
+        -------
+        data_sources : `dict`
+            The document's copies of ``data_sources``, by survey name.
+        """
+        return {
+            survey_name: doc.get_model_by_id(data_source.id)
+            for survey_name, data_source in self.data_sources.items()
+        }
+
+    def stream(self, data_sources=None, num_streamed=0):
+        """Stream computed rewards into data sources.
 
+        Parameters
+        ----------
+        data_sources : `dict`, optional
+            The data sources into which to stream, by survey name, by default
+            ``data_sources`` (those of ``figure`` itself).
+        num_streamed : `int`, optional
+            The number of reward data frames already streamed into the data
+            sources by earlier calls, by default 0.
 
-def generate_night_rewards_plot():
+        Returns
+        -------
+        num_streamed : `int`
+            The number of reward data frames streamed into the data sources,
+            including those from earlier calls.
+
+        Note
+        ----
+        If the data sources are in a bokeh document, this must be called with
+        the document locked, e.g. from a session callback.
+        """
+        if data_sources is None:
+            data_sources = self.data_sources
+
+        with self._lock:
+            reward_dfs = self._reward_dfs[num_streamed:]
+
+        for reward_df in reward_dfs:
+            for survey_name, survey_reward_df in reward_df.groupby("survey_name"):
+                if survey_name not in data_sources:
+                    continue
+
+                survey_reward_df = survey_reward_df.sort_values("time")
+                new_data = {
+                    column: survey_reward_df[column].tolist()
+                    for column in NIGHT_REWARD_COLUMNS
+                }
+                data_sources[survey_name].stream(new_data)
+
+        return num_streamed + len(reward_dfs)
+
+
+def generate_night_rewards_plot(night_context):
     # Plotting the rewards for scheduled surveys
-    with warnings.catch_warnings():
-        warnings.filterwarnings('ignore', category=RuntimeWarning, lineno=552)
-        warnings.filterwarnings('ignore', category=FutureWarning, lineno=465)
-        return bokeh.layouts.row(
-            _make_night_reward_plot(
-                freq="10T"
-            ),
-            sizing_mode="stretch_width"
-        )
+    return NightRewardStream(freq="10T", night=night_context.night)
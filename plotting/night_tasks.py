@@ -0,0 +1,34 @@
+from functools import partial
+
+from plotting.night_context import get_night_context
+from plotting.visits import load_night_visits
+
+# Names of the tasks that compute the data shared by a night's plots
+NIGHT_CONTEXT_TASK = "night_context"
+FOOTPRINT_TASK = "footprint"
+VISITS_TASK = "visits"
+
+
+def _footprint(night_context):
+    return night_context.footprint
+
+
+def add_night_tasks(graph, night):
+    """Add the tasks that compute the data shared by a night's plots.
+
+    Parameters
+    ----------
+    graph : `plotting.task_graph.TaskGraph`
+        The graph to which to add the tasks.
+    night : `astropy.time.Time`
+        The night.
+
+    Note
+    ----
+    The tasks are ``NIGHT_CONTEXT_TASK`` (the night's
+    `plotting.night_context.NightContext`), and ``FOOTPRINT_TASK`` and
+    ``VISITS_TASK``, which both depend on it.
+    """
+    graph.add(NIGHT_CONTEXT_TASK, partial(get_night_context, night))
+    graph.add(FOOTPRINT_TASK, _footprint, (NIGHT_CONTEXT_TASK,))
+    graph.add(VISITS_TASK, load_night_visits, (NIGHT_CONTEXT_TASK,))
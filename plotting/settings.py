@@ -1,8 +1,15 @@
 import gzip
+import hashlib
+import json
+import os
 import pickle
+import threading
+import time
 
 from astropy.time import Time
 
+from plotting import metrics
+
 
 # Configuration
 # This section is for parameters that users may want to change or configure.
@@ -13,17 +20,247 @@ NIGHT = Time("2023-10-04", scale="utc")
 TIMEZONE = "Chile/Continental"
 SIMULATE_NIGHT = False
 
+# Visits from the baseline simulation are loaded for the briefing night plus
+# this many days before it, reading at most VISIT_CHUNK_SIZE rows at a time.
+VISIT_LOOKBACK_DAYS = 7
+VISIT_CHUNK_SIZE = 50000
+
+# When there are more than VISIT_LOD_THRESHOLD visits, visits before the
+# briefing night are shown as counts in healpixels of VISIT_LOD_NSIDE (for
+# each band), rather than individually. A week of visits is typically about
+# 5000, so they are binned with the default VISIT_LOOKBACK_DAYS.
+VISIT_LOD_THRESHOLD = 2000
+VISIT_LOD_NSIDE = 32
+
+# Number of processes among which to split the night reward sample times,
+# and the number of sample times each process computes at a time before
+# the results are added to the plot.
+NIGHT_REWARD_PROCESSES = os.cpu_count()
+NIGHT_REWARD_CHUNK_SIZE = 6
+# Each pool of worker processes is forked with the scheduler updated for
+# one night, so keep pools for up to this many nights.
+NIGHT_REWARD_POOLS = 2
+# Number of nights for which to keep the observatory, twilight times and
+# conditions (with the most recently used kept).
+NIGHT_CONTEXTS = 4
+
+# Whether to check that each survey's reward from the scheduler's reward_df
+# matches the reward computed directly by the survey: "off", "always", or
+# "sampled" to check a randomly chosen REWARD_CHECK_FRACTION of them.
+REWARD_CHECK = "off"
+REWARD_CHECK_FRACTION = 0.02
+
+# Directory in which to keep a faster loading snapshot of the scheduler
+# (None to always load SCHEDULER_FNAME), and the snapshot compression:
+# None, "lz4" (requires the lz4 package) or "zstd" (requires zstandard).
+SCHEDULER_SNAPSHOT_DIR = None
+SCHEDULER_SNAPSHOT_COMPRESSION = None
+
+# Number of generated plots (for any night) to keep, and the directory in
+# which to also keep them on disk (None to keep them only in memory), so that
+# a restarted server can serve them straight away.
+FIGURE_CACHE_SIZE = 12
+FIGURE_CACHE_DIR = None
+# Number of seconds after a plot fails to be generated before it is tried
+# again, if it is requested.
+FIGURE_ERROR_RETRY_SECONDS = 60
+# How often to check whether the scheduler file has changed, so that the
+# cached plots are generated again from it without waiting for a request.
+SCHEDULER_CHECK_SECONDS = 30
+# Number of nights, starting with NIGHT, for which to generate the plots in
+# the background when the server starts.
+PREGENERATE_NIGHTS = 2
+# Number of nights for which to keep the astronomical events shown on the
+# briefing page.
+ASTRONOMICAL_EVENTS_NIGHTS = 8
+
 BAND_COLOURS = dict(u='#56b4e9', g='#008060', r='#ff4000', i='#850000', z='#6600cc', y='#000000')
 
 
 # Load the instance of the scheduler we will be using to schedule the night:
-def load_scheduler(fname=SCHEDULER_FNAME):
-    opener = gzip.open if fname.endswith(".gz") else open
-    with opener(fname, "rb") as pickle_io:
-        scheduler, conditions = pickle.load(pickle_io)
+def _open_snapshot(fname, mode, compression=SCHEDULER_SNAPSHOT_COMPRESSION):
+    if compression is None:
+        return open(fname, mode)
+    elif compression == "lz4":
+        import lz4.frame
+
+        return lz4.frame.open(fname, mode)
+    elif compression == "zstd":
+        import zstandard
+
+        return zstandard.open(fname, mode)
+    else:
+        raise ValueError(f"Unknown scheduler snapshot compression {compression}")
+
+
+def _source_hash(fname, snapshot_dir):
+    """Return the sha256 of a file, reusing the last hash if it is unchanged."""
+    stat = os.stat(fname)
+    hash_fname = os.path.join(snapshot_dir, "scheduler_source.json")
+    try:
+        with open(hash_fname, "r") as hash_io:
+            source = json.load(hash_io)
+        if (source["fname"], source["mtime_ns"], source["size"]) == (
+            os.path.abspath(fname),
+            stat.st_mtime_ns,
+            stat.st_size,
+        ):
+            return source["sha256"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    sha256 = hashlib.sha256()
+    with open(fname, "rb") as source_io:
+        for block in iter(lambda: source_io.read(2**20), b""):
+            sha256.update(block)
+
+    source = {
+        "fname": os.path.abspath(fname),
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": sha256.hexdigest(),
+    }
+    with open(hash_fname, "w") as hash_io:
+        json.dump(source, hash_io)
+
+    return source["sha256"]
+
+
+def scheduler_version(fname=SCHEDULER_FNAME):
+    """Return a short string identifying the contents of a scheduler file.
+
+    The version is made from the path, modification time, and size of the
+    file, rather than its contents, so that it is cheap to check often.
+
+    Parameters
+    ----------
+    fname : `str`, optional
+        The scheduler file name, by default ``SCHEDULER_FNAME``.
 
-    scheduler.update_conditions(conditions)
+    Returns
+    -------
+    version : `str`
+        The version. If the file cannot be read (e.g. while it is being
+        replaced), the version of the scheduler already loaded, if any.
+    """
+    try:
+        stat = os.stat(fname)
+    except OSError as e:
+        print(f"Could not read scheduler file {fname}: {e}")
+        if fname == SCHEDULER_FNAME and _scheduler_version is not None:
+            return _scheduler_version
+        return "missing"
+
+    source = f"{os.path.abspath(fname)}:{stat.st_mtime_ns}:{stat.st_size}"
+    return hashlib.sha256(source.encode()).hexdigest()[:16]
+
+
+def load_scheduler(
+    fname=SCHEDULER_FNAME,
+    snapshot_dir=SCHEDULER_SNAPSHOT_DIR,
+    compression=SCHEDULER_SNAPSHOT_COMPRESSION,
+):
+    """Load a scheduler and its conditions, and update it for the conditions.
+
+    Parameters
+    ----------
+    fname : `str`, optional
+        The (optionally gzipped) pickle with the scheduler and conditions,
+        by default ``SCHEDULER_FNAME``.
+    snapshot_dir : `str`, optional
+        Directory in which to keep a snapshot of the unpickled scheduler,
+        by default ``SCHEDULER_SNAPSHOT_DIR``. If the snapshot of the current
+        contents of ``fname`` exists, it is loaded instead of ``fname``;
+        otherwise, it is written after loading ``fname``.
+    compression : `str`, optional
+        Compression of the snapshot, by default
+        ``SCHEDULER_SNAPSHOT_COMPRESSION``.
+
+    Returns
+    -------
+    scheduler : `rubin_sim.scheduler.schedulers.Core_scheduler`
+        The scheduler.
+    """
+    start_time = time.perf_counter()
+
+    snapshot_fname = None
+    if snapshot_dir is not None:
+        os.makedirs(snapshot_dir, exist_ok=True)
+        suffix = "" if compression is None else f".{compression}"
+        snapshot_fname = os.path.join(
+            snapshot_dir,
+            f"scheduler_{_source_hash(fname, snapshot_dir)}.pickle{suffix}",
+        )
+
+    with metrics.profiled("load scheduler"):
+        if snapshot_fname is not None and os.path.exists(snapshot_fname):
+            loaded_fname = snapshot_fname
+            with _open_snapshot(snapshot_fname, "rb", compression) as pickle_io:
+                scheduler, conditions = pickle.load(pickle_io)
+        else:
+            loaded_fname = fname
+            opener = gzip.open if fname.endswith(".gz") else open
+            with opener(fname, "rb") as pickle_io:
+                scheduler, conditions = pickle.load(pickle_io)
+
+            if snapshot_fname is not None:
+                # Write to a temporary file and rename, so that other processes
+                # never load a partially written snapshot.
+                tmp_fname = f"{snapshot_fname}.{os.getpid()}.tmp"
+                with _open_snapshot(tmp_fname, "wb", compression) as pickle_io:
+                    pickle.dump(
+                        (scheduler, conditions), pickle_io, pickle.HIGHEST_PROTOCOL
+                    )
+                os.replace(tmp_fname, snapshot_fname)
+
+    load_time = time.perf_counter()
+    with metrics.profiled("update scheduler conditions"):
+        scheduler.update_conditions(conditions)
+    update_time = time.perf_counter()
+    metrics.record("load scheduler", load_time - start_time)
+    metrics.record("update scheduler conditions", update_time - load_time)
+
+    print(
+        f"Loaded scheduler from {loaded_fname} in {load_time - start_time:.2f} s"
+        f" and updated its conditions in {update_time - load_time:.2f} s"
+        f" (pid {os.getpid()})"
+    )
     return scheduler
 
 
-scheduler = load_scheduler()
+# The scheduler is only loaded when it is first needed, so that processes
+# that do not use it do not pay to load it, and is loaded again when the
+# version of SCHEDULER_FNAME changes.
+_scheduler = None
+_scheduler_version = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the scheduler, loading it on first use or if its file changed.
+
+    Returns
+    -------
+    scheduler : `rubin_sim.scheduler.schedulers.Core_scheduler`
+        The scheduler.
+    """
+    global _scheduler, _scheduler_version
+    with _scheduler_lock:
+        # Get the version before loading, so that a file replaced while it
+        # is loaded is loaded again next time.
+        version = scheduler_version()
+        if _scheduler is None or version != _scheduler_version:
+            _scheduler = load_scheduler()
+            _scheduler_version = version
+
+    return _scheduler
+
+
+def _reset_scheduler_lock():
+    # A forked process keeps a scheduler already loaded by its parent,
+    # but may inherit the lock held by a thread that is still loading it.
+    global _scheduler_lock
+    _scheduler_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_scheduler_lock)
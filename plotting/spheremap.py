@@ -1,6 +1,8 @@
+import os
+import threading
 from collections import OrderedDict, namedtuple
-from collections.abc import Iterable
 from copy import deepcopy
+from functools import lru_cache
 
 import numpy as np
 import pandas as pd
@@ -15,11 +17,23 @@ import astropy.visualization
 from rubin_sim.utils.Site import Site
 from rubin_sim.utils import calcLmstLast
 from rubin_sim.utils import altAzPaFromRaDec, raDecFromAltAz
-from rubin_sim.utils import approx_altAz2RaDec, approx_RaDec2AltAz
+from rubin_sim.utils import approx_altAz2RaDec
 from rubin_sim.utils import ObservationMetaData
 
+from plotting import metrics
+
 ProjSliders = namedtuple("ProjSliders", ["alt", "az", "mjd"])
 
+# Data source columns are sent to the browser as float32, except for these,
+# which need more precision.
+FLOAT64_COLUMNS = ("min_mjd", "max_mjd")
+
+# Level of detail for markers: when there are more than ``threshold``
+# markers, those with a ``min_mjd`` before ``mjd`` (or all of them, if ``mjd``
+# is None) are replaced by one marker per healpixel of ``nside`` (and group)
+# with the number of markers in it, and a size that grows with the number.
+MarkerLOD = namedtuple("MarkerLOD", ["threshold", "nside", "mjd"])
+
 # Full coordinate transforms are much slower, and the difference
 # with the fast approximations are not important for this use.
 APPROX_COORD_TRANSFORMS = True
@@ -29,6 +43,169 @@ APPROX_COORD_TRANSFORMS = True
 # Define an "almost 90" to get consistent behaviour.
 ALMOST_90 = np.degrees(np.arccos(0) - 2 * np.finfo(float).resolution)
 
+# Healpix pixel boundaries and their (time independent) projections are
+# cached, keyed by nside, bound_step and the projection parameters.
+# Up to HEALPIX_GEOMETRY_CACHE_SIZE geometries are kept in memory; if
+# HEALPIX_GEOMETRY_CACHE_DIR is set, geometries are also saved there
+# and memory mapped when loaded again.
+HEALPIX_GEOMETRY_CACHE_SIZE = 8
+HEALPIX_GEOMETRY_CACHE_DIR = None
+
+# Number of orthographic projection rotation matrices (one per site latitude
+# and LST) to keep.
+ORTH_ZENITH_ROTATION_CACHE_SIZE = 256
+
+# Time series projections (see SphereMap.project_times) are returned as a
+# float32 array with these fields, computed in chunks of about
+# PROJECTION_CHUNK_SIZE (point, time) pairs at a time.
+ProjectionCube = namedtuple("ProjectionCube", ["mjd", "fields", "values"])
+PROJECTION_CUBE_FIELDS = ("alt", "az", "x_orth", "y_orth", "z_orth", "x_hz", "y_hz")
+PROJECTION_CHUNK_SIZE = 2**20
+
+# Number of circles (by center, radius and step) whose equatorial coordinates
+# to keep, so that constant circles such as the ecliptic and galactic plane
+# are computed only once.
+CIRCLE_COORDS_CACHE_SIZE = 64
+
+
+class HealpixGeometryCache:
+    def __init__(self, max_size=HEALPIX_GEOMETRY_CACHE_SIZE, cache_dir=None):
+        """A least-recently-used cache of healpix geometry.
+
+        Parameters
+        ----------
+        max_size : `int`, optional
+            Maximum number of geometries to keep in memory,
+            by default ``HEALPIX_GEOMETRY_CACHE_SIZE``.
+        cache_dir : `str`, optional
+            Directory in which to store geometries on disk,
+            None to keep them only in memory. By default None.
+        """
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self._geometries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key_dir(self, key):
+        key_name = "_".join(str(k) for k in np.hstack(key))
+        return os.path.join(self.cache_dir, f"healpix_geometry_{key_name}")
+
+    def _load(self, key):
+        key_dir = self._key_dir(key)
+        if not os.path.isdir(key_dir):
+            return None
+
+        geometry = {}
+        for fname in os.listdir(key_dir):
+            name, ext = os.path.splitext(fname)
+            if ext == ".npy":
+                geometry[name] = np.load(os.path.join(key_dir, fname), mmap_mode="r")
+        return geometry
+
+    def _save(self, key, geometry):
+        key_dir = self._key_dir(key)
+        # Write to a temporary directory and rename, so other processes
+        # never see a partially written geometry.
+        tmp_dir = f"{key_dir}.{os.getpid()}.tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name, values in geometry.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), values)
+        try:
+            os.rename(tmp_dir, key_dir)
+        except OSError:
+            # Another process got there first
+            for fname in os.listdir(tmp_dir):
+                os.remove(os.path.join(tmp_dir, fname))
+            os.rmdir(tmp_dir)
+
+    def get(self, key, compute):
+        """Get a geometry, computing it if it is not already cached.
+
+        Parameters
+        ----------
+        key : `tuple`
+            Hashable key identifying the geometry.
+        compute : `Callable`
+            Function with no arguments that computes the geometry,
+            returning a `dict` of `numpy.ndarray`.
+
+        Returns
+        -------
+        geometry : `dict` [`str`, `numpy.ndarray`]
+            The geometry, with read-only arrays.
+        """
+        with self._lock:
+            if key in self._geometries:
+                self._geometries.move_to_end(key)
+                return self._geometries[key]
+
+        geometry = None
+        if self.cache_dir is not None:
+            geometry = self._load(key)
+
+        if geometry is None:
+            geometry = compute()
+            if self.cache_dir is not None:
+                self._save(key, geometry)
+
+        for values in geometry.values():
+            values.flags.writeable = False
+
+        with self._lock:
+            self._geometries[key] = geometry
+            self._geometries.move_to_end(key)
+            while len(self._geometries) > self.max_size:
+                self._geometries.popitem(last=False)
+
+        return geometry
+
+    def clear(self):
+        """Remove all geometries from the in-memory cache."""
+        with self._lock:
+            self._geometries.clear()
+
+
+HEALPIX_GEOMETRY_CACHE = HealpixGeometryCache(
+    HEALPIX_GEOMETRY_CACHE_SIZE, HEALPIX_GEOMETRY_CACHE_DIR
+)
+
+# Static overlays (graticules, the ecliptic, the galactic plane) are the
+# same (except for their orthographic and horizon projections) for every map
+# with the same laea projection, so their geometry is cached in memory in the
+# same way.
+OVERLAY_CACHE_SIZE = 16
+OVERLAY_CACHE = HealpixGeometryCache(OVERLAY_CACHE_SIZE)
+
+# Overlays that can be added to any map by name, with functions that take
+# the map and compute the time independent geometry of the overlay, and the
+# name of the map attribute with the default line keywords for the overlay.
+Overlay = namedtuple("Overlay", ["geometry", "line_kwargs"])
+OVERLAYS = dict()
+
+# The overlays added by SphereMap.decorate
+DECORATION_OVERLAYS = ("graticules", "ecliptic", "galactic_plane")
+
+
+def register_overlay(name, geometry, line_kwargs="default_graticule_line_kwargs"):
+    """Register an overlay that can be added to maps by name.
+
+    Parameters
+    ----------
+    name : `str`
+        The name of the overlay.
+    geometry : `Callable`
+        Function that takes a ``SphereMap`` and returns the time independent
+        geometry of the overlay on it: a `dict` of `numpy.ndarray` with
+        ``ra``, ``decl``, ``x_hp``, ``y_hp``, ``z_hp``, ``x_laea``,
+        ``y_laea``, ``x_moll`` and ``y_moll`` columns, with NaNs separating
+        lines.
+    line_kwargs : `str`, optional
+        The name of the ``SphereMap`` attribute with default keywords for
+        ``bokeh.plotting.figure.Figure.line``, by default
+        "default_graticule_line_kwargs".
+    """
+    OVERLAYS[name] = Overlay(geometry, line_kwargs)
+
 
 class SphereMap:
     alt_limit = 0
@@ -82,17 +259,53 @@ class SphereMap:
         self.figure = self.plot
         self.add_sliders()
 
+    @property
+    def mjd(self):
+        """The Modified Julian Date."""
+        return self._mjd
+
+    @mjd.setter
+    def mjd(self, value):
+        self._mjd = value
+        # The sidereal times of the new MJD are computed when next needed.
+        self._sidereal_times = None
+
+    def local_sidereal_times(self, mjds=None):
+        """Return the local mean and apparent sidereal times at the site.
+
+        Parameters
+        ----------
+        mjds : `float` or `numpy.ndarray`, optional
+            The Modified Julian Dates, by default None for ``mjd``, whose
+            sidereal times are computed once and kept until ``mjd`` is set.
+
+        Returns
+        -------
+        lmst : `float` or `numpy.ndarray`
+            The local mean sidereal times, in degrees.
+        last : `float` or `numpy.ndarray`
+            The local apparent sidereal times, in degrees.
+        """
+        if mjds is not None:
+            return local_sidereal_times(mjds, self.site.longitude_rad)
+
+        key = (self.mjd, self.site.longitude_rad)
+        if self._sidereal_times is None or self._sidereal_times[0] != key:
+            self._sidereal_times = (key, local_sidereal_times(*key))
+
+        return self._sidereal_times[1]
+
     @property
     def lst(self):
         """Return the Local Sidereal Time."""
-        lst = calcLmstLast(self.mjd, self.site.longitude_rad)[1] * 360.0 / 24.0
+        _, lst = self.local_sidereal_times()
         return lst
 
     @lst.setter
     def lst(self, value):
         """Modify the MJD to match the LST, keeping the same (UT) day."""
         mjd_start = np.floor(self.mjd)
-        lst_start = calcLmstLast(mjd_start, self.site.longitude_rad)[1] * 360.0 / 24.0
+        _, lst_start = self.local_sidereal_times(mjd_start)
         self.mjd = mjd_start + ((value - lst_start) % 360) / 360.9856405809225
 
     @property
@@ -163,26 +376,11 @@ class SphereMap:
         z : `numpy.ndarray`
             Orthographic z coordinate (positive toward the viewer)
         """
-        x1, y1, z1 = rotate_cart(0, 0, 1, -90, hpx, hpy, hpz)
-        x2, y2, z2 = rotate_cart(1, 0, 0, self.site.latitude + 90, x1, y1, z1)
-
-        npole_x1, npole_y1, npole_z1 = rotate_cart(0, 0, 1, -90, 0, 0, 1)
-        npole_x2, npole_y2, npole_z2 = rotate_cart(
-            1, 0, 0, self.site.latitude + 90, npole_x1, npole_y1, npole_z1
-        )
-        x3, y3, z3 = rotate_cart(npole_x2, npole_y2, npole_z2, -self.lst, x2, y2, z2)
-
-        # x3, y3, z3 have the center right, now rotate it so that north is "up"
-        # the 2-3 transform is about the axis through the n pole, so
-        # the n pole is the same in 3 an 2.
-
-        # Find the direction of the north pole, angle form +x axis toward
-        # +y axis
-        npole_x3, npole_y3 = npole_x2, npole_y2
-        orient = np.degrees(np.arctan2(npole_y3, npole_x3))
-
-        # To the n pole on the y axis, we must rotate it the rest of the 90 deg
-        x4, y4, z4 = rotate_cart(0, 0, 1, 90 - orient, x3, y3, z3)
+        # All of the rotations are applied at once, with one matrix product,
+        # to a (3, ...) array of the vectors.
+        rotation = orth_zenith_rotation(self.site.latitude, self.lst)
+        hp_vecs = np.stack(np.broadcast_arrays(hpx, hpy, hpz))
+        orth = np.matmul(rotation, hp_vecs.reshape(3, -1)).reshape(hp_vecs.shape)
 
         # In astronomy, we are looking out of the sphere from the center to the
         # back (which naturally results in west to the right).
@@ -191,18 +389,16 @@ class SphereMap:
         # So, set the points with positive z to NaN so they are
         # not shown, because they are behind the observer.
 
-        # Use np.finfo(z3[0]).resolution instead of exactly 0, because the
+        # Use np.finfo(orth.dtype).resolution instead of exactly 0, because the
         # assorted trig operations result in values slightly above or below
         # 0 when the horizon is in principle exactly 0, and this gives an
         # irregularly dotted/dashed appearance to the horizon if
         # a cutoff of exactly 0 is used.
 
-        orth_invisible = z4 > np.finfo(z4.dtype).resolution
-        x4[orth_invisible] = np.nan
-        y4[orth_invisible] = np.nan
-        z4[orth_invisible] = np.nan
+        orth[:, orth[2] > np.finfo(orth.dtype).resolution] = np.nan
 
-        return x4, y4, z4
+        x, y, z = orth
+        return x, y, z
 
     def eq_to_horizon(self, ra, decl, degrees=True, cart=True):
         """Convert equatorial to horizon coordinates
@@ -227,65 +423,179 @@ class SphereMap:
 
         Azimuth is east of north
         """
+        alt, az, x, y = self.horizon_coords(ra, decl, degrees=degrees)
+        if cart:
+            return x, y
 
-        # Due to a bug in altAzPaFromRaDec, it won't
-        # work on pandas Series, so convert to a numpy
-        # array if necessary.
-        if isinstance(ra, pd.Series):
-            ra = ra.values
+        return alt, az
 
-        if isinstance(decl, pd.Series):
-            decl = decl.values
+    def horizon_coords(self, ra, decl, degrees=True, out=None):
+        """Convert equatorial to horizon coordinates and their projection.
 
-        observation_metadata = ObservationMetaData(mjd=self.mjd, site=self.site)
+        Parameters
+        ----------
+        ra : `numpy.ndarray`
+            Values for Right Ascension
+        decl : `numpy.ndarray`
+            Values for declination
+        degrees : bool, optional
+            Values are in degrees (if False, values are in radians),
+            by default True
+        out : `tuple` [`numpy.ndarray`], optional
+            Arrays of float with the shape of ``ra`` and ``decl`` in which to
+            put alt, az, x, and y, by default None (to make new arrays).
+
+        Returns
+        -------
+        alt : `numpy.ndarray`
+            Altitude (in degrees if ``degrees``, otherwise radians)
+        az : `numpy.ndarray`
+            Azimuth, east of north (in degrees if ``degrees``, otherwise
+            radians)
+        x : `numpy.ndarray`
+            Horizon projection x coordinate, with +x pointing west (NaN
+            below ``alt_limit``)
+        y : `numpy.ndarray`
+            Horizon projection y coordinate, with +y pointing north (NaN
+            below ``alt_limit``)
+        """
+        ra = np.asarray(ra, dtype=float)
+        decl = np.asarray(decl, dtype=float)
         if degrees:
-            ra_deg, decl_deg = ra, decl
+            ra_rad, decl_rad = np.radians(ra), np.radians(decl)
         else:
-            ra_deg, decl_deg = np.degrees(ra), np.degrees(decl)
+            ra_rad, decl_rad = ra, decl
+
         if APPROX_COORD_TRANSFORMS:
-            alt, az = approx_RaDec2AltAz(
-                ra_deg, decl_deg, self.site.latitude, self.site.longitude, self.mjd
+            lmst, _ = self.local_sidereal_times()
+            alt, az, x, y = horizon_kernel(
+                ra_rad,
+                decl_rad,
+                np.radians(lmst),
+                self.site.latitude_rad,
+                np.radians(self.alt_limit),
+                out=out,
             )
         else:
-            alt, az, _ = altAzPaFromRaDec(ra_deg, decl_deg, observation_metadata)
+            observation_metadata = ObservationMetaData(mjd=self.mjd, site=self.site)
+            alt_deg, az_deg, _ = altAzPaFromRaDec(
+                np.degrees(ra_rad), np.degrees(decl_rad), observation_metadata
+            )
+            if out is None:
+                out = tuple(np.empty(np.shape(alt_deg)) for _ in range(4))
+            alt, az, x, y = out
+            np.radians(alt_deg, out=alt)
+            np.radians(az_deg, out=az)
+            horizon_projection(alt, az, np.radians(self.alt_limit), out=(x, y))
 
-        if cart:
-            zd = np.pi / 2 - np.radians(alt)
-            x = -zd * np.sin(np.radians(az))
-            y = zd * np.cos(np.radians(az))
+        if degrees:
+            np.degrees(alt, out=alt)
+            np.degrees(az, out=az)
 
-            invisible = alt < self.alt_limit
-            x[invisible] = np.nan
-            y[invisible] = np.nan
-            return x, y
+        return alt, az, x, y
 
-        if not degrees:
-            return np.radians(alt), np.radians(az)
+    def project_times(self, ra, decl, mjds):
+        """Project points at each of a sequence of times.
 
-        return alt, az
+        Parameters
+        ----------
+        ra : `numpy.ndarray`
+            Right Ascensions of the points, in degrees.
+        decl : `numpy.ndarray`
+            Declinations of the points, in degrees.
+        mjds : `numpy.ndarray`
+            The Modified Julian Dates of the times.
 
-    def make_healpix_data_source(self, hpvalues, nside=32, bound_step=1):
-        """Make a data source of healpix values, corners, and projected coords.
+        Returns
+        -------
+        cube : `ProjectionCube`
+            The MJDs, the names of the fields (``PROJECTION_CUBE_FIELDS``),
+            and the projected values: a `numpy.ndarray` of float32 with
+            shape (times, fields, points). Altitudes and azimuths are in
+            degrees, and points not visible in a projection are NaN, as with
+            ``eq_to_horizon`` and ``to_orth_zenith``.
+
+        Note
+        ----
+        Only the sidereal time changes with the time, so the trig of the
+        declinations and the healpy vectors of the points are computed once,
+        and each time needs only the hour angles and one rotation matrix.
+        """
+        ra = np.ravel(np.asarray(ra, dtype=float))
+        decl = np.ravel(np.asarray(decl, dtype=float))
+        mjds = np.atleast_1d(np.asarray(mjds, dtype=float))
+        lmst, last = self.local_sidereal_times(mjds)
+
+        values = np.empty((len(mjds), len(PROJECTION_CUBE_FIELDS), len(ra)), dtype=np.float32)
+        fields = {field: i for i, field in enumerate(PROJECTION_CUBE_FIELDS)}
+
+        ra_rad = np.radians(ra)
+        decl_rad = np.radians(decl)
+        hp_vecs = hp.ang2vec(ra, decl, lonlat=True).T
+
+        times_per_chunk = max(1, PROJECTION_CHUNK_SIZE // max(1, len(ra)))
+        for start in range(0, len(mjds), times_per_chunk):
+            times = slice(start, start + times_per_chunk)
+
+            # Horizon coordinates, as in horizon_coords
+            alt, az, x_hz, y_hz = horizon_kernel(
+                ra_rad,
+                decl_rad,
+                np.radians(lmst[times])[:, np.newaxis],
+                self.site.latitude_rad,
+                np.radians(self.alt_limit),
+            )
+            values[times, fields["alt"]] = np.degrees(alt)
+            values[times, fields["az"]] = np.degrees(az)
+            values[times, fields["x_hz"]] = x_hz
+            values[times, fields["y_hz"]] = y_hz
+
+            # Orthographic coordinates, as in to_orth_zenith, with one
+            # rotation per time (not cached, as each is used only once).
+            rotations = np.stack(
+                [
+                    orth_zenith_rotation.__wrapped__(self.site.latitude, lst)
+                    for lst in last[times]
+                ]
+            )
+            orth = np.matmul(rotations, hp_vecs)
+            orth_invisible = orth[:, 2, :] > np.finfo(orth.dtype).resolution
+            orth[np.broadcast_to(orth_invisible[:, np.newaxis, :], orth.shape)] = np.nan
+            values[times, fields["x_orth"] : fields["z_orth"] + 1] = orth
+
+        return ProjectionCube(mjds, PROJECTION_CUBE_FIELDS, values)
+
+    def healpix_geometry(self, nside=32, bound_step=1):
+        """Return the time independent geometry of healpixels on the map.
 
         Parameters
         ----------
-        hpvalues : `numpy.ndarray`
-            Healpixel values (RING pixel ordering)
         nside : int, optional
-            healpixel nside for display, by default 32
+            healpixel nside, by default 32
         bound_step : int, optional
             number of boundary points for each side of each healpixel,
             by default 1
 
         Returns
         -------
-        hpix_datasource : `bokeh.models.ColumnDataSource`
-            Data source for healpixel values and bounds.
+        geometry : `dict` [`str`, `numpy.ndarray`]
+            Read-only arrays with healpixel boundary vectors (``bounds_vec``),
+            centers (``center_ra``, ``center_decl``), and the coordinates
+            (``ra``, ``decl``) and projections (``x_laea``, ``y_laea``,
+            ``x_moll``, ``y_moll``) of each boundary point, with points
+            near projection discontinuities set to NaN.
+
+        Note
+        ----
+        Geometries are shared between maps through
+        ``HEALPIX_GEOMETRY_CACHE``, so must not be modified.
         """
-        values = np.copy(hpvalues)
-        values[np.isnan(values)] = hp.UNSEEN
-        values = hp.ud_grade(hpvalues, nside)
-        values[values == hp.UNSEEN] = np.nan
+        key = (nside, bound_step, self.laea_rot, self.laea_limit)
+        return HEALPIX_GEOMETRY_CACHE.get(
+            key, lambda: self._compute_healpix_geometry(nside, bound_step)
+        )
+
+    def _compute_healpix_geometry(self, nside, bound_step):
         npix = hp.nside2npix(nside)
         npts = npix * 4 * bound_step
         hpids = np.arange(npix)
@@ -294,98 +604,204 @@ class SphereMap:
         hpix_bounds_vec_long = np.moveaxis(hpix_bounds_vec, 1, 2).reshape((npts, 3))
         ra, decl = hp.vec2ang(hpix_bounds_vec_long, lonlat=True)
         center_ra, center_decl = hp.pix2ang(nside, hpids, lonlat=True)
-        x_hz, y_hz = self.eq_to_horizon(ra, decl)
-
-        xs, ys, zs = self.to_orth_zenith(
-            hpix_bounds_vec[:, 0, :], hpix_bounds_vec[:, 1, :], hpix_bounds_vec[:, 2, :]
-        )
 
         x_laea, y_laea = self.laea_proj.vec2xy(hpix_bounds_vec_long.T)
         x_moll, y_moll = self.moll_proj.vec2xy(hpix_bounds_vec_long.T)
 
-        # in hpix_bounds, each row corresponds to a healpixels, and columns
-        # contain lists where elements of the lists correspond to corners.
-        hpix_bounds = pd.DataFrame(
-            {
-                "hpid": hpids,
-                "x_hp": hpix_bounds_vec[:, 0, :].tolist(),
-                "y_hp": hpix_bounds_vec[:, 1, :].tolist(),
-                "z_hp": hpix_bounds_vec[:, 2, :].tolist(),
-                "ra": ra.reshape(npix, 4).tolist(),
-                "decl": decl.reshape(npix, 4).tolist(),
-                "x_orth": xs.tolist(),
-                "y_orth": ys.tolist(),
-                "z_orth": zs.tolist(),
-                "x_laea": x_laea.reshape(npix, 4).tolist(),
-                "y_laea": y_laea.reshape(npix, 4).tolist(),
-                "x_moll": x_moll.reshape(npix, 4).tolist(),
-                "y_moll": y_moll.reshape(npix, 4).tolist(),
-                "x_hz": x_hz.reshape(npix, 4).tolist(),
-                "y_hz": y_hz.reshape(npix, 4).tolist(),
-            }
-        )
-
-        # in hpix_cornors, each row corresponds to one corner of one
-        # healpix, identified by the hpid column.
-        explode_cols = list(set(hpix_bounds.columns) - set(["hpid"]))
-        hpix_corners = hpix_bounds.explode(column=explode_cols)
-
         # Hide points near the discontinuity at the pole in laea
         if self.site.latitude < 0:
-            hide_laea = hpix_corners["decl"] > self.laea_limit
+            hide_laea = decl > self.laea_limit
         else:
-            hide_laea = hpix_corners["decl"] < self.laea_limit
+            hide_laea = decl < self.laea_limit
 
-        hpix_corners.loc[hide_laea, ["x_laea", "y_laea"]] = np.NaN
+        x_laea[hide_laea] = np.nan
+        y_laea[hide_laea] = np.nan
 
         # Hide points near the discontiuities at ra=180 in Mollweide
         resol = np.degrees(hp.nside2resol(nside))
-        hide_moll = np.abs(hpix_corners["ra"] - 180) < (
-            resol / np.cos(np.radians(decl))
-        )
-        hpix_corners.loc[hide_moll, ["x_moll", "y_moll"]] = np.NaN
+        hide_moll = np.abs(ra - 180) < (resol / np.cos(np.radians(decl)))
+        x_moll[hide_moll] = np.nan
+        y_moll[hide_moll] = np.nan
+
+        geometry = {
+            "bounds_vec": hpix_bounds_vec,
+            "ra": ra,
+            "decl": decl,
+            "center_ra": center_ra,
+            "center_decl": center_decl,
+            "x_laea": x_laea,
+            "y_laea": y_laea,
+            "x_moll": x_moll,
+            "y_moll": y_moll,
+        }
+        return geometry
 
-        hpix_corners.replace([np.inf, -np.inf], np.NaN, inplace=True)
-        hpix_data = hpix_corners.groupby("hpid").agg(lambda x: x.tolist())
-        hpix_data["center_ra"] = center_ra
-        hpix_data["center_decl"] = center_decl
-        hpix_data["value"] = values
+    @metrics.timed("healpix data source")
+    def make_healpix_data_source(self, hpvalues, nside=32, bound_step=1):
+        """Make a data source of healpix values, corners, and projected coords.
+
+        Parameters
+        ----------
+        hpvalues : `numpy.ndarray`
+            Healpixel values (RING pixel ordering)
+        nside : int, optional
+            healpixel nside for display, by default 32
+        bound_step : int, optional
+            number of boundary points for each side of each healpixel,
+            by default 1
+
+        Returns
+        -------
+        hpix_datasource : `bokeh.models.ColumnDataSource`
+            Data source for healpixel values and bounds.
+        """
+        values = np.copy(hpvalues)
+        values[np.isnan(values)] = hp.UNSEEN
+        values = hp.ud_grade(hpvalues, nside)
+        values[values == hp.UNSEEN] = np.nan
+        npix = hp.nside2npix(nside)
+        hpids = np.arange(npix)
 
         values_are_finite = np.isfinite(values)
-        finite_hpix_data = hpix_data.loc[values_are_finite, :]
         finite_hpids = hpids[values_are_finite]
         finite_values = values[values_are_finite]
 
-        def de_nanify(data):
-            data = pd.DataFrame(data.tolist()) if type(data) is not list else pd.DataFrame(data)
-            data.replace([np.inf, -np.inf, np.NaN], "NaN", inplace=True)
-            return data.values.tolist()
+        # Corner coordinates are kept as arrays with one row per healpixel
+        # (with finite values) and one column per boundary point.
+        geometry = self.healpix_geometry(nside, bound_step)
+        hpix_bounds_vec = geometry["bounds_vec"][values_are_finite]
 
-        hpix = bokeh.models.ColumnDataSource(
+        def corners(column):
+            return geometry[column].reshape(npix, -1)[values_are_finite]
+
+        ra, decl = corners("ra"), corners("decl")
+        x_hz, y_hz = self.eq_to_horizon(ra.ravel(), decl.ravel())
+
+        xs, ys, zs = self.to_orth_zenith(
+            hpix_bounds_vec[:, 0, :], hpix_bounds_vec[:, 1, :], hpix_bounds_vec[:, 2, :]
+        )
+
+        hpix = make_data_source(
             {
-                "hpid": de_nanify(finite_hpids),
-                "value": de_nanify(finite_values),
-                "center_ra": de_nanify(finite_hpix_data["center_ra"]),
-                "center_decl": de_nanify(finite_hpix_data["center_decl"]),
-                "ra": de_nanify(finite_hpix_data["ra"]),
-                "decl": de_nanify(finite_hpix_data["decl"]),
-                "x_hp": de_nanify(finite_hpix_data["x_hp"]),
-                "y_hp": de_nanify(finite_hpix_data["y_hp"]),
-                "z_hp": de_nanify(finite_hpix_data["z_hp"]),
-                "x_orth": de_nanify(finite_hpix_data["x_orth"]),
-                "y_orth": de_nanify(finite_hpix_data["y_orth"]),
-                "z_orth": de_nanify(finite_hpix_data["z_orth"]),
-                "x_laea": de_nanify(finite_hpix_data["x_laea"]),
-                "y_laea": de_nanify(finite_hpix_data["y_laea"]),
-                "x_moll": de_nanify(finite_hpix_data["x_moll"]),
-                "y_moll": de_nanify(finite_hpix_data["y_moll"]),
-                "x_hz": de_nanify(finite_hpix_data["x_hz"]),
-                "y_hz": de_nanify(finite_hpix_data["y_hz"]),
+                "hpid": finite_hpids,
+                "value": finite_values,
+                "center_ra": geometry["center_ra"][values_are_finite],
+                "center_decl": geometry["center_decl"][values_are_finite],
+                "ra": ragged_coords(ra),
+                "decl": ragged_coords(decl),
+                "x_hp": ragged_coords(hpix_bounds_vec[:, 0, :]),
+                "y_hp": ragged_coords(hpix_bounds_vec[:, 1, :]),
+                "z_hp": ragged_coords(hpix_bounds_vec[:, 2, :]),
+                "x_orth": ragged_coords(xs),
+                "y_orth": ragged_coords(ys),
+                "z_orth": ragged_coords(zs),
+                "x_laea": ragged_coords(corners("x_laea")),
+                "y_laea": ragged_coords(corners("y_laea")),
+                "x_moll": ragged_coords(corners("x_moll")),
+                "y_moll": ragged_coords(corners("y_moll")),
+                "x_hz": ragged_coords(x_hz.reshape(ra.shape)),
+                "y_hz": ragged_coords(y_hz.reshape(ra.shape)),
             }
         )
 
         return hpix
 
+    def graticule_geometry(
+        self,
+        min_decl=-80,
+        max_decl=80,
+        decl_space=20,
+        min_ra=0,
+        max_ra=360,
+        ra_space=30,
+        step=1,
+    ):
+        """Return the time independent geometry of equatorial graticules.
+
+        Parameters are as for ``SphereMap.make_graticule_points``.
+
+        Returns
+        -------
+        geometry : `dict` [`str`, `numpy.ndarray`]
+            Read-only arrays with the graticule names (``grat``), and the
+            coordinates (``ra``, ``decl``), healpy vectors (``x_hp``,
+            ``y_hp``, ``z_hp``) and projections (``x_laea``, ``y_laea``,
+            ``x_moll``, ``y_moll``) of points along the graticules, with
+            a row of NaNs (and a ``grat`` of None) after each graticule.
+
+        Note
+        ----
+        Geometries are shared between maps through ``OVERLAY_CACHE``,
+        so must not be modified.
+        """
+        key = (
+            min_decl,
+            max_decl,
+            decl_space,
+            min_ra,
+            max_ra,
+            ra_space,
+            step,
+            self.laea_rot,
+        )
+        return OVERLAY_CACHE.get(
+            key,
+            lambda: self._compute_graticule_geometry(
+                min_decl, max_decl, decl_space, min_ra, max_ra, ra_space, step
+            ),
+        )
+
+    def _compute_graticule_geometry(
+        self, min_decl, max_decl, decl_space, min_ra, max_ra, ra_space, step
+    ):
+        # Each row of each grid has the points of one graticule.
+        grat_decls = np.arange(min_decl, max_decl + decl_space, decl_space)
+        decl_grat_decl, decl_grat_ra = np.meshgrid(
+            grat_decls, np.arange(0, 360 + step, step), indexing="ij"
+        )
+        grat_ras = np.arange(min_ra, max_ra + step, ra_space)
+        ra_grat_ra, ra_grat_decl = np.meshgrid(
+            grat_ras, np.arange(min_decl, max_decl + step, step), indexing="ij"
+        )
+
+        # Bokeh puts gaps in lines where there are NaNs, so follow each
+        # graticule with a NaN so that different graticules are not connected.
+        ra = np.concatenate([nan_separated(decl_grat_ra), nan_separated(ra_grat_ra)])
+        decl = np.concatenate(
+            [nan_separated(decl_grat_decl), nan_separated(ra_grat_decl)]
+        )
+        grat_names = [f"decl{d}" for d in grat_decls] + [f"ra{r}" for r in grat_ras]
+        grat = np.repeat(
+            np.array(grat_names, dtype=object),
+            np.concatenate(
+                [
+                    np.full(len(grat_decls), decl_grat_ra.shape[1] + 1),
+                    np.full(len(grat_ras), ra_grat_ra.shape[1] + 1),
+                ]
+            ),
+        )
+
+        points = np.isfinite(ra)
+        grat[~points] = None
+        hp_vec = hp.ang2vec(ra[points], decl[points], lonlat=True).T
+        x_laea, y_laea = self.laea_proj.ang2xy(ra[points], decl[points], lonlat=True)
+        x_moll, y_moll = self.moll_proj.ang2xy(ra[points], decl[points], lonlat=True)
+
+        geometry = {
+            "grat": grat,
+            "ra": ra,
+            "decl": decl,
+            "x_hp": fill_points(points, hp_vec[0]),
+            "y_hp": fill_points(points, hp_vec[1]),
+            "z_hp": fill_points(points, hp_vec[2]),
+            "x_laea": fill_points(points, x_laea),
+            "y_laea": fill_points(points, y_laea),
+            "x_moll": fill_points(points, x_moll),
+            "y_moll": fill_points(points, y_moll),
+        }
+        return geometry
+
+    @metrics.timed("graticule points")
     def make_graticule_points(
         self,
         min_decl=-80,
@@ -424,141 +840,73 @@ class SphereMap:
         graticule_points : `bokeh.models.ColumnDataSource`
             Bokeh data sources defining points in graticules.
         """
-
-        # Bohek puts gaps in lines when there are NaNs in the
-        # data frame. We will be platting many graticules, and we do not
-        # want them connected, so define a "stop" element to separate
-        # different graticules.
-        stop_df = pd.DataFrame(
-            {
-                "decl": [np.nan],
-                "ra": [np.nan],
-                "grat": None,
-                "x_orth": [np.nan],
-                "y_orth": [np.nan],
-                "z_orth": [np.nan],
-                "x_laea": [np.nan],
-                "y_laea": [np.nan],
-                "x_moll": [np.nan],
-                "y_moll": [np.nan],
-                "x_hz": [np.nan],
-                "y_hz": [np.nan],
-            }
+        geometry = self.graticule_geometry(
+            min_decl, max_decl, decl_space, min_ra, max_ra, ra_space, step
         )
-        graticule_list = []
-
-        # Define points in each declination graticule
-        for decl in np.arange(min_decl, max_decl + decl_space, decl_space):
-            ra_steps = np.arange(0, 360 + step)
-            this_graticule = pd.DataFrame(
-                {
-                    "grat": f"decl{decl}",
-                    "decl": decl,
-                    "ra": ra_steps,
-                    "x_hp": np.nan,
-                    "y_hp": np.nan,
-                    "z_hp": np.nan,
-                    "x_orth": np.nan,
-                    "y_orth": np.nan,
-                    "z_orth": np.nan,
-                    "x_laea": np.nan,
-                    "y_laea": np.nan,
-                    "x_moll": np.nan,
-                    "y_moll": np.nan,
-                    "x_hz": np.nan,
-                    "y_hz": np.nan,
-                }
-            )
-            this_graticule.loc[:, ["x_hp", "y_hp", "z_hp"]] = hp.ang2vec(
-                this_graticule.ra, this_graticule.decl, lonlat=True
-            )
-            xs, ys, zs = self.to_orth_zenith(
-                this_graticule.loc[:, "x_hp"],
-                this_graticule.loc[:, "y_hp"],
-                this_graticule.loc[:, "z_hp"],
-            )
-            this_graticule.loc[:, "x_orth"] = xs
-            this_graticule.loc[:, "y_orth"] = ys
-            this_graticule.loc[:, "z_orth"] = zs
+        graticule_points = self._make_overlay_data_source(geometry)
+        return graticule_points
 
-            x_laea, y_laea = self.laea_proj.ang2xy(
-                this_graticule["ra"], this_graticule["decl"], lonlat=True
-            )
-            this_graticule.loc[:, "x_laea"] = x_laea
-            this_graticule.loc[:, "y_laea"] = y_laea
+    def overlay_geometry(self, name):
+        """Return the time independent geometry of a registered overlay.
 
-            x_moll, y_moll = self.moll_proj.ang2xy(
-                this_graticule["ra"], this_graticule["decl"], lonlat=True
-            )
-            this_graticule.loc[:, "x_moll"] = x_moll
-            this_graticule.loc[:, "y_moll"] = y_moll
+        Parameters
+        ----------
+        name : `str`
+            The name of the overlay, a key of ``OVERLAYS``.
 
-            x_hz, y_hz = self.eq_to_horizon(
-                this_graticule["ra"].values, this_graticule["decl"].values
-            )
-            this_graticule.loc[:, "x_hz"] = x_hz
-            this_graticule.loc[:, "y_hz"] = y_hz
-
-            graticule_list.append(this_graticule)
-            graticule_list.append(stop_df)
-
-        # Define points in each R.A. graticule
-        for ra in np.arange(min_ra, max_ra + step, ra_space):
-            decl_steps = np.arange(min_decl, max_decl + step, step)
-            this_graticule = pd.DataFrame(
-                {
-                    "grat": f"ra{ra}",
-                    "decl": decl_steps,
-                    "ra": ra,
-                    "x_hp": np.nan,
-                    "y_hp": np.nan,
-                    "z_hp": np.nan,
-                    "x_orth": np.nan,
-                    "y_orth": np.nan,
-                    "z_orth": np.nan,
-                    "x_laea": np.nan,
-                    "y_laea": np.nan,
-                    "x_moll": np.nan,
-                    "y_moll": np.nan,
-                    "x_hz": np.nan,
-                    "y_hz": np.nan,
-                }
-            )
-            this_graticule.loc[:, ["x_hp", "y_hp", "z_hp"]] = hp.ang2vec(
-                this_graticule.ra, this_graticule.decl, lonlat=True
-            )
-            xs, ys, zs = self.to_orth_zenith(
-                this_graticule.loc[:, "x_hp"],
-                this_graticule.loc[:, "y_hp"],
-                this_graticule.loc[:, "z_hp"],
-            )
-            this_graticule.loc[:, "x_orth"] = xs
-            this_graticule.loc[:, "y_orth"] = ys
-            this_graticule.loc[:, "z_orth"] = zs
+        Returns
+        -------
+        geometry : `dict` [`str`, `numpy.ndarray`]
+            Read-only arrays with the coordinates and time independent
+            projections of points in the overlay.
 
-            x_laea, y_laea = self.laea_proj.ang2xy(
-                this_graticule["ra"], this_graticule["decl"], lonlat=True
-            )
-            this_graticule.loc[:, "x_laea"] = x_laea
-            this_graticule.loc[:, "y_laea"] = y_laea
+        Note
+        ----
+        Geometries are shared between maps through ``OVERLAY_CACHE``,
+        so must not be modified.
+        """
+        key = (name, self.laea_rot, self.laea_limit)
+        return OVERLAY_CACHE.get(key, lambda: OVERLAYS[name].geometry(self))
 
-            x_moll, y_moll = self.moll_proj.ang2xy(
-                this_graticule["ra"], this_graticule["decl"], lonlat=True
-            )
-            this_graticule.loc[:, "x_moll"] = x_moll
-            this_graticule.loc[:, "y_moll"] = y_moll
+    def make_overlay_data_source(self, name):
+        """Create a data source for a registered overlay.
 
-            x_hz, y_hz = self.eq_to_horizon(
-                this_graticule["ra"].values, this_graticule["decl"].values
-            )
-            this_graticule.loc[:, "x_hz"] = x_hz
-            this_graticule.loc[:, "y_hz"] = y_hz
+        Parameters
+        ----------
+        name : `str`
+            The name of the overlay, a key of ``OVERLAYS``.
 
-            graticule_list.append(this_graticule)
-            graticule_list.append(stop_df)
+        Returns
+        -------
+        overlay_points : `bokeh.models.ColumnDataSource`
+            Bokeh data source with points in the overlay.
+        """
+        return self._make_overlay_data_source(self.overlay_geometry(name))
+
+    def _make_overlay_data_source(self, geometry):
+        # The cached arrays are used directly, so the data source must not
+        # be modified in python.
+        overlay_data = dict(geometry)
+
+        # Only the orthographic and horizon projections depend on the time
+        # and site.
+        points = np.isfinite(geometry["ra"])
+        x_orth, y_orth, z_orth = self.to_orth_zenith(
+            geometry["x_hp"], geometry["y_hp"], geometry["z_hp"]
+        )
+        x_hz, y_hz = self.eq_to_horizon(geometry["ra"][points], geometry["decl"][points])
+        overlay_data.update(
+            {
+                "x_orth": x_orth,
+                "y_orth": y_orth,
+                "z_orth": z_orth,
+                "x_hz": fill_points(points, x_hz),
+                "y_hz": fill_points(points, y_hz),
+            }
+        )
 
-        graticule_points = bokeh.models.ColumnDataSource(pd.concat(graticule_list))
-        return graticule_points
+        overlay_points = make_data_source(overlay_data)
+        return overlay_points
 
     def make_horizon_graticule_points(
         self,
@@ -598,64 +946,66 @@ class SphereMap:
         graticule_points : `bokeh.models.ColumnDataSource`
             Bokeh data sources defining points in graticules.
         """
-
-        # Bohek puts gaps in lines when there are NaNs in the
-        # data frame. We will be platting many graticules, and we do not
-        # want them connected, so define a "stop" element to separate
-        # different graticules.
-        stop_df = pd.DataFrame(
-            {
-                "decl": [np.nan],
-                "ra": [np.nan],
-                "alt": [np.nan],
-                "az": [np.nan],
-                "grat": None,
-                "x_orth": [np.nan],
-                "y_orth": [np.nan],
-                "z_orth": [np.nan],
-                "x_laea": [np.nan],
-                "y_laea": [np.nan],
-                "x_moll": [np.nan],
-                "y_moll": [np.nan],
-                "x_hz": [np.nan],
-                "y_hz": [np.nan],
-            }
+        # Each row of each grid has the points of one graticule.
+        grat_alts = np.arange(min_alt, max_alt + alt_space, alt_space)
+        alt_grat_alt, alt_grat_az = np.meshgrid(
+            grat_alts, np.arange(0, 360 + step, step), indexing="ij"
+        )
+        grat_azs = np.arange(min_az, max_az + step, az_space)
+        az_grat_az, az_grat_alt = np.meshgrid(
+            grat_azs, np.arange(min_alt + step, max_alt + step, step), indexing="ij"
         )
-        graticule_list = []
-
-        # Define points in each alt graticule
-        for alt in np.arange(min_alt, max_alt + alt_space, alt_space):
-            radius = 90 - alt
-            start_bear = 0
-            end_bear = 360 + step
-            this_graticule = pd.DataFrame(
-                self.make_horizon_circle_points(
-                    90, 0, radius, start_bear, end_bear, step
-                ).data
-            )
-            this_graticule["grat"] = f"Alt{alt}"
 
-            graticule_list.append(this_graticule)
-            graticule_list.append(stop_df)
+        # Bokeh puts gaps in lines where there are NaNs, so follow each
+        # graticule with a NaN so that different graticules are not connected.
+        alt = np.concatenate(
+            [nan_separated(alt_grat_alt), nan_separated(az_grat_alt)]
+        )
+        az = np.concatenate([nan_separated(alt_grat_az), nan_separated(az_grat_az)])
+        grat_names = [f"Alt{a}" for a in grat_alts] + [f"Az{a}" for a in grat_azs]
+        grat = np.repeat(
+            np.array(grat_names, dtype=object),
+            np.concatenate(
+                [
+                    np.full(len(grat_alts), alt_grat_alt.shape[1] + 1),
+                    np.full(len(grat_azs), az_grat_az.shape[1] + 1),
+                ]
+            ),
+        )
 
-        for az in np.arange(min_az, max_az + step, az_space):
-            radius = 90
-            this_graticule = pd.DataFrame(
-                self.make_horizon_circle_points(
-                    0, az + 90, radius, 0, 360 + step, step
-                ).data
-            )
-            this_graticule.query(
-                f"(alt > {min_alt}) and (alt <= {max_alt}) and (abs(az-{az}) < 1)",
-                inplace=True,
+        points = np.isfinite(alt)
+        grat[~points] = None
+        if APPROX_COORD_TRANSFORMS:
+            ra, decl = approx_altAz2RaDec(
+                alt[points],
+                az[points],
+                self.site.latitude,
+                self.site.longitude,
+                self.mjd,
             )
-            this_graticule.sort_values(by="alt", inplace=True)
-            this_graticule["grat"] = f"Az{az}"
+        else:
+            observation_metadata = ObservationMetaData(mjd=self.mjd, site=self.site)
+            ra, decl = raDecFromAltAz(alt[points], az[points], observation_metadata)
+
+        projected = self._project_circle_points(ra, decl, step)
+        graticule_data = {
+            name: fill_points(points, values) for name, values in projected.items()
+        }
 
-            graticule_list.append(this_graticule)
-            graticule_list.append(stop_df)
+        # Project onto the horizon map directly, rather than through R.A.
+        # and Decl., so that rounding does not hide points on the horizon.
+        zd = np.radians(90 - alt)
+        graticule_data.update(
+            {
+                "grat": grat,
+                "alt": alt,
+                "az": az,
+                "x_hz": -zd * np.sin(np.radians(az)),
+                "y_hz": zd * np.cos(np.radians(az)),
+            }
+        )
 
-        graticule_points = bokeh.models.ColumnDataSource(pd.concat(graticule_list))
+        graticule_points = make_data_source(graticule_data)
         return graticule_points
 
     def make_circle_points(
@@ -689,64 +1039,202 @@ class SphereMap:
         circle : `bokeh.models.ColumnDataSource`
             Bokeh data source for points in the circle.
         """
-        ras = []
-        decls = []
-        bearings = []
-        for bearing in range(start_bear, end_bear + step, step):
-            ra, decl = offset_sep_bear(
-                np.radians(center_ra),
-                np.radians(center_decl),
-                np.radians(radius),
-                np.radians(bearing),
-            )
-            ras.append(np.degrees(ra))
-            decls.append(np.degrees(decl))
-            bearings.append(bearing)
+        circle_data = self._circle_points_data(
+            center_ra, center_decl, radius, start_bear, end_bear, step
+        )
+        circle = make_data_source(circle_data)
 
-        x0s, y0s, z0s = hp.ang2vec(np.array(ras), np.array(decls), lonlat=True).T
-        xs, ys, zs = self.to_orth_zenith(x0s, y0s, z0s)
+        return circle
 
-        x_laea, y_laea = self.laea_proj.ang2xy(
-            np.array(ras), np.array(decls), lonlat=True
+    def _circle_points_data(
+        self, center_ra, center_decl, radius, start_bear, end_bear, step
+    ):
+        bearings = np.arange(start_bear, end_bear + step, step)
+        ras, decls = offset_sep_bear(
+            center_ra, center_decl, radius, bearings, degrees=True
         )
-        x_moll, y_moll = self.moll_proj.ang2xy(
-            np.array(ras), np.array(decls), lonlat=True
+
+        circle_data = {"bearing": bearings}
+        circle_data.update(self._project_circle_points(ras, decls, step))
+        return circle_data
+
+    @metrics.timed("circles points")
+    def make_circles_points(
+        self,
+        center_ra,
+        center_decl,
+        radius=90.0,
+        start_bear=0,
+        end_bear=360,
+        step=1,
+    ):
+        """Create points along many circles or arcs on a sphere
+
+        Parameters
+        ----------
+        center_ra : `Iterable` [`float`]
+            R.A. of the centers of the circles (deg.).
+        center_decl : `Iterable` [`float`]
+            Decl. of the centers of the circles (deg.).
+        radius : `float` or `Iterable` [`float`], optional
+            Radius of the circles (deg.), by default 90.0
+        start_bear : int, optional
+            Bearing (E. of N.) of the start of the circles (deg.),
+            by default 0
+        end_bear : int, optional
+            Bearing (E. of N.) of the end of the circles (deg.),
+            by default 360
+        step : int, optional
+            Spacing of the points along the circles (deg.), by default 1
+
+        Returns
+        -------
+        circles : `bokeh.models.ColumnDataSource`
+            Bokeh data source for points in the circles, with a ``circle``
+            column with the index of the circle, and a row of NaNs after
+            each circle so that lines through them are not connected.
+        """
+        center_ra = np.asarray(center_ra, dtype=float)
+        center_decl = np.asarray(center_decl, dtype=float)
+        radius = np.broadcast_to(radius, center_ra.shape)
+        bearings = np.arange(start_bear, end_bear + step, step)
+
+        # Each row has the points of one circle, with an extra column for
+        # the NaN that separates it from the next circle.
+        ras, decls = offset_sep_bear(
+            center_ra[:, np.newaxis],
+            center_decl[:, np.newaxis],
+            radius[:, np.newaxis],
+            bearings[np.newaxis, :],
+            degrees=True,
         )
-        x_hz, y_hz = self.eq_to_horizon(np.array(ras), np.array(decls))
+        num_circles, num_points = ras.shape
+
+        circles_data = {
+            "circle": np.repeat(np.arange(num_circles), num_points),
+            "bearing": np.tile(bearings, num_circles),
+        }
+        circles_data.update(
+            self._project_circle_points(ras.ravel(), decls.ravel(), step)
+        )
+
+        for column in circles_data:
+            circles_data[column] = nan_separated(
+                circles_data[column].astype(float).reshape(num_circles, num_points)
+            )
+
+        circles = make_data_source(circles_data)
+
+        return circles
+
+    def circle_geometry(self, center_ra, center_decl, radius=90.0, step=1):
+        """Return the time independent geometry of a circle on the map.
+
+        Parameters
+        ----------
+        center_ra : `float`
+            R.A. of the center of the circle (deg.).
+        center_decl : `float`
+            Decl. of the center of the circle (deg.).
+        radius : float, optional
+            Radius of the circle (deg.), by default 90.0
+        step : int, optional
+            Spacing of the points along the circle (deg.), by default 1
+
+        Returns
+        -------
+        geometry : `dict` [`str`, `numpy.ndarray`]
+            The coordinates (``ra``, ``decl``), healpy vectors (``x_hp``,
+            ``y_hp``, ``z_hp``) and projections (``x_laea``, ``y_laea``,
+            ``x_moll``, ``y_moll``) of points along the circle.
+        """
+        bearings, ras, decls = circle_coords(center_ra, center_decl, radius, step)
+        geometry = {"bearing": bearings}
+        geometry.update(self._circle_geometry(ras, decls, step))
+        return geometry
+
+    def _circle_geometry(self, ras, decls, step):
+        """Project points on circles, hiding projection discontinuities.
+
+        Parameters
+        ----------
+        ras : `numpy.ndarray`
+            R.A. of the points (deg.).
+        decls : `numpy.ndarray`
+            Decl. of the points (deg.).
+        step : int
+            Spacing of the points along the circles (deg.).
+
+        Returns
+        -------
+        geometry : `dict` [`str`, `numpy.ndarray`]
+            Coordinates and time independent projected coordinates
+            of the points.
+        """
+        x0s, y0s, z0s = hp.ang2vec(ras, decls, lonlat=True).T
+        x_laea, y_laea = self.laea_proj.ang2xy(ras, decls, lonlat=True)
+        x_moll, y_moll = self.moll_proj.ang2xy(ras, decls, lonlat=True)
 
         # Hide discontinuities
         if self.site.latitude < 0:
-            laea_discont = np.array(decls) > self.laea_limit
+            laea_discont = decls > self.laea_limit
         else:
-            laea_discont = np.array(decls) < self.laea_limit
+            laea_discont = decls < self.laea_limit
         x_laea[laea_discont] = np.nan
         y_laea[laea_discont] = np.nan
 
-        moll_discont = np.abs(np.array(ras) - 180) < step
+        moll_discont = np.abs(ras - 180) < step
         x_moll[moll_discont] = np.nan
         y_moll[moll_discont] = np.nan
 
-        circle = bokeh.models.ColumnDataSource(
-            data={
-                "bearing": bearings,
-                "ra": ras,
-                "decl": decls,
-                "x_hp": x0s,
-                "y_hp": y0s,
-                "z_hp": z0s,
+        geometry = {
+            "ra": ras,
+            "decl": decls,
+            "x_hp": x0s,
+            "y_hp": y0s,
+            "z_hp": z0s,
+            "x_laea": x_laea,
+            "y_laea": y_laea,
+            "x_moll": x_moll,
+            "y_moll": y_moll,
+        }
+
+        return geometry
+
+    def _project_circle_points(self, ras, decls, step):
+        """Project points on circles, hiding projection discontinuities.
+
+        Parameters
+        ----------
+        ras : `numpy.ndarray`
+            R.A. of the points (deg.).
+        decls : `numpy.ndarray`
+            Decl. of the points (deg.).
+        step : int
+            Spacing of the points along the circles (deg.).
+
+        Returns
+        -------
+        circle_data : `dict` [`str`, `numpy.ndarray`]
+            Coordinates and projected coordinates of the points.
+        """
+        circle_data = self._circle_geometry(ras, decls, step)
+
+        xs, ys, zs = self.to_orth_zenith(
+            circle_data["x_hp"], circle_data["y_hp"], circle_data["z_hp"]
+        )
+        x_hz, y_hz = self.eq_to_horizon(ras, decls)
+        circle_data.update(
+            {
                 "x_orth": xs,
                 "y_orth": ys,
                 "z_orth": zs,
-                "x_laea": x_laea,
-                "y_laea": y_laea,
-                "x_moll": x_moll,
-                "y_moll": y_moll,
                 "x_hz": x_hz,
                 "y_hz": y_hz,
             }
         )
 
-        return circle
+        return circle_data
 
     def make_horizon_circle_points(
         self, alt=ALMOST_90, az=0, radius=90.0, start_bear=0, end_bear=360, step=1
@@ -787,18 +1275,16 @@ class SphereMap:
         else:
             center_ra, center_decl = raDecFromAltAz(alt, az, observation_metadata)
 
-        eq_circle_points = self.make_circle_points(
+        circle_data = self._circle_points_data(
             center_ra, center_decl, radius, start_bear, end_bear, step
         )
-        ra = np.array(eq_circle_points.data["ra"])
-        decl = np.array(eq_circle_points.data["decl"])
-        alt, az = self.eq_to_horizon(ra, decl, degrees=True, cart=False)
-
-        circle_data = dict(eq_circle_points.data)
-        circle_data["alt"] = alt.tolist()
-        circle_data["az"] = az.tolist()
+        alt, az = self.eq_to_horizon(
+            circle_data["ra"], circle_data["decl"], degrees=True, cart=False
+        )
+        circle_data["alt"] = alt
+        circle_data["az"] = az
 
-        circle = bokeh.models.ColumnDataSource(data=circle_data)
+        circle = make_data_source(circle_data)
 
         return circle
 
@@ -832,8 +1318,8 @@ class SphereMap:
         x_moll, y_moll = self.moll_proj.ang2xy(
             points_df.ra, points_df.decl, lonlat=True
         )
-        x_hz, y_hz = self.eq_to_horizon(
-            points_df.ra.values, points_df.decl.values, degrees=True, cart=True
+        alt, az, x_hz, y_hz = self.horizon_coords(
+            points_df.ra.values, points_df.decl.values, degrees=True
         )
 
         # If point_df.ra and points_df.decl have only one value, ang2xy returns
@@ -848,10 +1334,7 @@ class SphereMap:
         x_hz = x_hz.reshape(x_hz.size)
         y_hz = y_hz.reshape(y_hz.size)
 
-        alt, az = self.eq_to_horizon(
-            points_df.ra, points_df.decl, degrees=True, cart=False
-        )
-        invisible = alt < -1 * np.finfo(float).resolution
+        invisible = alt.reshape(alt.size) < -1 * np.finfo(float).resolution
         x_hz[invisible] = np.nan
         y_hz[invisible] = np.nan
 
@@ -877,12 +1360,13 @@ class SphereMap:
         # Add any additional data provided
         for column_name in points_df.columns:
             if column_name not in data.keys():
-                data[column_name] = points_df[column_name].to_list()
+                data[column_name] = points_df[column_name].values
 
-        points = bokeh.models.ColumnDataSource(data=data)
+        points = make_data_source(data)
 
         return points
 
+    @metrics.timed("marker data source")
     def make_marker_data_source(
         self,
         ra=None,
@@ -891,6 +1375,8 @@ class SphereMap:
         glyph_size=5,
         min_mjd=None,
         max_mjd=None,
+        group=None,
+        lod=None,
     ):
         """Add one or more circular marker(s) to the map.
 
@@ -904,65 +1390,62 @@ class SphereMap:
             Name for the thing marked, by default "anonymous"
         glyph_size : `int` or `Iterable`, optional
             Size of the marker, by default 5
-        min_mjd : `float`
+        min_mjd : `float` or `Iterable`, optional
             Earlist time for which to show the marker
-        max_mjd : `float`
+        max_mjd : `float` or `Iterable`, optional
             Latest time for which to show the marker
+        group : `str` or `Iterable`, optional
+            Group of the marker, for ``add_grouped_markers``, by default None
+        lod : `MarkerLOD`, optional
+            Level of detail with which to show many markers,
+            by default None to show all markers individually.
 
         Returns
         -------
         data_source : `bokeh.models.ColumnDataSource`
             A data source with marker locations, including projected coords.
         """
-        ras = ra if isinstance(ra, Iterable) else [ra]
-        decls = decl if isinstance(decl, Iterable) else [decl]
-        if len(ras) > 0:
-            glyph_sizes = (
-                glyph_size
-                if isinstance(glyph_size, Iterable)
-                else [glyph_size] * len(ras)
-            )
-            names = [name] * len(ras) if isinstance(name, str) else name
+        ras = np.atleast_1d(np.asarray(ra, dtype=float))
+        decls = np.atleast_1d(np.asarray(decl, dtype=float))
+        num_markers = len(ras)
+
+        # Scalar names, sizes and times apply to all markers.
+        if isinstance(name, str):
+            names = np.full(num_markers, name, dtype=object)
         else:
-            glyph_sizes = np.array([])
-            names = np.array([])
+            names = np.asarray(name)
 
         data = {
             "ra": ras,
             "decl": decls,
             "name": names,
-            "glyph_size": glyph_sizes,
+            "glyph_size": np.broadcast_to(glyph_size, num_markers),
         }
 
-        if (min_mjd is not None) or (max_mjd is not None):
-            if len(ras) == 0:
-                data["in_mjd_window"] = np.array([])
-            else:
-                data["in_mjd_window"] = [1] * len(ras)
-
         if min_mjd is not None:
-            if not isinstance(min_mjd, Iterable):
-                min_mjd = [min_mjd]
-            if len(ras) < 1:
-                min_mjd = np.array([])
-
-            data["min_mjd"] = min_mjd
-
-            for marker_index, this_min_mjd in enumerate(min_mjd):
-                if self.mjd < this_min_mjd:
-                    data["in_mjd_window"][marker_index] = 0
+            data["min_mjd"] = np.broadcast_to(
+                np.asarray(min_mjd, dtype=float), num_markers
+            )
 
         if max_mjd is not None:
-            if not isinstance(max_mjd, Iterable):
-                max_mjd = [max_mjd]
-            if len(ras) < 1:
-                max_mjd = np.array([])
+            data["max_mjd"] = np.broadcast_to(
+                np.asarray(max_mjd, dtype=float), num_markers
+            )
 
-            data["max_mjd"] = max_mjd
+        if group is not None:
+            # bokeh.models.GroupFilter only selects on strings
+            data["group"] = np.broadcast_to(group, num_markers).astype(str)
 
-            for marker_index, this_max_mjd in enumerate(max_mjd):
-                if self.mjd > this_max_mjd:
-                    data["in_mjd_window"][marker_index] = 0
+        if lod is not None and num_markers > lod.threshold:
+            data = bin_markers(data, lod.nside, lod.mjd)
+
+        if (min_mjd is not None) or (max_mjd is not None):
+            in_mjd_window = np.ones(len(data["ra"]), dtype=int)
+            if min_mjd is not None:
+                in_mjd_window[self.mjd < data["min_mjd"]] = 0
+            if max_mjd is not None:
+                in_mjd_window[self.mjd > data["max_mjd"]] = 0
+            data["in_mjd_window"] = in_mjd_window
 
         data_source = self.make_points(data)
 
@@ -1112,17 +1595,42 @@ class SphereMap:
         self.plot.line(x=self.x_col, y=self.y_col, source=graticule_points, **kwargs)
         return graticule_points
 
-    def add_circle(self, center_ra, center_decl, circle_kwargs={}, line_kwargs={}):
-        """Draw a circle on the map.
+    def add_circle(self, center_ra, center_decl, circle_kwargs={}, line_kwargs={}):
+        """Draw a circle on the map.
+
+        Parameters
+        ----------
+        center_ra : `float`
+            R.A. of the center of the circle (deg.)
+        center_decl : `float`
+            Decl. of the center of the circle (deg.)
+        circle_kwargs : dict, optional
+            Keywords to be passed to ``SphereMap.make_circle_points``,
+            by default {}
+        line_kwargs : dict, optional
+            Keywords to be passed to ``bokeh.plotting.figure.Figure.line``,
+            by default {}
+
+        Returns
+        -------
+        circle_points : `bokeh.models.ColumnDataSource`
+            The bokeh data source with points defining the circle.
+        """
+        circle_points = self.make_circle_points(center_ra, center_decl, **circle_kwargs)
+        self.plot.line(x=self.x_col, y=self.y_col, source=circle_points, **line_kwargs)
+        return circle_points
+
+    def add_circles(self, center_ra, center_decl, circle_kwargs={}, line_kwargs={}):
+        """Draw many circles on the map.
 
         Parameters
         ----------
-        center_ra : `float`
-            R.A. of the center of the circle (deg.)
-        center_decl : `float`
-            Decl. of the center of the circle (deg.)
+        center_ra : `Iterable` [`float`]
+            R.A. of the centers of the circles (deg.)
+        center_decl : `Iterable` [`float`]
+            Decl. of the centers of the circles (deg.)
         circle_kwargs : dict, optional
-            Keywords to be passed to ``SphereMap.make_circle_points``,
+            Keywords to be passed to ``SphereMap.make_circles_points``,
             by default {}
         line_kwargs : dict, optional
             Keywords to be passed to ``bokeh.plotting.figure.Figure.line``,
@@ -1130,12 +1638,14 @@ class SphereMap:
 
         Returns
         -------
-        circle_points : `bokeh.models.ColumnDataSource`
-            The bokeh data source with points defining the circle.
+        circles_points : `bokeh.models.ColumnDataSource`
+            The bokeh data source with points defining the circles.
         """
-        circle_points = self.make_circle_points(center_ra, center_decl, **circle_kwargs)
-        self.plot.line(x=self.x_col, y=self.y_col, source=circle_points, **line_kwargs)
-        return circle_points
+        circles_points = self.make_circles_points(
+            center_ra, center_decl, **circle_kwargs
+        )
+        self.plot.line(x=self.x_col, y=self.y_col, source=circles_points, **line_kwargs)
+        return circles_points
 
     def add_horizon(
         self, zd=ALMOST_90, data_source=None, circle_kwargs={}, line_kwargs={}
@@ -1186,6 +1696,7 @@ class SphereMap:
         max_mjd=None,
         data_source=None,
         circle_kwargs={},
+        lod=None,
     ):
         """Add one or more circular marker(s) to the map.
 
@@ -1209,6 +1720,10 @@ class SphereMap:
         circle_kwargs : dict, optional
             Keywords to be passed to ``bokeh.plotting.figure.Figure.circle``,
             by default {}
+        lod : `MarkerLOD`, optional
+            Level of detail with which to show many markers, if a new data
+            source is generated, by default None to show all markers
+            individually.
 
         Returns
         -------
@@ -1217,7 +1732,7 @@ class SphereMap:
         """
         if data_source is None:
             data_source = self.make_marker_data_source(
-                ra, decl, name, glyph_size, min_mjd, max_mjd
+                ra, decl, name, glyph_size, min_mjd, max_mjd, lod=lod
             )
 
         self.plot.circle(
@@ -1230,6 +1745,85 @@ class SphereMap:
 
         return data_source
 
+    def add_grouped_markers(
+        self,
+        ra=None,
+        decl=None,
+        group=None,
+        name="anonymous",
+        glyph_size=5,
+        min_mjd=None,
+        max_mjd=None,
+        data_source=None,
+        group_circle_kwargs={},
+        circle_kwargs={},
+        lod=None,
+    ):
+        """Add markers in groups drawn with different glyph keywords.
+
+        All groups share one data source, and each group is drawn from a
+        view of it, so the points are only projected (and sent to the
+        browser) once.
+
+        Parameters
+        ----------
+        ra : `Iterable`, optional
+            R.A. of the markers (deg.), by default None
+        decl : `Iterable`, optional
+            Declination of the markers (deg.), by default None
+        group : `Iterable`, optional
+            Group of each marker (e.g. its band), by default None
+        name : `str` or `Iterable` , optional
+            Name for the things marked, by default "anonymous"
+        glyph_size : `int` or `Iterable`, optional
+            Size of the markers, by default 5
+        min_mjd : `float` or `Iterable`, optional
+            Earliest time for which to show each marker.
+        max_mjd : `float` or `Iterable`, optional
+            Latest time for which to show each marker.
+        data_source : `bokeh.models.ColumnDataSource`, optional
+            Data source for the markers, with a ``group`` column, None if a
+            new one is to be generated. By default, None
+        group_circle_kwargs : `dict` [`str`, `dict`], optional
+            Keywords to be passed to ``bokeh.plotting.figure.Figure.circle``
+            for each group, by group. Only groups included are drawn.
+            By default {}
+        circle_kwargs : dict, optional
+            Keywords to be passed to ``bokeh.plotting.figure.Figure.circle``
+            for all groups, by default {}
+        lod : `MarkerLOD`, optional
+            Level of detail with which to show many markers, if a new data
+            source is generated, by default None to show all markers
+            individually.
+
+        Returns
+        -------
+        data_source : `bokeh.models.ColumnDataSource`
+            A data source with marker locations, including projected coords.
+        """
+        if data_source is None:
+            data_source = self.make_marker_data_source(
+                ra, decl, name, glyph_size, min_mjd, max_mjd, group, lod
+            )
+
+        for group_name, group_kwargs in group_circle_kwargs.items():
+            view = bokeh.models.CDSView(
+                source=data_source,
+                filters=[bokeh.models.GroupFilter(column_name="group", group=group_name)],
+            )
+            kwargs = deepcopy(circle_kwargs)
+            kwargs.update(group_kwargs)
+            self.plot.circle(
+                x=self.x_col,
+                y=self.y_col,
+                size="glyph_size",
+                source=data_source,
+                view=view,
+                **kwargs,
+            )
+
+        return data_source
+
     def add_stars(
         self, points_data, data_source=None, mag_limit_slider=False, star_kwargs={}
     ):
@@ -1314,6 +1908,34 @@ class SphereMap:
         stars = self.make_points(star_data)
         self.star_data_source.data = dict(stars.data)
 
+    def add_overlay(self, name, data_source=None, line_kwargs={}):
+        """Add a registered overlay to the map.
+
+        Parameters
+        ----------
+        name : `str`
+            The name of the overlay, a key of ``OVERLAYS``.
+        data_source : `bokeh.models.ColumnDataSource`, optional
+            The data source for the overlay, made by another map with the
+            same laea projection in the same bokeh document, to share rather
+            than making a new one. By default None, to make a new one.
+        line_kwargs : dict, optional
+            Keywords to be passed to ``bokeh.plotting.figure.Figure.line``,
+            by default {}
+
+        Returns
+        -------
+        overlay_points : `bokeh.models.ColumnDataSource`
+            The bokeh data source with points in the overlay.
+        """
+        if data_source is None:
+            data_source = self.make_overlay_data_source(name)
+
+        kwargs = deepcopy(getattr(self, OVERLAYS[name].line_kwargs))
+        kwargs.update(line_kwargs)
+        self.plot.line(x=self.x_col, y=self.y_col, source=data_source, **kwargs)
+        return data_source
+
     def add_ecliptic(self, **kwargs):
         """Map the ecliptic.
 
@@ -1322,14 +1944,7 @@ class SphereMap:
         points : `bokeh.models.ColumnDataSource`
             The bokeh data source with points on the ecliptic.
         """
-        ecliptic_pole = SkyCoord(
-            lon=0 * u.degree, lat=90 * u.degree, frame="geocentricmeanecliptic"
-        ).icrs
-        line_kwargs = deepcopy(self.default_ecliptic_line_kwargs)
-        line_kwargs.update(kwargs)
-        points = self.add_circle(
-            ecliptic_pole.ra.deg, ecliptic_pole.dec.deg, line_kwargs=line_kwargs
-        )
+        points = self.add_overlay("ecliptic", line_kwargs=kwargs)
         return points
 
     def add_galactic_plane(self, **kwargs):
@@ -1340,19 +1955,33 @@ class SphereMap:
         points : `bokeh.models.ColumnDataSource`
             The bokeh data source with points on the galactic plane.
         """
-        galactic_pole = SkyCoord(l=0 * u.degree, b=90 * u.degree, frame="galactic").icrs
-        line_kwargs = deepcopy(self.default_galactic_plane_line_kwargs)
-        line_kwargs.update(kwargs)
-        points = self.add_circle(
-            galactic_pole.ra.deg, galactic_pole.dec.deg, line_kwargs=line_kwargs
-        )
+        points = self.add_overlay("galactic_plane", line_kwargs=kwargs)
         return points
 
-    def decorate(self):
-        """Add graticules, the ecliptic, and galactic plane to the map."""
-        self.add_graticules()
-        self.add_ecliptic()
-        self.add_galactic_plane()
+    def decorate(self, overlay_sources=None):
+        """Add graticules, the ecliptic, and galactic plane to the map.
+
+        Parameters
+        ----------
+        overlay_sources : `dict` [`str`, `bokeh.models.ColumnDataSource`]
+            Data sources for overlays, by overlay name, returned by
+            ``decorate`` for another map with the same laea projection
+            that will be in the same bokeh document. These are shared rather
+            than making new ones. By default None, to make new ones.
+
+        Returns
+        -------
+        overlay_sources : `dict` [`str`, `bokeh.models.ColumnDataSource`]
+            The data sources for the overlays, by overlay name.
+        """
+        if overlay_sources is None:
+            overlay_sources = dict()
+
+        overlay_sources = {
+            name: self.add_overlay(name, overlay_sources.get(name))
+            for name in DECORATION_OVERLAYS
+        }
+        return overlay_sources
 
 
 class Planisphere(SphereMap):
@@ -1417,6 +2046,30 @@ class MovingSphereMap(SphereMap):
         self.set_js_update_func(data_source)
         return data_source
 
+    def add_overlay(self, name, data_source=None, line_kwargs={}):
+        """Add a registered overlay to the map.
+
+        Parameters
+        ----------
+        name : `str`
+            The name of the overlay, a key of ``OVERLAYS``.
+        data_source : `bokeh.models.ColumnDataSource`, optional
+            The data source for the overlay, made by another map with the
+            same laea projection in the same bokeh document, to share rather
+            than making a new one. By default None, to make a new one.
+        line_kwargs : dict, optional
+            Keywords to be passed to ``bokeh.plotting.figure.Figure.line``,
+            by default {}
+
+        Returns
+        -------
+        overlay_points : `bokeh.models.ColumnDataSource`
+            The bokeh data source with points in the overlay.
+        """
+        data_source = super().add_overlay(name, data_source, line_kwargs)
+        self.set_js_update_func(data_source)
+        return data_source
+
     def add_circle(self, center_ra, center_decl, circle_kwargs={}, line_kwargs={}):
         """Draw a circle on the map.
 
@@ -1444,6 +2097,33 @@ class MovingSphereMap(SphereMap):
         self.set_js_update_func(data_source)
         return data_source
 
+    def add_circles(self, center_ra, center_decl, circle_kwargs={}, line_kwargs={}):
+        """Draw many circles on the map.
+
+        Parameters
+        ----------
+        center_ra : `Iterable` [`float`]
+            R.A. of the centers of the circles (deg.)
+        center_decl : `Iterable` [`float`]
+            Decl. of the centers of the circles (deg.)
+        circle_kwargs : dict, optional
+            Keywords to be passed to ``SphereMap.make_circles_points``,
+            by default {}
+        line_kwargs : dict, optional
+            Keywords to be passed to ``bokeh.plotting.figure.Figure.line``,
+            by default {}
+
+        Returns
+        -------
+        circles_points : `bokeh.models.ColumnDataSource`
+            The bokeh data source with points defining the circles.
+        """
+        data_source = super().add_circles(
+            center_ra, center_decl, circle_kwargs, line_kwargs
+        )
+        self.set_js_update_func(data_source)
+        return data_source
+
     def add_stars(
         self, points_data, data_source=None, mag_limit_slider=False, star_kwargs={}
     ):
@@ -1490,6 +2170,7 @@ class MovingSphereMap(SphereMap):
         max_mjd=None,
         data_source=None,
         circle_kwargs={},
+        lod=None,
     ):
         """Add one or more circular marker(s) to the map.
 
@@ -1513,6 +2194,10 @@ class MovingSphereMap(SphereMap):
         circle_kwargs : dict, optional
             Keywords to be passed to ``bokeh.plotting.figure.Figure.circle``,
             by default {}
+        lod : `MarkerLOD`, optional
+            Level of detail with which to show many markers, if a new data
+            source is generated, by default None to show all markers
+            individually.
 
         Returns
         -------
@@ -1528,6 +2213,79 @@ class MovingSphereMap(SphereMap):
             max_mjd,
             data_source=data_source,
             circle_kwargs=circle_kwargs,
+            lod=lod,
+        )
+        self.set_js_update_func(data_source)
+        return data_source
+
+    def add_grouped_markers(
+        self,
+        ra=None,
+        decl=None,
+        group=None,
+        name="anonymous",
+        glyph_size=5,
+        min_mjd=None,
+        max_mjd=None,
+        data_source=None,
+        group_circle_kwargs={},
+        circle_kwargs={},
+        lod=None,
+    ):
+        """Add markers in groups drawn with different glyph keywords.
+
+        All groups share one data source, and each group is drawn from a
+        view of it, so the points are only projected (and sent to the
+        browser) once.
+
+        Parameters
+        ----------
+        ra : `Iterable`, optional
+            R.A. of the markers (deg.), by default None
+        decl : `Iterable`, optional
+            Declination of the markers (deg.), by default None
+        group : `Iterable`, optional
+            Group of each marker (e.g. its band), by default None
+        name : `str` or `Iterable` , optional
+            Name for the things marked, by default "anonymous"
+        glyph_size : `int` or `Iterable`, optional
+            Size of the markers, by default 5
+        min_mjd : `float` or `Iterable`, optional
+            Earliest time for which to show each marker.
+        max_mjd : `float` or `Iterable`, optional
+            Latest time for which to show each marker.
+        data_source : `bokeh.models.ColumnDataSource`, optional
+            Data source for the markers, with a ``group`` column, None if a
+            new one is to be generated. By default, None
+        group_circle_kwargs : `dict` [`str`, `dict`], optional
+            Keywords to be passed to ``bokeh.plotting.figure.Figure.circle``
+            for each group, by group. Only groups included are drawn.
+            By default {}
+        circle_kwargs : dict, optional
+            Keywords to be passed to ``bokeh.plotting.figure.Figure.circle``
+            for all groups, by default {}
+        lod : `MarkerLOD`, optional
+            Level of detail with which to show many markers, if a new data
+            source is generated, by default None to show all markers
+            individually.
+
+        Returns
+        -------
+        data_source : `bokeh.models.ColumnDataSource`
+            A data source with marker locations, including projected coords.
+        """
+        data_source = super().add_grouped_markers(
+            ra,
+            decl,
+            group,
+            name,
+            glyph_size,
+            min_mjd,
+            max_mjd,
+            data_source=data_source,
+            group_circle_kwargs=group_circle_kwargs,
+            circle_kwargs=circle_kwargs,
+            lod=lod,
         )
         self.set_js_update_func(data_source)
         return data_source
@@ -1635,6 +2393,156 @@ class ArmillarySphere(MovingSphereMap):
         )
 
 
+# The poles are constant, so are transformed with astropy only once, when
+# first needed.
+@lru_cache(maxsize=None)
+def ecliptic_pole():
+    """Return the R.A. and Decl. of the north ecliptic pole (deg.)."""
+    pole = SkyCoord(
+        lon=0 * u.degree, lat=90 * u.degree, frame="geocentricmeanecliptic"
+    ).icrs
+    return pole.ra.deg, pole.dec.deg
+
+
+@lru_cache(maxsize=None)
+def galactic_pole():
+    """Return the R.A. and Decl. of the north galactic pole (deg.)."""
+    pole = SkyCoord(l=0 * u.degree, b=90 * u.degree, frame="galactic").icrs
+    return pole.ra.deg, pole.dec.deg
+
+
+register_overlay(
+    "graticules", SphereMap.graticule_geometry, "default_graticule_line_kwargs"
+)
+register_overlay(
+    "ecliptic",
+    lambda sphere_map: sphere_map.circle_geometry(*ecliptic_pole()),
+    "default_ecliptic_line_kwargs",
+)
+register_overlay(
+    "galactic_plane",
+    lambda sphere_map: sphere_map.circle_geometry(*galactic_pole()),
+    "default_galactic_plane_line_kwargs",
+)
+
+
+def horizon_kernel(ra, decl, lst, latitude, alt_limit=0.0, out=None):
+    """Compute horizon coordinates and their projection in one pass.
+
+    Parameters
+    ----------
+    ra : `numpy.ndarray`
+        Right Ascensions, in radians.
+    decl : `numpy.ndarray`
+        Declinations, in radians.
+    lst : `float` or `numpy.ndarray`
+        Local sidereal time(s), in radians, broadcastable with ``ra`` and
+        ``decl``.
+    latitude : `float`
+        Latitude of the site, in radians.
+    alt_limit : `float`, optional
+        Altitude (in radians) below which the projected coordinates are
+        NaN, by default 0.
+    out : `tuple` [`numpy.ndarray`], optional
+        Arrays of float, with the broadcast shape of the inputs, in which to
+        put alt, az, x, and y, by default None (to make new arrays).
+
+    Returns
+    -------
+    alt : `numpy.ndarray`
+        Altitudes, in radians.
+    az : `numpy.ndarray`
+        Azimuths, east of north, in radians.
+    x : `numpy.ndarray`
+        Horizon projection x coordinate, with +x pointing west.
+    y : `numpy.ndarray`
+        Horizon projection y coordinate, with +y pointing north.
+
+    Note
+    ----
+    This uses the same approximations as
+    ``rubin_sim.utils.approx_RaDec2AltAz``. The output arrays are also used
+    for intermediate values, so that the only other arrays made are the
+    trig of the declinations and a mask.
+    """
+    if out is None:
+        shape = np.broadcast(ra, decl, lst).shape
+        out = tuple(np.empty(shape) for _ in range(4))
+    alt, az, x, y = out
+
+    sin_decl = np.sin(decl)
+    cos_decl = np.cos(decl)
+    sin_lat = np.sin(latitude)
+    cos_lat = np.cos(latitude)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # The hour angle, and its sine and cosine
+        np.subtract(lst, ra, out=az)
+        np.sin(az, out=x)
+        np.cos(az, out=y)
+
+        # sin(alt) in y, then alt
+        y *= cos_decl
+        y *= cos_lat
+        y += sin_decl * sin_lat
+        np.clip(y, -1, 1, out=y)
+        np.arcsin(y, out=alt)
+
+        # cos(az), then az
+        np.multiply(y, -sin_lat, out=az)
+        az += sin_decl
+        np.cos(alt, out=y)
+        y *= cos_lat
+        az /= y
+        np.clip(az, -1, 1, out=az)
+        np.arccos(az, out=az)
+        west = x > 0
+        np.subtract(2 * np.pi, az, out=az, where=west)
+
+    horizon_projection(alt, az, alt_limit, out=(x, y))
+    return alt, az, x, y
+
+
+def horizon_projection(alt, az, alt_limit=0.0, out=None):
+    """Project horizon coordinates, with the zenith at the origin.
+
+    Parameters
+    ----------
+    alt : `numpy.ndarray`
+        Altitudes, in radians.
+    az : `numpy.ndarray`
+        Azimuths, east of north, in radians.
+    alt_limit : `float`, optional
+        Altitude (in radians) below which the projected coordinates are
+        NaN, by default 0.
+    out : `tuple` [`numpy.ndarray`], optional
+        Arrays of float in which to put x and y, by default None (to make
+        new arrays).
+
+    Returns
+    -------
+    x : `numpy.ndarray`
+        Projected x coordinate, with +x pointing west.
+    y : `numpy.ndarray`
+        Projected y coordinate, with +y pointing north.
+    """
+    if out is None:
+        out = (np.empty(np.shape(alt)), np.empty(np.shape(alt)))
+    x, y = out
+
+    # The zenith distance, in y
+    np.subtract(np.pi / 2, alt, out=y)
+    np.sin(az, out=x)
+    x *= y
+    np.negative(x, out=x)
+    y *= np.cos(az)
+
+    invisible = alt < alt_limit
+    x[invisible] = np.nan
+    y[invisible] = np.nan
+    return x, y
+
+
 def make_zscale_linear_cmap(
     values, field_name="value", palette="Inferno256", *args, **kwargs
 ):
@@ -1649,29 +2557,215 @@ def make_zscale_linear_cmap(
     return cmap
 
 
+def make_data_source(data):
+    """Make a bokeh data source, with columns in compact types.
+
+    Parameters
+    ----------
+    data : `dict`
+        The columns of the data source, by name.
+
+    Returns
+    -------
+    data_source : `bokeh.models.ColumnDataSource`
+        The data source. Float columns are stored as float32 (except
+        for those in ``FLOAT64_COLUMNS``) and integer columns as int32, which
+        bokeh sends to the browser as binary arrays rather than as JSON.
+    """
+    columns = {}
+    for name, values in data.items():
+        if isinstance(values, (np.ndarray, pd.Series)):
+            values = np.asarray(values)
+            if values.dtype.kind == "f" and name not in FLOAT64_COLUMNS:
+                values = values.astype(np.float32)
+            elif values.dtype.kind in "iu" and (
+                len(values) == 0 or np.abs(values).max() <= np.iinfo(np.int32).max
+            ):
+                values = values.astype(np.int32)
+            elif values.dtype.kind in "OU":
+                values = values.tolist()
+        columns[name] = values
+
+    data_source = bokeh.models.ColumnDataSource(data=columns)
+
+    return data_source
+
+
+def ragged_coords(values):
+    """Convert rows of coordinates to float32 arrays for bokeh patches.
+
+    Parameters
+    ----------
+    values : `numpy.ndarray`
+        Two dimensional array with the coordinates of one patch in each row.
+
+    Returns
+    -------
+    values : `list` [`numpy.ndarray`]
+        The coordinates of each patch, as a float32 array, which bokeh sends
+        to the browser as a binary array.
+    """
+    return list(np.asarray(values, dtype=np.float32))
+
+
+def bin_markers(data, nside, mjd=None):
+    """Replace markers with counts of markers in healpixels.
+
+    Parameters
+    ----------
+    data : `dict` [`str`, `numpy.ndarray`]
+        Marker data, with ``ra``, ``decl``, ``name`` and ``glyph_size``, and
+        optionally ``min_mjd``, ``max_mjd`` and ``group``, columns.
+    nside : `int`
+        The nside of the healpixels in which to count markers.
+    mjd : `float`, optional
+        Only markers with a ``min_mjd`` before this are binned, by default
+        None to bin all markers.
+
+    Returns
+    -------
+    binned_data : `dict` [`str`, `numpy.ndarray`]
+        Marker data with the same columns, and a ``count`` column with the
+        number of markers each marker stands for. Markers that are not
+        binned are first, followed by one marker at the center of each
+        healpixel (for each group) with binned markers, with the largest
+        ``min_mjd``, and the smallest ``max_mjd``, of the markers in it.
+        Its ``glyph_size`` is the largest of the markers in it, scaled so
+        that its area grows with the logarithm of the count: by
+        ``sqrt(1 + log2(count))``.
+    """
+    if mjd is None or "min_mjd" not in data:
+        binned = np.ones(len(data["ra"]), dtype=bool)
+    else:
+        binned = data["min_mjd"] < mjd
+
+    markers = pd.DataFrame({column: data[column][binned] for column in data})
+    markers["hpid"] = hp.ang2pix(
+        nside, markers["ra"].values, markers["decl"].values, lonlat=True
+    )
+    by = ["hpid", "group"] if "group" in markers.columns else ["hpid"]
+    aggregations = {"glyph_size": ("glyph_size", "max"), "count": ("ra", "size")}
+    if "min_mjd" in markers.columns:
+        aggregations["min_mjd"] = ("min_mjd", "max")
+    if "max_mjd" in markers.columns:
+        aggregations["max_mjd"] = ("max_mjd", "min")
+    bins = markers.groupby(by, sort=False).agg(**aggregations).reset_index()
+    bins["ra"], bins["decl"] = hp.pix2ang(nside, bins["hpid"].values, lonlat=True)
+    bins["glyph_size"] = bins["glyph_size"] * np.sqrt(1 + np.log2(bins["count"]))
+    bins["name"] = bins["count"].astype(str) + " markers"
+
+    unbinned = ~binned
+    binned_data = {
+        column: np.concatenate([data[column][unbinned], bins[column].values])
+        for column in data
+    }
+    binned_data["count"] = np.concatenate(
+        [np.ones(np.count_nonzero(unbinned), dtype=int), bins["count"].values]
+    )
+
+    return binned_data
+
+
+def nan_separated(lines):
+    """Join lines into one array, with a NaN after each line.
+
+    Parameters
+    ----------
+    lines : `numpy.ndarray`
+        Two dimensional array with the values of one line in each row.
+
+    Returns
+    -------
+    values : `numpy.ndarray`
+        One dimensional array with the values in each row followed by a NaN.
+    """
+    num_lines = lines.shape[0]
+    return np.hstack([lines, np.full((num_lines, 1), np.nan)]).ravel()
+
+
+def fill_points(points, values):
+    """Scatter values into an array of NaNs.
+
+    Parameters
+    ----------
+    points : `numpy.ndarray` [`bool`]
+        Where in the returned array to put the values.
+    values : `numpy.ndarray`
+        The values, one for each True element of ``points``.
+
+    Returns
+    -------
+    filled : `numpy.ndarray`
+        An array the shape of ``points``, with ``values`` where ``points``
+        is True and NaN elsewhere.
+    """
+    filled = np.full(points.shape, np.nan)
+    filled[points] = values
+    return filled
+
+
+@lru_cache(maxsize=CIRCLE_COORDS_CACHE_SIZE)
+def circle_coords(center_ra, center_decl, radius=90.0, step=1):
+    """Return the coordinates of points along a circle on the sphere.
+
+    Parameters
+    ----------
+    center_ra : `float`
+        R.A. of the center of the circle (deg.).
+    center_decl : `float`
+        Decl. of the center of the circle (deg.).
+    radius : float, optional
+        Radius of the circle (deg.), by default 90.0
+    step : int, optional
+        Spacing of the points along the circle (deg.), by default 1
+
+    Returns
+    -------
+    bearings : `numpy.ndarray`
+        Bearings of the points from the center (deg.).
+    ras : `numpy.ndarray`
+        R.A. of the points (deg.).
+    decls : `numpy.ndarray`
+        Decl. of the points (deg.).
+
+    Note
+    ----
+    The arrays are cached and shared, so are read-only.
+    """
+    bearings = np.arange(0, 360 + step, step)
+    ras, decls = offset_sep_bear(
+        center_ra, center_decl, radius, bearings, degrees=True
+    )
+    for values in (bearings, ras, decls):
+        values.flags.writeable = False
+    return bearings, ras, decls
+
+
 def offset_sep_bear(ra, decl, sep, bearing, degrees=False):
     """Calculate coordinates after an offset by a separation.
 
     Parameters
     ----------
-    ra : `float`
+    ra : `float` or `numpy.ndarray`
        R.A. as a float in radians
-    decl : `float`
+    decl : `float` or `numpy.ndarray`
        declination as a float in radians
-    sep : `float`
+    sep : `float` or `numpy.ndarray`
        separation in radians
-    bearing : `float`
+    bearing : `float` or `numpy.ndarray`
        bearing (east of north) in radians
     degrees : `bool`
         arguments and returnes are in degrees (False for radians).
 
     Returns
     -------
-    ra : `float`
+    ra : `float` or `numpy.ndarray`
        R.A. Right Ascension
-    decl : `float`
+    decl : `float` or `numpy.ndarray`
        declination
 
+    Array arguments are broadcast against each other.
+
     """
     # Use cos formula:
     # cos(a)=cos(b)*cos(c)+sin(b)*sin(c)*cos(A)
@@ -1698,8 +2792,10 @@ def offset_sep_bear(ra, decl, sep, bearing, degrees=False):
 
     # Hack to match astropy behaviour at poles
     near_pole = np.abs(np.cos(decl)) < 1e-12
-    if near_pole:
-        dra = np.pi / 2 + np.cos(np_sep) * (np.pi / 2 - bearing)
+    if np.any(near_pole):
+        dra = np.where(
+            near_pole, np.pi / 2 + np.cos(np_sep) * (np.pi / 2 - bearing), dra
+        )
 
     new_ra = ra + dra
 
@@ -1710,6 +2806,71 @@ def offset_sep_bear(ra, decl, sep, bearing, degrees=False):
     return new_ra, new_decl
 
 
+def local_sidereal_times(mjds, longitude):
+    """Return the local mean and apparent sidereal times.
+
+    Parameters
+    ----------
+    mjds : `float` or `numpy.ndarray`
+        The Modified Julian Dates.
+    longitude : `float`
+        The longitude of the site, in radians (east positive).
+
+    Returns
+    -------
+    lmst : `float` or `numpy.ndarray`
+        The local mean sidereal times, in degrees.
+    last : `float` or `numpy.ndarray`
+        The local apparent sidereal times, in degrees.
+    """
+    if np.ndim(mjds) > 0:
+        mjds = np.asarray(mjds, dtype=float)
+    lmst, last = calcLmstLast(mjds, longitude)
+    return lmst * 15, last * 15
+
+
+@lru_cache(maxsize=ORTH_ZENITH_ROTATION_CACHE_SIZE)
+def orth_zenith_rotation(latitude, lst):
+    """Return the rotation from healpy vectors to orthographic coordinates.
+
+    Parameters
+    ----------
+    latitude : `float`
+        The latitude of the site, in degrees.
+    lst : `float`
+        The local sidereal time, in degrees.
+
+    Returns
+    -------
+    rotation : `numpy.ndarray`
+        The (read only) 3x3 rotation matrix, which rotates (column) healpy
+        vectors to orthographic coordinates with the zenith at the center
+        and north up.
+    """
+
+    def rotation_matrix(ux, uy, uz, angle):
+        # The columns are the rotated unit vectors
+        return np.array(rotate_cart(ux, uy, uz, angle, *np.eye(3)))
+
+    # Put the zenith (at LST 0) at the center.
+    zenith_rotation = rotation_matrix(1, 0, 0, latitude + 90) @ rotation_matrix(
+        0, 0, 1, -90
+    )
+
+    # Rotate about the north pole by the LST.
+    npole = zenith_rotation @ np.array([0.0, 0.0, 1.0])
+    lst_rotation = rotation_matrix(*npole, -lst)
+
+    # The rotation about the north pole leaves it in place, so rotate the
+    # rest of the way to put it on the y axis, so that north is up.
+    orient = np.degrees(np.arctan2(npole[1], npole[0]))
+    orient_rotation = rotation_matrix(0, 0, 1, 90 - orient)
+
+    rotation = orient_rotation @ lst_rotation @ zenith_rotation
+    rotation.flags.writeable = False
+    return rotation
+
+
 def rotate_cart(ux, uy, uz, angle, x0, y0, z0):
     """Rotate coordinates on a unit sphere around an axis
 
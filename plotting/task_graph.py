@@ -0,0 +1,171 @@
+import threading
+import time
+import traceback
+from concurrent.futures import Future, InvalidStateError
+
+from plotting import metrics
+
+
+class TaskError(Exception):
+    """A task was not run because one of its dependencies failed."""
+
+
+class Task:
+    def __init__(self, name, func, dependencies=()):
+        """A task in a ``TaskGraph``.
+
+        Parameters
+        ----------
+        name : `str`
+            The name of the task, unique within its graph.
+        func : `Callable`
+            The function run by the task, called with the results of its
+            dependencies as positional arguments.
+        dependencies : `Iterable` [`Task`], optional
+            The tasks whose results are needed by this one, by default none.
+        """
+        self.name = name
+        self.func = func
+        self.dependencies = tuple(dependencies)
+        self.future = Future()
+        self.start_time = None
+        self.end_time = None
+
+    @property
+    def duration(self):
+        """The time the task took to run, in seconds, or None if it has not
+        finished running."""
+        if self.start_time is None or self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+
+class TaskGraph:
+    def __init__(self, executor, name="tasks"):
+        """Tasks run in an executor as soon as their dependencies finish.
+
+        Tasks never wait for each other in the executor's threads: a task is
+        only submitted once all of its dependencies have finished.
+        If a dependency fails or is cancelled, so are the tasks that depend
+        on it.
+
+        Parameters
+        ----------
+        executor : `concurrent.futures.Executor`
+            The executor in which to run the tasks.
+        name : `str`, optional
+            The name of the graph, used when reporting task timings,
+            by default "tasks".
+        """
+        self.executor = executor
+        self.name = name
+        self.tasks = dict()
+        self._lock = threading.Lock()
+
+    def add(self, name, func, dependencies=()):
+        """Add a task, to be run once its dependencies have finished.
+
+        Parameters
+        ----------
+        name : `str`
+            The name of the task, unique within the graph.
+        func : `Callable`
+            The function run by the task, called with the results of its
+            dependencies as positional arguments.
+        dependencies : `Iterable` [`str`], optional
+            The names of the tasks (already in the graph) whose results are
+            needed by this one, by default none.
+
+        Returns
+        -------
+        task : `Task`
+            The task, whose ``future`` gives its result.
+        """
+        with self._lock:
+            if name in self.tasks:
+                raise ValueError(f"{self.name} already has a task {name}")
+            for dependency in dependencies:
+                if dependency not in self.tasks:
+                    raise ValueError(f"{self.name} has no task {dependency}")
+
+            task = Task(name, func, [self.tasks[d] for d in dependencies])
+            self.tasks[name] = task
+
+        # The number of dependencies still running, and whether any failed
+        waiting = {"num_running": len(task.dependencies), "failed": False}
+
+        def dependency_done(dependency_future):
+            failed = dependency_future.cancelled() or (
+                dependency_future.exception() is not None
+            )
+            with self._lock:
+                waiting["num_running"] -= 1
+                waiting["failed"] = waiting["failed"] or failed
+                ready = waiting["num_running"] == 0 and not waiting["failed"]
+
+            if dependency_future.cancelled():
+                task.future.cancel()
+            elif failed:
+                self._fail_dependency(task, dependency_future.exception())
+            elif ready:
+                self.executor.submit(self._run, task)
+
+        if len(task.dependencies) == 0:
+            self.executor.submit(self._run, task)
+        for dependency in task.dependencies:
+            dependency.future.add_done_callback(dependency_done)
+
+        return task
+
+    def _fail_dependency(self, task, dependency_error):
+        error = TaskError(f"{task.name} failed: {dependency_error}")
+        error.__cause__ = dependency_error
+        try:
+            task.future.set_exception(error)
+        except InvalidStateError:
+            # The task already failed (from another dependency) or was
+            # cancelled.
+            pass
+
+    def _run(self, task):
+        if not task.future.set_running_or_notify_cancel():
+            return
+
+        task.start_time = time.perf_counter()
+        try:
+            args = [dependency.future.result() for dependency in task.dependencies]
+            with metrics.profiled(f"task {task.name}"):
+                result = task.func(*args)
+        except Exception as e:
+            task.end_time = time.perf_counter()
+            print(f"{self.name}: {task.name} failed after {task.duration:.2f} s: {e}")
+            traceback.print_exc()
+            metrics.increment(f"task {task.name} failures")
+            task.future.set_exception(e)
+        else:
+            task.end_time = time.perf_counter()
+            print(f"{self.name}: {task.name} took {task.duration:.2f} s")
+            metrics.record(f"task {task.name}", task.duration)
+            task.future.set_result(result)
+
+    def cancel(self):
+        """Cancel every task that has not started running.
+
+        Tasks that are already running are left to finish.
+        """
+        for task in list(self.tasks.values()):
+            task.future.cancel()
+
+    @property
+    def done(self):
+        """Whether every task has finished, failed, or been cancelled."""
+        return all(task.future.done() for task in list(self.tasks.values()))
+
+    @property
+    def timings(self):
+        """The time each task that has finished running took, in seconds."""
+        return {
+            name: task.duration
+            for name, task in list(self.tasks.items())
+            if task.duration is not None
+        }
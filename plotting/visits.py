@@ -1,6 +1,5 @@
 import sqlite3
-import traceback
-from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 
 import bokeh.layouts
 import bokeh.models
@@ -10,12 +9,74 @@ import bokeh.transform
 import healpy as hp
 import numpy as np
 import pandas as pd
-from rubin_sim.scheduler.modelObservatory import Model_observatory
 
-from plotting.settings import BAND_COLOURS, NIGHT, scheduler, BASELINE_SIM_DB_FNAME
-from plotting.spheremap import Planisphere, ArmillarySphere
+from plotting import metrics
+from plotting.settings import (
+    BAND_COLOURS,
+    BASELINE_SIM_DB_FNAME,
+    VISIT_LOOKBACK_DAYS,
+    VISIT_CHUNK_SIZE,
+    VISIT_LOD_THRESHOLD,
+    VISIT_LOD_NSIDE,
+)
+from plotting.spheremap import MarkerLOD, Planisphere, ArmillarySphere
+
+# Only the columns needed for the visit plot are read from the simulation
+VISIT_COLUMNS = ("observationId", "fieldRA", "fieldDec", "filter", "observationStartMJD")
+
+
+def load_visits(
+    start_mjd,
+    end_mjd,
+    columns=VISIT_COLUMNS,
+    fname=BASELINE_SIM_DB_FNAME,
+    chunksize=VISIT_CHUNK_SIZE,
+):
+    """Load visits within an MJD window from an opsim database.
+
+    Parameters
+    ----------
+    start_mjd : `float`
+        Earliest ``observationStartMJD`` to load.
+    end_mjd : `float`
+        Latest ``observationStartMJD`` to load.
+    columns : `Iterable` [`str`], optional
+        Columns of the ``observations`` table to load, which must include
+        ``observationId``. By default ``VISIT_COLUMNS``.
+    fname : `str`, optional
+        The opsim database file name, by default ``BASELINE_SIM_DB_FNAME``.
+    chunksize : `int`, optional
+        Number of rows to read from the database at a time,
+        by default ``VISIT_CHUNK_SIZE``.
+
+    Returns
+    -------
+    visits : `pandas.DataFrame`
+        The visits, indexed by ``observationId``.
+    """
+    query = (
+        f"SELECT {', '.join(columns)} FROM observations"
+        " WHERE observationStartMJD BETWEEN ? AND ?"
+        " ORDER BY observationStartMJD"
+    )
+    # Open the database read only, so that the simulation is never modified
+    with metrics.span("load visits"), closing(
+        sqlite3.connect(f"file:{fname}?mode=ro", uri=True)
+    ) as sim_connection:
+        chunks = pd.read_sql_query(
+            query,
+            sim_connection,
+            index_col="observationId",
+            params=(start_mjd, end_mjd),
+            chunksize=chunksize,
+        )
+        visits = pd.concat(chunks)
+    metrics.increment("visits loaded", len(visits))
+
+    if "filter" in visits.columns:
+        visits["filter"] = visits["filter"].astype("category")
 
-worker = ThreadPoolExecutor()
+    return visits
 
 
 def skymaps(visits, footprint, conditions):
@@ -28,25 +89,27 @@ def skymaps(visits, footprint, conditions):
     nside = hp.npix2nside(footprint.shape[0])
     healpix_ds, cmap, glyph = asphere.add_healpix(footprint, nside=nside, cmap=cmap)
     psphere.add_healpix(healpix_ds, nside=nside, cmap=cmap)
-    for band in 'ugrizy':
-        band_visits = visits.query(f"filter == '{band}'")
-        visit_ds = asphere.add_marker(
-            ra=band_visits.fieldRA,
-            decl=band_visits.fieldDec,
-            glyph_size=band_sizes[band],
-            name=band_visits.index.values,
-            min_mjd=band_visits.observationStartMJD.values,
-            circle_kwargs={"fill_alpha": "in_mjd_window", "fill_color": BAND_COLOURS[band], 'line_alpha': 0},
-        )
-        psphere.add_marker(data_source=visit_ds,
-                           glyph_size=band_sizes[band],
-                           name=band_visits.index.values,
-                           min_mjd=band_visits.observationStartMJD.values,
-                           circle_kwargs={"fill_alpha": "in_mjd_window", "fill_color": BAND_COLOURS[band],
-                                          'line_alpha': 0},
-                           )
-    asphere.decorate()
-    psphere.decorate()
+    # All visits are projected once, into one data source, and each band is
+    # drawn from a view of it.
+    band_circle_kwargs = {band: {"fill_color": BAND_COLOURS[band]} for band in 'ugrizy'}
+    visit_circle_kwargs = {"fill_alpha": "in_mjd_window", 'line_alpha': 0}
+    visit_ds = asphere.add_grouped_markers(
+        ra=visits.fieldRA,
+        decl=visits.fieldDec,
+        group=visits["filter"],
+        name=visits.index.values,
+        glyph_size=visits["filter"].map(band_sizes).astype(int),
+        min_mjd=visits.observationStartMJD.values,
+        group_circle_kwargs=band_circle_kwargs,
+        circle_kwargs=visit_circle_kwargs,
+        lod=MarkerLOD(VISIT_LOD_THRESHOLD, VISIT_LOD_NSIDE, conditions.sun_n12_setting),
+    )
+    psphere.add_grouped_markers(data_source=visit_ds,
+                                group_circle_kwargs=band_circle_kwargs,
+                                circle_kwargs=visit_circle_kwargs,
+                                )
+    overlay_sources = asphere.decorate()
+    psphere.decorate(overlay_sources)
     horizon_ds = asphere.add_horizon()
     psphere.add_horizon(data_source=horizon_ds)
     horizon70_ds = asphere.add_horizon(zd=70, line_kwargs={"color": "red", "line_width": 2})
@@ -84,57 +147,29 @@ def skymaps(visits, footprint, conditions):
     return [asphere.figure, psphere.figure]
 
 
-def get_footprint():
-    """Extract the footprint from a survey."""
-    # This is a hack, good enough for example code, not for production.
-
-    # Look through the scheduler to find a blob survey that has a footprint basis function
-    for survey_tier in scheduler.survey_lists:
-        for survey in survey_tier:
-            if survey.__class__.__name__ in ("Blob_survey", "Greedy_survey"):
-                for basis_function in survey.basis_functions:
-                    if basis_function.__class__.__name__.startswith("Footprint"):
-                        footprint = np.sum(basis_function.footprint.footprints, axis=0)
-                        break
-
-    footprint[footprint == 0] = np.nan
-    return footprint
-
-
-def make_visit():
-    try:
-        # Set the site of the observatory:
-        observatory = Model_observatory(mjd_start=NIGHT.mjd - 1)
-
-        # Initialaze the time to the start of the night. Start by getting a conditions object for some time in the night
-        # in question, which will have the sunset time:
-        observatory.mjd = NIGHT.mjd
-        conditions = observatory.return_conditions()
-
-        # Now that we have a conditions object in the night we want, get the sunset time from it to get the specific time
-        # for the start of observing:
-        start_mjd = conditions.sun_n12_setting
+def load_night_visits(night_context, lookback_days=VISIT_LOOKBACK_DAYS):
+    """Load the visits of a night, and of the days before it.
 
-        # Now, create a conditions object for this specific time we want, and update the scheduler for that time:
-        observatory.mjd = start_mjd
-        conditions = observatory.return_conditions()
-        scheduler.update_conditions(conditions)
+    Parameters
+    ----------
+    night_context : `plotting.night_context.NightContext`
+        The context of the night.
+    lookback_days : `float`, optional
+        Number of days before the night from which to also load visits,
+        by default ``VISIT_LOOKBACK_DAYS``.
 
-        with sqlite3.connect(BASELINE_SIM_DB_FNAME) as sim_connection:
-            visits = pd.read_sql_query(
-                "SELECT * FROM observations", sim_connection, index_col="observationId"
-            )
+    Returns
+    -------
+    visits : `pandas.DataFrame`
+        The visits, indexed by ``observationId``.
+    """
+    return load_visits(night_context.start_mjd - lookback_days, night_context.end_mjd)
 
-        footprint = get_footprint()
 
-        observatory.mjd = (conditions.sun_n12_setting + conditions.sun_n12_rising) / 2
-        night_middle_conditions = observatory.return_conditions()
-        return skymaps(visits, footprint, night_middle_conditions)
-    except Exception as e:
-        print(e)
-        traceback.print_exc()
+def make_visit(night_context, visits, footprint):
+    night_middle_conditions = night_context.conditions(night_context.middle_mjd)
+    return skymaps(visits, footprint, night_middle_conditions)
 
 
-def generate_visit_plot():
-    result = worker.submit(make_visit)
-    return bokeh.layouts.row(result.result())
+def generate_visit_plot(night_context, visits, footprint):
+    return bokeh.layouts.row(make_visit(night_context, visits, footprint))
@@ -0,0 +1,142 @@
+import gc
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from plotting.night_context import updated_scheduler
+from plotting.settings import (
+    NIGHT,
+    NIGHT_REWARD_POOLS,
+    NIGHT_REWARD_PROCESSES,
+    scheduler_version,
+)
+
+# Pools of worker processes, by night MJD and scheduler version
+_scheduler_pools = OrderedDict()
+_scheduler_pools_lock = threading.Lock()
+
+# The night context and scheduler, updated for its night, that the workers
+# of a pool are forked with. Only set in this process while forking them.
+_worker_night_context = None
+_worker_scheduler = None
+
+
+def _worker_pid(_):
+    return os.getpid()
+
+
+def worker_scheduler(night):
+    """Return the scheduler a worker process was forked with.
+
+    Parameters
+    ----------
+    night : `astropy.time.Time`
+        The night for which the scheduler is needed.
+
+    Returns
+    -------
+    night_context : `plotting.night_context.NightContext`
+        The context for the night.
+    scheduler : `rubin_sim.scheduler.schedulers.Core_scheduler`
+        The scheduler, already updated for the night.
+
+    Raises
+    ------
+    RuntimeError
+        If the process is not a worker forked for the night. Workers never
+        update or load a scheduler themselves, which would copy the pages
+        they share with the parent.
+    """
+    if _worker_night_context is None or _worker_night_context.night.mjd != night.mjd:
+        raise RuntimeError(f"Process {os.getpid()} has no scheduler for {night.iso}")
+    return _worker_night_context, _worker_scheduler
+
+
+def make_scheduler_pool(max_workers=NIGHT_REWARD_PROCESSES, night=NIGHT):
+    """Make a process pool whose workers share the parent's scheduler.
+
+    Parameters
+    ----------
+    max_workers : `int`, optional
+        The number of worker processes, by default ``NIGHT_REWARD_PROCESSES``.
+    night : `astropy.time.Time`, optional
+        The night for which the workers compute rewards, by default ``NIGHT``.
+
+    Returns
+    -------
+    pool : `concurrent.futures.ProcessPoolExecutor`
+        The process pool, with its workers already started.
+
+    Note
+    ----
+    The scheduler is loaded and updated for the night in this process, and
+    the workers are then forked, so that they share its memory copy-on-write
+    rather than each loading their own. Workers get it with
+    ``worker_scheduler``.
+    """
+    global _worker_night_context, _worker_scheduler
+
+    # Hold the scheduler until the workers are forked, so that they do not
+    # get a copy of it part way through being updated by another thread.
+    with updated_scheduler(night) as (night_context, scheduler):
+        _worker_night_context, _worker_scheduler = night_context, scheduler
+
+        # Move everything allocated so far into the garbage collector's
+        # permanent generation, so that collections in the workers do not
+        # write to (and so copy) the pages holding the scheduler.
+        gc.collect()
+        gc.freeze()
+
+        pool = ProcessPoolExecutor(
+            max_workers, mp_context=multiprocessing.get_context("fork")
+        )
+
+        # Fork the workers now, rather than when the first job is submitted.
+        try:
+            list(pool.map(_worker_pid, range(max_workers)))
+        finally:
+            # The workers have their own copy of the permanent generation,
+            # so let this (long running) process collect those objects again.
+            gc.unfreeze()
+            _worker_night_context, _worker_scheduler = None, None
+
+    return pool
+
+
+def get_scheduler_pool(night=NIGHT):
+    """Return the pool of worker processes for a night, starting it if needed.
+
+    Pools are kept for the last ``NIGHT_REWARD_POOLS`` nights used. When the
+    scheduler file changes, a new pool is started, with workers forked from
+    a process with the new scheduler. Pools that are no longer kept are shut
+    down once their jobs are done.
+
+    Parameters
+    ----------
+    night : `astropy.time.Time`, optional
+        The night, by default ``NIGHT``.
+
+    Returns
+    -------
+    pool : `concurrent.futures.ProcessPoolExecutor`
+        The process pool.
+    """
+    with _scheduler_pools_lock:
+        key = (night.mjd, scheduler_version())
+        if key not in _scheduler_pools:
+            _scheduler_pools[key] = make_scheduler_pool(night=night)
+        _scheduler_pools.move_to_end(key)
+
+        old_pools = []
+        for other_key in list(_scheduler_pools):
+            if other_key[1] != key[1] or len(_scheduler_pools) > NIGHT_REWARD_POOLS:
+                old_pools.append(_scheduler_pools.pop(other_key))
+
+        pool = _scheduler_pools[key]
+
+    for old_pool in old_pools:
+        old_pool.shutdown(wait=False)
+
+    return pool
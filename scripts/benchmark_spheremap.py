@@ -0,0 +1,221 @@
+"""Benchmarks for building spheremap data sources.
+
+Run from the project root with:
+
+    PYTHONPATH=`pwd` python scripts/benchmark_spheremap.py
+"""
+import timeit
+import warnings
+from unittest import mock
+
+import healpy as hp
+import numpy as np
+from astropy.coordinates import frame_transform_graph
+
+from rubin_sim.utils import ObservationMetaData, approx_RaDec2AltAz, calcLmstLast
+
+from plotting import spheremap
+from plotting.spheremap import ArmillarySphere, Planisphere
+
+MJD = 60222.1
+
+
+def report(name, func, repeat=3, number=1):
+    """Print the best time of a number of repeated calls of a function.
+
+    Parameters
+    ----------
+    name : `str`
+        Name of the benchmark.
+    func : `Callable`
+        Function to time, called with no arguments.
+    repeat : `int`, optional
+        Number of times to repeat the timing, by default 3
+    number : `int`, optional
+        Number of calls in each timing, by default 1
+    """
+    best = min(timeit.repeat(func, repeat=repeat, number=number)) / number
+    print(f"{name:<50s} {best * 1000:10.2f} ms")
+
+
+def benchmark_healpix_data_source(nsides=(16, 32, 64, 128)):
+    psphere = Planisphere(mjd=MJD)
+    for nside in nsides:
+        values = np.random.default_rng(6563).random(hp.nside2npix(nside))
+
+        def make_uncached():
+            spheremap.HEALPIX_GEOMETRY_CACHE.clear()
+            psphere.make_healpix_data_source(values, nside=nside)
+
+        def make_cached():
+            psphere.make_healpix_data_source(values, nside=nside)
+
+        report(f"make_healpix_data_source nside={nside}", make_uncached)
+        report(f"make_healpix_data_source nside={nside} (cached)", make_cached)
+
+
+def benchmark_circles(num_circles=(1, 100, 10000)):
+    psphere = Planisphere(mjd=MJD)
+    report("make_circle_points", lambda: psphere.make_circle_points(30, -40, 20))
+    rng = np.random.default_rng(6563)
+    for num in num_circles:
+        ras = rng.uniform(0, 360, num)
+        decls = np.degrees(np.arcsin(rng.uniform(-1, 1, num)))
+        report(
+            f"make_circles_points {num} circles",
+            lambda: psphere.make_circles_points(ras, decls, 1.75, step=10),
+        )
+
+
+def benchmark_graticules():
+    psphere = Planisphere(mjd=MJD)
+
+    def make_uncached():
+        spheremap.OVERLAY_CACHE.clear()
+        psphere.make_graticule_points()
+
+    report("make_graticule_points", make_uncached)
+    report("make_graticule_points (cached)", psphere.make_graticule_points)
+    report("make_horizon_graticule_points", psphere.make_horizon_graticule_points)
+
+
+def benchmark_markers(num_markers=(1000, 10000, 100000)):
+    psphere = Planisphere(mjd=MJD)
+    rng = np.random.default_rng(6563)
+    for num in num_markers:
+        ras = rng.uniform(0, 360, num)
+        decls = np.degrees(np.arcsin(rng.uniform(-1, 1, num)))
+        min_mjds = MJD + rng.uniform(-7, 1, num)
+        report(
+            f"make_marker_data_source {num} markers",
+            lambda: psphere.make_marker_data_source(
+                ras, decls, name=np.arange(num), glyph_size=5, min_mjd=min_mjds
+            ),
+        )
+
+
+def benchmark_orth_projection(num_points=(1000, 100000, 1000000)):
+    psphere = Planisphere(mjd=MJD)
+    rng = np.random.default_rng(6563)
+    for num in num_points:
+        vecs = rng.normal(size=(3, num))
+        vecs /= np.linalg.norm(vecs, axis=0)
+        report(f"to_orth_zenith {num} points", lambda: psphere.to_orth_zenith(*vecs))
+
+
+def benchmark_project_times(num_points=(1000, 100000), num_times=25):
+    asphere = ArmillarySphere(mjd=MJD)
+    rng = np.random.default_rng(6563)
+    mjds = np.linspace(MJD - 0.2, MJD + 0.2, num_times)
+    for num in num_points:
+        ras = rng.uniform(0, 360, num)
+        decls = np.degrees(np.arcsin(rng.uniform(-1, 1, num)))
+
+        def project_each_time():
+            for mjd in mjds:
+                asphere.mjd = mjd
+                asphere.eq_to_horizon(ras, decls, cart=False)
+                asphere.eq_to_horizon(ras, decls)
+                asphere.to_orth_zenith(*hp.ang2vec(ras, decls, lonlat=True).T)
+
+        report(f"project {num} points at {num_times} times, one by one", project_each_time)
+        report(
+            f"project_times {num} points at {num_times} times",
+            lambda: asphere.project_times(ras, decls, mjds),
+        )
+
+
+def _previous_eq_to_horizon(sphere_map, ra, decl):
+    # The horizon projection as it was computed before horizon_kernel:
+    # transform to alt, az, then project, with the trig of each done again.
+    ObservationMetaData(mjd=sphere_map.mjd, site=sphere_map.site)
+    alt, az = approx_RaDec2AltAz(
+        ra, decl, sphere_map.site.latitude, sphere_map.site.longitude, sphere_map.mjd
+    )
+    zd = np.pi / 2 - np.radians(alt)
+    x = -zd * np.sin(np.radians(az))
+    y = zd * np.cos(np.radians(az))
+    invisible = alt < sphere_map.alt_limit
+    x[invisible] = np.nan
+    y[invisible] = np.nan
+    return alt, az, x, y
+
+
+def benchmark_eq_to_horizon(num_points=(10**3, 10**4, 10**5, 10**6, 10**7)):
+    psphere = Planisphere(mjd=MJD)
+    rng = np.random.default_rng(6563)
+    for num in num_points:
+        ras = rng.uniform(0, 360, num)
+        decls = np.degrees(np.arcsin(rng.uniform(-1, 1, num)))
+        out = tuple(np.empty(num) for _ in range(4))
+        report(
+            f"previous eq_to_horizon {num} points",
+            lambda: _previous_eq_to_horizon(psphere, ras, decls),
+        )
+        report(
+            f"horizon_coords {num} points",
+            lambda: psphere.horizon_coords(ras, decls),
+        )
+        report(
+            f"horizon_coords {num} points, into buffers",
+            lambda: psphere.horizon_coords(ras, decls, out=out),
+        )
+
+
+def benchmark_sidereal_time(num_times=(1, 100, 10000)):
+    psphere = Planisphere(mjd=MJD)
+    longitude = psphere.site.longitude_rad
+    report("calcLmstLast", lambda: calcLmstLast(MJD, longitude), number=1000)
+    report("SphereMap.lst, cached", lambda: psphere.lst, number=1000)
+    for num in num_times:
+        mjds = MJD + np.linspace(0, 1, num)
+        report(
+            f"calcLmstLast {num} times, one at a time",
+            lambda: [calcLmstLast(mjd, longitude) for mjd in mjds],
+        )
+        report(
+            f"local_sidereal_times {num} times",
+            lambda: psphere.local_sidereal_times(mjds),
+        )
+
+
+def benchmark_decorate():
+    # Clear the overlay cache before each call, so that every decoration
+    # computes its geometry, as for a map with a new projection.
+    def decorate(clear_poles):
+        spheremap.OVERLAY_CACHE.clear()
+        if clear_poles:
+            spheremap.ecliptic_pole.cache_clear()
+            spheremap.galactic_pole.cache_clear()
+            spheremap.circle_coords.cache_clear()
+        Planisphere(mjd=MJD).decorate()
+
+    for clear_poles, name in ((True, "uncached poles"), (False, "cached poles")):
+        decorate(False)
+        with mock.patch.object(
+            frame_transform_graph,
+            "get_transform",
+            wraps=frame_transform_graph.get_transform,
+        ) as get_transform:
+            decorate(clear_poles)
+        print(f"decorate, {name}: {get_transform.call_count} astropy transforms")
+        report(f"decorate, {name}", lambda: decorate(clear_poles))
+
+
+BENCHMARKS = (
+    benchmark_healpix_data_source,
+    benchmark_circles,
+    benchmark_graticules,
+    benchmark_markers,
+    benchmark_orth_projection,
+    benchmark_project_times,
+    benchmark_eq_to_horizon,
+    benchmark_sidereal_time,
+    benchmark_decorate,
+)
+
+if __name__ == "__main__":
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", category=RuntimeWarning)
+        for benchmark in BENCHMARKS:
+            benchmark()
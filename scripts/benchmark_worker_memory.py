@@ -0,0 +1,112 @@
+"""Benchmark the memory used by night reward worker processes.
+
+Compares workers forked from a process that has already loaded the scheduler
+(as used by the night reward plot) with workers that each load their own.
+Memory is reported as RSS and PSS (which divides shared pages between the
+processes sharing them) from /proc, so this only runs on Linux.
+
+Run from the project root with:
+
+    PYTHONPATH=`pwd` python scripts/benchmark_worker_memory.py
+
+To measure without a scheduler file, use a stand-in scheduler of a given
+size instead, e.g. ``--stand-in-mib 400``.
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from plotting import settings
+from plotting.settings import NIGHT_REWARD_PROCESSES, get_scheduler
+from plotting.worker_pool import make_scheduler_pool
+
+
+class StandInScheduler:
+    def __init__(self, size_mib):
+        """A scheduler-sized object: healpix-map-like arrays, and many small
+        python objects (whose reference counts are written by every process
+        that touches them).
+
+        Parameters
+        ----------
+        size_mib : `float`
+            The approximate size, in MiB, half in each.
+        """
+        num_maps = max(1, int(size_mib / 2 / 6))
+        self.maps = [np.random.random(12 * 256**2) for _ in range(num_maps)]
+        num_objects = int(size_mib / 2 * 2**20 / 250)
+        self.objects = [{"index": i, "name": f"object {i}"} for i in range(num_objects)]
+        self.survey_lists = []
+
+    def update_conditions(self, conditions):
+        pass
+
+
+def _use_stand_in_scheduler(size_mib):
+    settings._scheduler = StandInScheduler(size_mib)
+
+
+def memory_usage(pid="self"):
+    """Return the RSS and PSS of a process, in MiB."""
+    usage = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as smaps_io:
+        for line in smaps_io:
+            fields = line.split()
+            if fields[0] in ("Rss:", "Pss:"):
+                usage[fields[0][:-1]] = int(fields[1]) / 1024
+    return usage
+
+
+def _worker_memory_usage(_):
+    # Make sure the worker has a scheduler, then hold the worker long enough
+    # for every worker to get a job.
+    get_scheduler()
+    time.sleep(1)
+    return os.getpid(), memory_usage()
+
+
+def report(name, pool, num_workers):
+    worker_usage = dict(pool.map(_worker_memory_usage, range(num_workers)))
+    parent_usage = memory_usage()
+    total_rss = parent_usage["Rss"] + sum(u["Rss"] for u in worker_usage.values())
+    total_pss = parent_usage["Pss"] + sum(u["Pss"] for u in worker_usage.values())
+    print(
+        f"{name:<30s} {len(worker_usage):3d} workers"
+        f" total RSS {total_rss:10.1f} MiB total PSS {total_pss:10.1f} MiB"
+    )
+
+
+def benchmark_worker_memory(num_workers=NIGHT_REWARD_PROCESSES, stand_in_mib=None):
+    initializer, initargs = None, ()
+    if stand_in_mib is not None:
+        initializer, initargs = _use_stand_in_scheduler, (stand_in_mib,)
+        _use_stand_in_scheduler(stand_in_mib)
+
+    with ProcessPoolExecutor(
+        num_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=initializer,
+        initargs=initargs,
+    ) as pool:
+        report("spawned, each loading", pool, num_workers)
+
+    pool = make_scheduler_pool(num_workers)
+    report("forked from loaded parent", pool, num_workers)
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=NIGHT_REWARD_PROCESSES)
+    parser.add_argument(
+        "--stand-in-mib",
+        type=float,
+        default=None,
+        help="use a stand-in scheduler of this size, rather than loading one",
+    )
+    args = parser.parse_args()
+    benchmark_worker_memory(args.workers, args.stand_in_mib)
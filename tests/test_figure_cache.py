@@ -0,0 +1,261 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from astropy.time import Time
+from bokeh.models import Div
+
+from plotting import figure_cache
+from plotting.figure_cache import FigureCache, PlotTask, hydrate_figure
+
+NIGHTS = [Time("2023-10-04", scale="utc") + days for days in range(4)]
+TIMEOUT = 10
+
+
+class SchedulerVersion:
+    # Stands in for scheduler_version, so that tests can change it.
+    def __init__(self):
+        self.version = "v1"
+
+    def __call__(self):
+        return self.version
+
+
+class Generator:
+    # Generates Divs naming the scheduler version, counting its calls and
+    # failing while ``fail`` is set.
+    def __init__(self, scheduler_version):
+        self.scheduler_version = scheduler_version
+        self.calls = 0
+        self.fail = False
+
+    def __call__(self, **parameters):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError("generator failed")
+        return Div(text=f"{self.scheduler_version()} {parameters}")
+
+
+class Stream:
+    # A plot that is filled in by compute, once ``release`` is set.
+    def __init__(self, fail=False):
+        self.figure = Div(text="empty")
+        self.release = threading.Event()
+        self.fail = fail
+        self.complete = False
+        self.error = None
+
+    def compute(self):
+        self.release.wait(TIMEOUT)
+        if self.fail:
+            raise RuntimeError("stream failed")
+        self.figure.text = "computed"
+        self.complete = True
+
+    def stream(self):
+        pass
+
+
+@pytest.fixture
+def scheduler_version(monkeypatch):
+    scheduler_version = SchedulerVersion()
+    monkeypatch.setattr(figure_cache, "scheduler_version", scheduler_version)
+    return scheduler_version
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(2)
+    yield executor
+    executor.shutdown(wait=True, cancel_futures=True)
+
+
+def make_cache(generators, executor, **kwargs):
+    plots = {name: PlotTask(generate, ()) for name, generate in generators.items()}
+    return FigureCache(
+        plots, executor, add_shared_tasks=lambda graph, night: None, **kwargs
+    )
+
+
+def wait_for(cache, name, night=NIGHTS[0], text=None):
+    # Return the cached figure once it has a snapshot (with the given text)
+    # or an error.
+    end_time = time.monotonic() + TIMEOUT
+    while time.monotonic() < end_time:
+        cached = cache.get(name, night)
+        if cached.error is not None:
+            return cached
+        if cached.snapshot is not None and (
+            text is None or hydrate_figure(cached.snapshot).text == text
+        ):
+            return cached
+        time.sleep(0.01)
+    raise TimeoutError(f"{name} was not generated")
+
+
+def text(cached):
+    return hydrate_figure(cached.snapshot).text
+
+
+def test_plots_are_generated_once(scheduler_version, executor):
+    generator = Generator(scheduler_version)
+    cache = make_cache({"plot": generator}, executor)
+
+    first = cache.get("plot")
+    assert first.snapshot is None and first.error is None
+    assert text(wait_for(cache, "plot")) == "v1 {}"
+    cache.get("plot")
+    assert generator.calls == 1
+
+    # Parameters make a different plot
+    cached = cache.get("plot", parameters={"band": "g"})
+    while cached.snapshot is None:
+        time.sleep(0.01)
+        cached = cache.get("plot", parameters={"band": "g"})
+    assert text(cached) == "v1 {'band': 'g'}"
+    assert generator.calls == 2
+
+
+def test_least_recently_used_are_evicted(scheduler_version, executor):
+    generator = Generator(scheduler_version)
+    cache = make_cache({"plot": generator}, executor, max_size=2)
+
+    for night in NIGHTS[:2]:
+        wait_for(cache, "plot", night)
+    # Use the first night, so that the second is the least recently used.
+    cache.get("plot", NIGHTS[0])
+    wait_for(cache, "plot", NIGHTS[2])
+    assert generator.calls == 3
+
+    assert cache.get("plot", NIGHTS[0]).snapshot is not None
+    assert cache.get("plot", NIGHTS[2]).snapshot is not None
+    assert generator.calls == 3
+    # The second night is generated again.
+    assert cache.get("plot", NIGHTS[1]).snapshot is None
+    wait_for(cache, "plot", NIGHTS[1])
+    assert generator.calls == 4
+    assert len(cache._snapshots) == 2
+
+
+def test_older_version_served_until_replaced(scheduler_version, executor):
+    generator = Generator(scheduler_version)
+    release = threading.Event()
+
+    def generate():
+        if scheduler_version.version != "v1":
+            release.wait(TIMEOUT)
+        return generator()
+
+    cache = make_cache({"plot": generate}, executor)
+    wait_for(cache, "plot")
+
+    scheduler_version.version = "v2"
+    assert text(cache.get("plot")) == "v1 {}"
+    release.set()
+    assert text(wait_for(cache, "plot", text="v2 {}")) == "v2 {}"
+    # The old version is kept until evicted, but not returned.
+    assert text(cache.get("plot")) == "v2 {}"
+
+
+def test_errors_are_retried(scheduler_version, executor):
+    generator = Generator(scheduler_version)
+    generator.fail = True
+    cache = make_cache({"plot": generator}, executor, error_retry_seconds=1)
+
+    cached = wait_for(cache, "plot")
+    assert isinstance(cached.error, RuntimeError)
+    assert cached.snapshot is None
+
+    # Not retried until error_retry_seconds have passed
+    generator.fail = False
+    assert cache.get("plot").error is not None
+    assert generator.calls == 1
+    time.sleep(1)
+    assert text(wait_for(cache, "plot")) == "v1 {}"
+    assert generator.calls == 2
+    assert len(cache._errors) == 0
+
+
+def test_errors_are_pruned(scheduler_version, executor):
+    generator = Generator(scheduler_version)
+    generator.fail = True
+    cache = make_cache({"plot": generator}, executor, error_retry_seconds=0.2)
+    for night in NIGHTS[:3]:
+        assert wait_for(cache, "plot", night).error is not None
+    assert len(cache._errors) == 3
+
+    # Adding a snapshot drops the errors that have expired.
+    time.sleep(0.2)
+    generator.fail = False
+    wait_for(cache, "plot", NIGHTS[3])
+    assert len(cache._errors) == 0
+
+
+def test_streams(scheduler_version, executor):
+    streams = []
+
+    def generate(fail=False):
+        streams.append(Stream(fail))
+        return streams[-1]
+
+    cache = make_cache({"stream": generate}, executor)
+    cached = wait_for(cache, "stream")
+    assert text(cached) == "empty"
+    assert cached.stream is streams[0]
+
+    streams[0].release.set()
+    cached = wait_for(cache, "stream", text="computed")
+    assert cached.stream is None
+
+    # A stream that fails is discarded, and its error returned.
+    cached = cache.get("stream", parameters={"fail": True})
+    while len(streams) < 2:
+        time.sleep(0.01)
+    streams[1].release.set()
+    end_time = time.monotonic() + TIMEOUT
+    while cached.error is None and time.monotonic() < end_time:
+        time.sleep(0.01)
+        cached = cache.get("stream", parameters={"fail": True})
+    assert isinstance(cached.error, RuntimeError)
+    assert cached.snapshot is None
+
+
+def test_cache_dir(scheduler_version, executor, tmp_path):
+    generator = Generator(scheduler_version)
+    cache = make_cache({"plot": generator}, executor, cache_dir=str(tmp_path))
+    wait_for(cache, "plot")
+    (fname,) = os.listdir(tmp_path)
+
+    # A new cache (e.g. after a restart) loads the saved snapshot.
+    cache = make_cache({"plot": generator}, executor, cache_dir=str(tmp_path))
+    assert text(cache.get("plot")) == "v1 {}"
+    assert generator.calls == 1
+
+    # A corrupt file is generated again, and replaced.
+    with open(tmp_path / fname, "w") as snapshot_io:
+        snapshot_io.write("{")
+    cache = make_cache({"plot": generator}, executor, cache_dir=str(tmp_path))
+    assert text(wait_for(cache, "plot")) == "v1 {}"
+    assert generator.calls == 2
+    cache = make_cache({"plot": generator}, executor, cache_dir=str(tmp_path))
+    assert text(cache.get("plot")) == "v1 {}"
+
+
+def test_refresh_cached(scheduler_version, executor):
+    generator = Generator(scheduler_version)
+    cache = make_cache({"plot": generator}, executor)
+    for night in NIGHTS[:2]:
+        wait_for(cache, "plot", night)
+
+    scheduler_version.version = "v2"
+    cache.refresh_cached()
+    end_time = time.monotonic() + TIMEOUT
+    while generator.calls < 4 or cache._pending:
+        assert time.monotonic() < end_time
+        time.sleep(0.01)
+    assert generator.calls == 4
+    for night in NIGHTS[:2]:
+        assert text(cache.get("plot", night)) == "v2 {}"
+    assert generator.calls == 4
@@ -0,0 +1,162 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from plotting.night_reward import check_survey_rewards, reward_bfs_df
+
+BASIS_FUNCTIONS = ("Slewtime", "M5_diff", "Footprint")
+
+
+class FakeSurvey:
+    def __init__(self, survey_name, rewards, feasible):
+        self.survey_name = survey_name
+        self.rewards = rewards
+        self.feasible = feasible
+
+    def calc_reward_function(self, conditions):
+        return np.array([np.nan, self.rewards[-1] - 1, self.rewards[-1]])
+
+
+class FakeScheduler:
+    def __init__(self, survey_names, seed=5):
+        rng = np.random.default_rng(seed)
+        self.survey_lists = [
+            [
+                FakeSurvey(
+                    survey_name,
+                    np.cumsum(rng.uniform(-1, 1, len(BASIS_FUNCTIONS))),
+                    rng.uniform(size=len(BASIS_FUNCTIONS)) > 0.2,
+                )
+                for survey_name in tier_names
+            ]
+            for tier_names in survey_names
+        ]
+
+    def make_reward_df(self, conditions):
+        rows = [
+            {
+                "list_index": list_index,
+                "survey_index": survey_index,
+                "basis_function": basis_function,
+                "feasible": survey.feasible[i],
+                "accum_reward": survey.rewards[i],
+            }
+            for list_index, survey_list in enumerate(self.survey_lists)
+            for survey_index, survey in enumerate(survey_list)
+            for i, basis_function in enumerate(BASIS_FUNCTIONS)
+        ]
+        return pd.DataFrame(rows).set_index(["list_index", "survey_index"])
+
+
+def baseline_reward_bfs_df(scheduler, conditions):
+    # The row by row implementation that reward_bfs_df replaced.
+    reward_df = scheduler.make_reward_df(conditions)
+    summary_df = reward_df.reset_index()
+
+    def make_tier_name(row):
+        tier_name = f"tier {row.list_index}"
+        return tier_name
+
+    summary_df["tier"] = summary_df.apply(make_tier_name, axis=1)
+
+    def get_survey_name(row):
+        survey_name = scheduler.survey_lists[row.list_index][
+            row.survey_index
+        ].survey_name
+        return survey_name
+
+    summary_df["survey_name"] = summary_df.apply(get_survey_name, axis=1)
+
+    def make_survey_row(survey_bfs):
+        infeasible_bf = ", ".join(
+            survey_bfs.loc[~survey_bfs.feasible.astype(bool)].basis_function.to_list()
+        )
+        infeasible = ~np.all(survey_bfs.feasible.astype(bool))
+        list_index = survey_bfs.list_index.iloc[0]
+        survey_index = survey_bfs.survey_index.iloc[0]
+        direct_reward = scheduler.survey_lists[list_index][
+            survey_index
+        ].calc_reward_function(conditions)
+        reward = survey_bfs.accum_reward.iloc[-1]
+        assert reward == np.nanmax(direct_reward)
+        survey_row = pd.Series(
+            {
+                "reward": reward,
+                "infeasible": infeasible,
+                "infeasible_bfs": infeasible_bf,
+            }
+        )
+        return survey_row
+
+    survey_df = summary_df.groupby(["tier", "survey_name"]).apply(make_survey_row)
+    return survey_df
+
+
+def test_reward_bfs_df_matches_baseline():
+    survey_names = [
+        ["greedy u", "greedy g"],
+        ["blob ug", "blob gr", "blob ri"],
+        ["ddf"],
+    ]
+    scheduler = FakeScheduler(survey_names)
+    survey_df = reward_bfs_df(scheduler, None)
+    baseline_df = baseline_reward_bfs_df(scheduler, None)
+
+    baseline_df = baseline_df.astype({"reward": float, "infeasible": bool})
+    pd.testing.assert_frame_equal(survey_df, baseline_df)
+
+
+def test_reward_bfs_df_duplicate_names():
+    # Surveys in the same tier with the same name are merged, with the reward
+    # of the last of them.
+    scheduler = FakeScheduler([["blob", "blob"], ["blob"]])
+    survey_df = reward_bfs_df(scheduler, None)
+    assert list(survey_df.index) == [("tier 0", "blob"), ("tier 1", "blob")]
+    assert survey_df.loc[("tier 0", "blob"), "reward"] == (
+        scheduler.survey_lists[0][1].rewards[-1]
+    )
+    assert survey_df.loc[("tier 0", "blob"), "infeasible"] == (
+        not np.all(np.concatenate([s.feasible for s in scheduler.survey_lists[0]]))
+    )
+
+
+def last_bfs(scheduler):
+    summary_df = scheduler.make_reward_df(None).reset_index()
+    return summary_df.drop_duplicates(["list_index", "survey_index"], keep="last")
+
+
+def test_check_survey_rewards():
+    scheduler = FakeScheduler([[f"survey {i}" for i in range(50)]])
+    check_survey_rewards(scheduler, None, last_bfs(scheduler), mode="always")
+
+    # A survey whose reward differs from the one in the reward_df
+    survey = scheduler.survey_lists[0][3]
+    survey.calc_reward_function = lambda conditions: survey.rewards[-1:] + 1
+    with pytest.raises(AssertionError):
+        check_survey_rewards(scheduler, None, last_bfs(scheduler), mode="always")
+    # The check can be turned off
+    check_survey_rewards(scheduler, None, last_bfs(scheduler), mode="off")
+    with pytest.raises(ValueError):
+        check_survey_rewards(scheduler, None, last_bfs(scheduler), mode="never")
+
+
+def test_sampled_reward_checks_are_reproducible(monkeypatch):
+    scheduler = FakeScheduler([[f"survey {i}" for i in range(200)]])
+    checked = set()
+
+    def calc_reward_function(survey, conditions):
+        checked.add(survey.survey_name)
+        return np.array([survey.rewards[-1]])
+
+    monkeypatch.setattr(FakeSurvey, "calc_reward_function", calc_reward_function)
+    check_survey_rewards(scheduler, None, last_bfs(scheduler), mode="sampled", seed=1)
+    first_checked = set(checked)
+    assert 0 < len(first_checked) < 200
+
+    checked.clear()
+    check_survey_rewards(scheduler, None, last_bfs(scheduler), mode="sampled", seed=1)
+    assert checked == first_checked
+
+    checked.clear()
+    check_survey_rewards(scheduler, None, last_bfs(scheduler), mode="sampled", seed=2)
+    assert checked != first_checked
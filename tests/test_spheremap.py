@@ -0,0 +1,367 @@
+import healpy as hp
+import numpy as np
+import pandas as pd
+import pytest
+from rubin_sim.utils import approx_RaDec2AltAz
+
+from plotting.spheremap import (
+    MarkerLOD,
+    Planisphere,
+    bin_markers,
+    offset_sep_bear,
+    orth_zenith_rotation,
+    rotate_cart,
+)
+
+# An MJD in the middle of a night at the site
+TEST_MJD = 60222.2
+
+
+def baseline_offset_sep_bear(ra, decl, sep, bearing):
+    # The scalar implementation that offset_sep_bear replaced, in radians.
+    np_sep = np.pi / 2 - decl
+    new_np_sep = np.arccos(
+        np.cos(np_sep) * np.cos(sep) + np.sin(np_sep) * np.sin(sep) * np.cos(bearing)
+    )
+    new_decl = np.pi / 2 - new_np_sep
+    dra = np.arctan2(
+        np.sin(sep) * np.sin(bearing) * np.sin(np_sep),
+        np.cos(sep) - np.cos(new_np_sep) * np.cos(np_sep),
+    )
+    if np.abs(np.cos(decl)) < 1e-12:
+        dra = np.pi / 2 + np.cos(np_sep) * (np.pi / 2 - bearing)
+    return ra + dra, new_decl
+
+
+def baseline_circle_points(sphere_map, center_ra, center_decl, radius, step):
+    # The point by point implementation that make_circles_points replaced.
+    ras = []
+    decls = []
+    bearings = []
+    for bearing in range(0, 360 + step, step):
+        ra, decl = baseline_offset_sep_bear(
+            np.radians(center_ra),
+            np.radians(center_decl),
+            np.radians(radius),
+            np.radians(bearing),
+        )
+        ras.append(np.degrees(ra))
+        decls.append(np.degrees(decl))
+        bearings.append(bearing)
+    ras = np.array(ras)
+    decls = np.array(decls)
+
+    x0s, y0s, z0s = hp.ang2vec(ras, decls, lonlat=True).T
+    xs, ys, zs = sphere_map.to_orth_zenith(x0s, y0s, z0s)
+    x_laea, y_laea = sphere_map.laea_proj.ang2xy(ras, decls, lonlat=True)
+    x_moll, y_moll = sphere_map.moll_proj.ang2xy(ras, decls, lonlat=True)
+    x_hz, y_hz = sphere_map.eq_to_horizon(ras, decls)
+
+    if sphere_map.site.latitude < 0:
+        laea_discont = decls > sphere_map.laea_limit
+    else:
+        laea_discont = decls < sphere_map.laea_limit
+    x_laea[laea_discont] = np.nan
+    y_laea[laea_discont] = np.nan
+
+    moll_discont = np.abs(ras - 180) < step
+    x_moll[moll_discont] = np.nan
+    y_moll[moll_discont] = np.nan
+
+    return {
+        "bearing": np.array(bearings),
+        "ra": ras,
+        "decl": decls,
+        "x_hp": x0s,
+        "y_hp": y0s,
+        "z_hp": z0s,
+        "x_orth": xs,
+        "y_orth": ys,
+        "z_orth": zs,
+        "x_laea": x_laea,
+        "y_laea": y_laea,
+        "x_moll": x_moll,
+        "y_moll": y_moll,
+        "x_hz": x_hz,
+        "y_hz": y_hz,
+    }
+
+
+def baseline_to_orth_zenith(latitude, lst, hpx, hpy, hpz):
+    # The rotation by rotation implementation that orth_zenith_rotation
+    # replaced, in SphereMap.to_orth_zenith.
+    x1, y1, z1 = rotate_cart(0, 0, 1, -90, hpx, hpy, hpz)
+    x2, y2, z2 = rotate_cart(1, 0, 0, latitude + 90, x1, y1, z1)
+
+    npole_x1, npole_y1, npole_z1 = rotate_cart(0, 0, 1, -90, 0, 0, 1)
+    npole_x2, npole_y2, npole_z2 = rotate_cart(
+        1, 0, 0, latitude + 90, npole_x1, npole_y1, npole_z1
+    )
+    x3, y3, z3 = rotate_cart(npole_x2, npole_y2, npole_z2, -lst, x2, y2, z2)
+
+    orient = np.degrees(np.arctan2(npole_y2, npole_x2))
+    x4, y4, z4 = rotate_cart(0, 0, 1, 90 - orient, x3, y3, z3)
+
+    orth_invisible = z4 > np.finfo(z4.dtype).resolution
+    x4[orth_invisible] = np.nan
+    y4[orth_invisible] = np.nan
+    z4[orth_invisible] = np.nan
+
+    return x4, y4, z4
+
+
+def baseline_eq_to_horizon(sphere_map, ra, decl):
+    # The implementation that SphereMap.horizon_coords replaced, in
+    # SphereMap.eq_to_horizon, with APPROX_COORD_TRANSFORMS, in degrees.
+    alt, az = approx_RaDec2AltAz(
+        ra,
+        decl,
+        sphere_map.site.latitude,
+        sphere_map.site.longitude,
+        sphere_map.mjd,
+    )
+    zd = np.pi / 2 - np.radians(alt)
+    x = -zd * np.sin(np.radians(az))
+    y = zd * np.cos(np.radians(az))
+    invisible = alt < sphere_map.alt_limit
+    x[invisible] = np.nan
+    y[invisible] = np.nan
+    return alt, az, x, y
+
+
+def healpix_vectors(nside=8):
+    return hp.pix2vec(nside, np.arange(hp.nside2npix(nside)))
+
+
+@pytest.fixture
+def sphere_map():
+    return Planisphere(mjd=TEST_MJD)
+
+
+@pytest.mark.parametrize("decl", [-90.0, -45.0, 0.0, 30.0, 90.0])
+def test_offset_sep_bear_matches_baseline(decl):
+    ra = 40.0
+    seps = np.array([0.0, 1.0, 30.0, 90.0, 150.0])
+    bearings = np.arange(0.0, 361.0, 15.0)
+    new_ras, new_decls = offset_sep_bear(
+        ra, decl, seps[:, np.newaxis], bearings[np.newaxis, :], degrees=True
+    )
+    assert new_ras.shape == (len(seps), len(bearings))
+
+    for i, sep in enumerate(seps):
+        for j, bearing in enumerate(bearings):
+            baseline_ra, baseline_decl = baseline_offset_sep_bear(
+                np.radians(ra), np.radians(decl), np.radians(sep), np.radians(bearing)
+            )
+            assert new_ras[i, j] == pytest.approx(np.degrees(baseline_ra), abs=1e-9)
+            assert new_decls[i, j] == pytest.approx(
+                np.degrees(baseline_decl), abs=1e-9
+            )
+
+
+def test_offset_sep_bear_scalar():
+    new_ra, new_decl = offset_sep_bear(0.0, 0.0, np.pi / 2, 0.0)
+    assert np.ndim(new_ra) == 0
+    assert new_ra == pytest.approx(0.0)
+    assert new_decl == pytest.approx(np.pi / 2)
+
+
+def test_make_circles_points_matches_baseline(sphere_map):
+    center_ras = np.array([0.0, 90.0, 200.0, 310.0])
+    center_decls = np.array([-80.0, -30.0, 0.0, 45.0])
+    radii = np.array([10.0, 45.0, 90.0, 20.0])
+    step = 5
+
+    circles = sphere_map.make_circles_points(
+        center_ras, center_decls, radii, step=step
+    ).data
+    num_points = len(range(0, 360 + step, step))
+    # Each circle is followed by a row of NaNs
+    assert len(circles["circle"]) == len(center_ras) * (num_points + 1)
+
+    for circle, (center_ra, center_decl, radius) in enumerate(
+        zip(center_ras, center_decls, radii)
+    ):
+        baseline = baseline_circle_points(
+            sphere_map, center_ra, center_decl, radius, step
+        )
+        start = circle * (num_points + 1)
+        end = start + num_points
+        assert np.all(circles["circle"][start:end] == circle)
+        assert np.all(np.isnan(circles["circle"][end]))
+        for column, baseline_values in baseline.items():
+            # Data source columns are float32
+            np.testing.assert_allclose(
+                circles[column][start:end],
+                baseline_values,
+                rtol=1e-5,
+                atol=1e-5,
+                err_msg=column,
+            )
+
+
+def test_make_circle_points_matches_baseline(sphere_map):
+    circle = sphere_map.make_circle_points(120.0, -20.0, 30.0, step=2).data
+    baseline = baseline_circle_points(sphere_map, 120.0, -20.0, 30.0, 2)
+    for column, baseline_values in baseline.items():
+        np.testing.assert_allclose(
+            circle[column], baseline_values, rtol=1e-5, atol=1e-5, err_msg=column
+        )
+
+
+@pytest.mark.parametrize("latitude", [-30.2444, 0.0, 19.8])
+@pytest.mark.parametrize("lst", [0.0, 97.5, 271.0])
+def test_orth_zenith_rotation_matches_baseline(latitude, lst):
+    hpx, hpy, hpz = healpix_vectors()
+    rotation = orth_zenith_rotation(latitude, lst)
+    assert not rotation.flags.writeable
+    np.testing.assert_allclose(rotation @ rotation.T, np.eye(3), atol=1e-12)
+
+    x, y, z = rotation @ np.stack([hpx, hpy, hpz])
+    visible = z <= np.finfo(z.dtype).resolution
+    x[~visible] = np.nan
+    y[~visible] = np.nan
+    z[~visible] = np.nan
+    for values, baseline_values in zip(
+        (x, y, z), baseline_to_orth_zenith(latitude, lst, hpx, hpy, hpz)
+    ):
+        np.testing.assert_allclose(values, baseline_values, atol=1e-12)
+
+
+def test_to_orth_zenith_matches_baseline(sphere_map):
+    hpx, hpy, hpz = healpix_vectors()
+    baseline = baseline_to_orth_zenith(
+        sphere_map.site.latitude, sphere_map.lst, hpx, hpy, hpz
+    )
+    orth = sphere_map.to_orth_zenith(hpx, hpy, hpz)
+    for values, baseline_values in zip(orth, baseline):
+        assert values.shape == hpx.shape
+        np.testing.assert_allclose(values, baseline_values, atol=1e-12)
+
+    # Other shapes (e.g. the corners of healpixels) are kept.
+    corners = hp.boundaries(4, np.arange(hp.nside2npix(4)))
+    x, y, z = sphere_map.to_orth_zenith(corners[:, 0], corners[:, 1], corners[:, 2])
+    assert x.shape == corners[:, 0].shape
+    baseline_x, _, _ = baseline_to_orth_zenith(
+        sphere_map.site.latitude,
+        sphere_map.lst,
+        corners[:, 0],
+        corners[:, 1],
+        corners[:, 2],
+    )
+    np.testing.assert_allclose(x, baseline_x, atol=1e-12)
+
+
+def test_horizon_coords_matches_baseline(sphere_map):
+    rng = np.random.default_rng(6)
+    ra = rng.uniform(0, 360, 1000)
+    decl = np.degrees(np.arcsin(rng.uniform(-1, 1, 1000)))
+    baseline = baseline_eq_to_horizon(sphere_map, ra, decl)
+
+    coords = sphere_map.horizon_coords(ra, decl)
+    for values, baseline_values in zip(coords, baseline):
+        np.testing.assert_allclose(values, baseline_values, atol=1e-9)
+
+    # The same, given radians and series, and into given arrays
+    out = tuple(np.empty(ra.shape) for _ in range(4))
+    coords = sphere_map.horizon_coords(
+        pd.Series(np.radians(ra)), pd.Series(np.radians(decl)), degrees=False, out=out
+    )
+    for values, out_values in zip(coords, out):
+        assert values is out_values
+    alt, az, x, y = coords
+    np.testing.assert_allclose(np.degrees(alt), baseline[0], atol=1e-9)
+    np.testing.assert_allclose(np.degrees(az), baseline[1], atol=1e-9)
+    np.testing.assert_allclose(x, baseline[2], atol=1e-9)
+    np.testing.assert_allclose(y, baseline[3], atol=1e-9)
+
+    # eq_to_horizon keeps its interface
+    x, y = sphere_map.eq_to_horizon(ra, decl)
+    np.testing.assert_allclose(x, baseline[2], atol=1e-9)
+    alt, az = sphere_map.eq_to_horizon(ra, decl, cart=False)
+    np.testing.assert_allclose(alt, baseline[0], atol=1e-9)
+
+
+def marker_data(num_markers=500, seed=15):
+    rng = np.random.default_rng(seed)
+    min_mjd = TEST_MJD - rng.uniform(-0.5, 7, num_markers)
+    return {
+        "ra": rng.uniform(0, 360, num_markers),
+        "decl": np.degrees(np.arcsin(rng.uniform(-1, 0.3, num_markers))),
+        "name": np.array([f"visit {i}" for i in range(num_markers)], dtype=object),
+        "glyph_size": rng.choice([5.0, 10.0, 15.0], num_markers),
+        "min_mjd": min_mjd,
+        "max_mjd": min_mjd + 30,
+        "group": rng.choice(list("ugrizy"), num_markers),
+    }
+
+
+def test_bin_markers_matches_loop():
+    data = marker_data()
+    nside = 4
+    binned = bin_markers(data, nside, TEST_MJD)
+
+    old = data["min_mjd"] < TEST_MJD
+    num_unbinned = np.count_nonzero(~old)
+    assert binned["count"].sum() == len(data["ra"])
+
+    # Markers that are not binned come first, unchanged.
+    for column, values in data.items():
+        np.testing.assert_array_equal(binned[column][:num_unbinned], values[~old])
+    assert np.all(binned["count"][:num_unbinned] == 1)
+
+    # Count the binned markers one by one.
+    hpids = hp.ang2pix(nside, data["ra"], data["decl"], lonlat=True)
+    expected = dict()
+    for i in np.flatnonzero(old):
+        key = (hpids[i], data["group"][i])
+        count, glyph_size, min_mjd, max_mjd = expected.get(
+            key, (0, 0.0, -np.inf, np.inf)
+        )
+        expected[key] = (
+            count + 1,
+            max(glyph_size, data["glyph_size"][i]),
+            max(min_mjd, data["min_mjd"][i]),
+            min(max_mjd, data["max_mjd"][i]),
+        )
+
+    bin_hpids = hp.ang2pix(
+        nside, binned["ra"][num_unbinned:], binned["decl"][num_unbinned:], lonlat=True
+    )
+    assert len(bin_hpids) == len(expected)
+    for i, hpid in enumerate(bin_hpids, start=num_unbinned):
+        count, glyph_size, min_mjd, max_mjd = expected[(hpid, binned["group"][i])]
+        assert binned["count"][i] == count
+        assert binned["name"][i] == f"{count} markers"
+        assert binned["glyph_size"][i] == pytest.approx(
+            glyph_size * np.sqrt(1 + np.log2(count))
+        )
+        assert binned["min_mjd"][i] == min_mjd
+        assert binned["max_mjd"][i] == max_mjd
+
+
+def test_bin_markers_without_mjd_bins_all():
+    data = marker_data()
+    del data["group"]
+    binned = bin_markers(data, 2)
+    assert len(binned["ra"]) <= hp.nside2npix(2)
+    assert binned["count"].sum() == len(data["ra"])
+
+
+def test_marker_lod_threshold(sphere_map):
+    data = marker_data()
+    columns = ("ra", "decl", "name", "glyph_size", "min_mjd", "max_mjd", "group")
+    kwargs = {column: data[column] for column in columns}
+    baseline = sphere_map.make_marker_data_source(**kwargs).data
+
+    # Below the threshold, the markers are the same as without a LOD.
+    lod = MarkerLOD(len(data["ra"]), 4, TEST_MJD)
+    unbinned = sphere_map.make_marker_data_source(lod=lod, **kwargs).data
+    assert set(unbinned) == set(baseline)
+    for column in baseline:
+        np.testing.assert_array_equal(unbinned[column], baseline[column])
+
+    lod = MarkerLOD(len(data["ra"]) - 1, 4, TEST_MJD)
+    binned = sphere_map.make_marker_data_source(lod=lod, **kwargs).data
+    assert len(binned["ra"]) < len(baseline["ra"])
+    assert np.sum(binned["count"]) == len(data["ra"])
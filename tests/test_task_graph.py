@@ -0,0 +1,103 @@
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+import pytest
+
+from plotting.task_graph import TaskError, TaskGraph
+
+TIMEOUT = 10
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(2)
+    yield executor
+    executor.shutdown(wait=True, cancel_futures=True)
+
+
+def test_tasks_get_dependency_results(executor):
+    graph = TaskGraph(executor)
+    graph.add("a", lambda: 2)
+    graph.add("b", lambda: 3)
+    graph.add("sum", lambda a, b: a + b, ("a", "b"))
+    product = graph.add("product", lambda a, total: a * total, ("a", "sum"))
+
+    assert product.future.result(TIMEOUT) == 10
+    assert graph.done
+    assert set(graph.timings) == {"a", "b", "sum", "product"}
+
+
+def test_tasks_wait_without_holding_threads(executor):
+    # If the second task waited for the first in the executor, it would take
+    # the other thread until the first finished, and the third could not run.
+    graph = TaskGraph(executor)
+    release = threading.Event()
+    first = graph.add("first", lambda: release.wait(TIMEOUT))
+    second = graph.add("second", lambda first: "second", ("first",))
+    other = graph.add("other", lambda: "other")
+
+    assert other.future.result(TIMEOUT) == "other"
+    assert not second.future.done()
+    release.set()
+    assert first.future.result(TIMEOUT)
+    assert second.future.result(TIMEOUT) == "second"
+
+
+def test_failure_propagates_to_dependents(executor):
+    graph = TaskGraph(executor, name="test")
+
+    def fail():
+        raise RuntimeError("no data")
+
+    graph.add("ok", lambda: 1)
+    failed = graph.add("failed", fail)
+    dependent = graph.add("dependent", lambda ok, failed: ok, ("ok", "failed"))
+    indirect = graph.add("indirect", lambda dependent: dependent, ("dependent",))
+
+    with pytest.raises(RuntimeError):
+        failed.future.result(TIMEOUT)
+    with pytest.raises(TaskError) as error:
+        dependent.future.result(TIMEOUT)
+    assert isinstance(error.value.__cause__, RuntimeError)
+    with pytest.raises(TaskError):
+        indirect.future.result(TIMEOUT)
+    assert graph.done
+    # Only tasks that ran have timings
+    assert set(graph.timings) == {"ok", "failed"}
+
+
+def test_cancel_propagates_to_dependents():
+    executor = ThreadPoolExecutor(1)
+    graph = TaskGraph(executor)
+    release = threading.Event()
+    running = graph.add("running", lambda: release.wait(TIMEOUT))
+    waiting = graph.add("waiting", lambda: "waiting")
+    dependent = graph.add("dependent", lambda waiting: waiting, ("waiting",))
+
+    graph.cancel()
+    release.set()
+    assert running.future.result(TIMEOUT)
+    with pytest.raises(CancelledError):
+        waiting.future.result(TIMEOUT)
+    with pytest.raises(CancelledError):
+        dependent.future.result(TIMEOUT)
+    assert graph.done
+    executor.shutdown()
+
+
+def test_add_checks_names(executor):
+    graph = TaskGraph(executor, name="test")
+    graph.add("a", lambda: 1)
+    with pytest.raises(ValueError):
+        graph.add("a", lambda: 2)
+    with pytest.raises(ValueError):
+        graph.add("b", lambda missing: 2, ("missing",))
+    assert set(graph.tasks) == {"a"}
+
+
+def test_dependency_finished_before_add(executor):
+    graph = TaskGraph(executor)
+    first = graph.add("first", lambda: 1)
+    assert first.future.result(TIMEOUT) == 1
+    second = graph.add("second", lambda first: first + 1, ("first",))
+    assert second.future.result(TIMEOUT) == 2